@@ -0,0 +1,31 @@
+"""shared fixtures."""
+import sqlite3
+
+import pytest
+
+from version import gallerydb
+
+
+@pytest.fixture
+def db_conn(tmp_path, monkeypatch):
+    """file backed db with all tables, set as the writer connection"""
+    conn = sqlite3.connect(str(tmp_path / 'test.db'), check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.isolation_level = None
+    conn.execute("PRAGMA foreign_keys = on")
+    conn.executescript(gallerydb.database.db.STRUCTURE_SCRIPT)
+    monkeypatch.setattr(gallerydb.database.db.DBBase, '_DB_CONN', conn)
+    monkeypatch.setattr(gallerydb.app_constants, 'GALLERY_LISTS', set())
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def make_gallery():
+    """returns a function making a gallery with the given attributes"""
+    def make(**attrs):
+        gallery = gallerydb.Gallery()
+        for name, value in attrs.items():
+            setattr(gallery, name, value)
+        return gallery
+    return make
@@ -57,3 +57,57 @@ def test_init_db(path_isfile_retval, check_dbv_retval, path_is_dbc_path):
             ])
         assert res == m_sl3.connect.return_value
         assert res.isolation_level is None
+
+
+def test_chunks():
+    """sequences and sets are split into lists of the given size"""
+    from version.database import db
+    assert list(db.chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(db.chunks(set(), 2)) == []
+    # a chunk of the largest size fits into one statement
+    import sqlite3
+    conn = sqlite3.connect(':memory:')
+    chunk = next(db.chunks(range(db.MAX_SQL_VARIABLES + 1), db.MAX_SQL_VARIABLES))
+    assert conn.execute('SELECT 1 WHERE 0 IN ({})'.format(','.join('?' * len(chunk))), chunk).fetchone() == (1,)
+    conn.close()
+
+
+def test_transaction(db_conn):
+    """changes are committed at the end or rolled back on errors, an active transaction is joined"""
+    from version import gallerydb
+    db = gallerydb.database.db
+    with db.DBBase.transaction():
+        db_conn.execute("INSERT INTO series(series_id, title) VALUES(1, 'a')")
+    with pytest.raises(ValueError):
+        with db.DBBase.transaction():
+            db_conn.execute("INSERT INTO series(series_id, title) VALUES(2, 'b')")
+            raise ValueError
+    db.DBBase.begin()
+    with db.DBBase.transaction():
+        db_conn.execute("INSERT INTO series(series_id, title) VALUES(3, 'c')")
+    assert db.DBBase._STATE['active']
+    db.DBBase.rollback()
+    assert [r[0] for r in db_conn.execute('SELECT series_id FROM series')] == [1]
+    assert not db.DBBase._STATE['active']
+
+
+def test_convert_hashes(tmp_path):
+    """hex digests of older DBs are stored as bytes, the newest hash of a page is kept"""
+    import sqlite3
+    from version.database import db
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(db.STRUCTURE_SCRIPT.replace('UNIQUE(series_id, chapter_id, page)',
+                                                   'UNIQUE(hash, series_id, chapter_id, page)'))
+    conn.executescript("""DROP INDEX idx_hashes_hash;
+        CREATE TABLE version(version REAL); INSERT INTO version VALUES(0.26);
+        INSERT INTO hashes(hash, series_id, chapter_id, page) VALUES('{}', 1, 1, 0), ('{}', 1, 1, 0),
+        ('{}', 1, 1, 1), ('not hex', 1, 1, 2);""".format('a' * 40, 'b' * 40, 'c' * 40))
+    conn.close()
+    db.add_db_revisions(path)
+    conn = sqlite3.connect(path)
+    assert conn.execute('SELECT page, hash FROM hashes ORDER BY page').fetchall() == [
+        (0, bytes.fromhex('b' * 40)), (1, bytes.fromhex('c' * 40))]
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name='idx_hashes_hash'").fetchone()
+    assert conn.execute('SELECT version FROM version').fetchone()[0] == db.db_constants.CURRENT_DB_VERSION
+    conn.close()
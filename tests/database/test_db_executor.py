@@ -0,0 +1,89 @@
+"""test db executor module."""
+import sqlite3
+import threading
+
+import pytest
+
+from version.database import db
+from version.database.db_executor import DBExecutor
+
+
+@pytest.fixture
+def db_conn(tmp_path):
+    """file backed db set as the writer connection"""
+    path = str(tmp_path / 'test.db')
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.isolation_level = None
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('CREATE TABLE t(x INTEGER)')
+    old_conn = db.DBBase._DB_CONN
+    db.DBBase._DB_CONN = conn
+    yield conn
+    db.DBBase._DB_CONN = old_conn
+    conn.close()
+
+
+def test_futures_per_call(db_conn):
+    """every call gets its own result"""
+    executor = DBExecutor(readers=2)
+    fs = [executor.submit(lambda n: n * 2, n) for n in range(20)]
+    assert [f.result() for f in fs] == [n * 2 for n in range(20)]
+
+
+def test_priority_order(db_conn):
+    """writer queue is processed by priority, then by submission order"""
+    executor = DBExecutor(readers=0)
+    executor.start()
+    gate = threading.Event()
+    order = []
+    executor.submit(gate.wait)
+    fs = [executor.submit(order.append, n, priority=p)
+          for n, p in enumerate([5, 1, 5, 0])]
+    gate.set()
+    [f.result() for f in fs]
+    assert order == [3, 1, 0, 2]
+
+
+def test_reads_use_reader_connection(db_conn):
+    """read calls run on a read-only connection to the same file"""
+    executor = DBExecutor(readers=2)
+    executor.submit(db.DBBase().execute, 'INSERT INTO t(x) VALUES(1)').result()
+
+    def read():
+        assert db.DBBase.reader_connection() is not None
+        return db.DBBase().execute('SELECT x FROM t').fetchall()[0]['x']
+
+    def write():
+        db.DBBase().execute('INSERT INTO t(x) VALUES(2)')
+
+    assert executor.submit(read, read=True).result() == 1
+    with pytest.raises(sqlite3.OperationalError):
+        executor.submit(write, read=True).result()
+
+
+def test_reads_fall_back_to_writer_for_memory_db():
+    """in-memory dbs can't be shared, so reads run on the writer thread"""
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    old_conn = db.DBBase._DB_CONN
+    db.DBBase._DB_CONN = conn
+    try:
+        executor = DBExecutor(readers=2)
+        f = executor.submit(db.DBBase.reader_connection, read=True)
+        assert f.result() is None
+    finally:
+        db.DBBase._DB_CONN = old_conn
+        conn.close()
+
+
+def test_submit_batch(db_conn):
+    """batch calls return futures in call order and accept named arguments"""
+    executor = DBExecutor(readers=3)
+
+    def add(a, b=0):
+        return a + b
+
+    fs = executor.submit_batch([[add, 1], [add, 2, {'b': 3}], [add, 4, 5]])
+    assert [f.result() for f in fs] == [1, 5, 9]
+    executor.join()
+    assert executor.idle()
@@ -0,0 +1,25 @@
+"""test loading the library on startup."""
+import pytest
+from PyQt5.QtCore import QSortFilterProxyModel, Qt
+from PyQt5.QtGui import QStandardItem, QStandardItemModel
+
+from version.gallerydb import DatabaseStartup
+
+
+@pytest.mark.parametrize('sort', ['title', 'artist'])
+def test_first_screen_order(db_conn, sort):
+    """the first galleries loaded are the ones at the top of a view sorted case insensitively"""
+    names = ['b', 'A', 'c', 'B2', 'a2', 'C1', 'a']
+    db_conn.executemany('INSERT INTO series(series_id, {}) VALUES(?, ?)'.format(sort), enumerate(names, 1))
+    # sorted case insensitively like gallery.SortFilterModel, without its locale which is C here
+    model = QStandardItemModel()
+    for name in names:
+        model.appendRow(QStandardItem(name))
+    view = QSortFilterProxyModel()
+    view.setSourceModel(model)
+    view.setSortCaseSensitivity(Qt.CaseInsensitive)
+    view.sort(0, Qt.AscendingOrder)
+    top = [view.index(row, 0).data() for row in range(4)]
+
+    rows = DatabaseStartup._fetch_first_series_rows(DatabaseStartup(), DatabaseStartup._SORT_ORDER[sort], 4)
+    assert [r[sort] for r in rows] == top
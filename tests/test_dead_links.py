@@ -0,0 +1,53 @@
+"""test dead links module."""
+import os
+
+from version import dead_links
+from version.dead_links import DeadLinkChecker
+from version import gallerydb
+
+
+def test_check_dead_links(tmp_path, monkeypatch, make_gallery):
+    """each directory is listed once, and only galleries whose state changed are returned"""
+    listed = []
+    scandir = os.scandir
+    def counting_scandir(path):
+        listed.append(path)
+        return scandir(path)
+    monkeypatch.setattr(dead_links.os, 'scandir', counting_scandir)
+    DeadLinkChecker.invalidate()
+
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b.zip').write_bytes(b'')
+    (tmp_path / 'c').mkdir()
+    galleries = [make_gallery(path=str(tmp_path / name)) for name in ('a', 'b.zip', 'c', 'gone')]
+    galleries[2].dead_link = True
+    batches = []
+    changed = DeadLinkChecker.check(galleries, batches.append, batch=3)
+    assert changed == [galleries[2], galleries[3]]
+    assert batches == [[galleries[2]], [galleries[3]]]
+    assert [g.dead_link for g in galleries] == [False, False, False, True]
+    assert listed == [str(tmp_path)]
+
+    # created after listing is still found, removed is trusted until the listing expires
+    (tmp_path / 'gone').mkdir()
+    (tmp_path / 'a').rmdir()
+    assert DeadLinkChecker.check(galleries) == [galleries[3]]
+    DeadLinkChecker.invalidate(str(tmp_path))
+    assert DeadLinkChecker.check(galleries) == [galleries[0]]
+    assert galleries[0].dead_link
+
+
+def test_moved_gallery_is_dead(tmp_path, make_gallery):
+    """moving a gallery forgets the listing of the directory it was in"""
+    # the checker gallerydb invalidates
+    checker = gallerydb.dead_links.DeadLinkChecker
+    checker.invalidate()
+    (tmp_path / 'src' / 'g').mkdir(parents=True)
+    (tmp_path / 'dst').mkdir()
+    gallery = make_gallery(path=str(tmp_path / 'src' / 'g'))
+    stale = make_gallery(path=str(tmp_path / 'src' / 'g'))
+    assert checker.check([gallery, stale]) == []
+
+    gallery.move_gallery(str(tmp_path / 'dst'))
+    assert gallery.path == str(tmp_path / 'dst' / 'g')
+    assert checker.check([gallery, stale]) == [stale]
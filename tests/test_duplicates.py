@@ -0,0 +1,30 @@
+"""test duplicates module."""
+from version.duplicates import duplicate_groups, group_pairs
+
+
+def test_duplicate_groups(make_gallery):
+    """galleries with the same title, path or a page in common end up in one group"""
+    galleries = [
+        make_gallery(title='Summer ', path='/a'),
+        make_gallery(title='summer', path='/b', hashes=['1', '2']),
+        make_gallery(title='Other', path='/c', hashes=['2', '4']),
+        make_gallery(title='Winter', path='/d'),
+        make_gallery(title='Autumn', path='/e', hashes=['3']),
+        make_gallery(title='Spring', path='/e'),
+    ]
+    progress = []
+    groups = duplicate_groups(galleries, lambda n, total: progress.append(n), batch=4)
+    assert sorted(sorted(g.path for g in group) for group in groups) == [['/a', '/b', '/c'], ['/e', '/e']]
+    assert progress == [4, 6]
+
+
+def test_common_pages(make_gallery):
+    """a page found in too many galleries doesn't make them duplicates"""
+    galleries = [make_gallery(title=str(n), path='/' + str(n), hashes=['blank', str(n)]) for n in range(3)]
+    assert duplicate_groups(galleries, max_shared=3)
+    assert duplicate_groups(galleries, max_shared=2) == []
+
+
+def test_group_pairs():
+    """pairs sharing an item are merged"""
+    assert sorted(sorted(g) for g in group_pairs([(1, 2), (3, 4), (2, 5)])) == [[1, 2, 5], [3, 4]]
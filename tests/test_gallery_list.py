@@ -0,0 +1,75 @@
+"""test gallery lists."""
+from version.gallerydb import GalleryDB, GalleryList, ListDB
+from version import gallerydb
+
+
+def test_list_membership(db_conn, make_gallery):
+    """galleries are members by id, a newer copy of a gallery replaces the old one"""
+    g_list = GalleryList('l', _db=False)
+    galleries = [make_gallery(id=n) for n in range(1, 4)]
+    g_list.add_gallery(galleries[:2], False, _check_filter=False)
+    copy = make_gallery(id=2)
+    g_list.add_gallery(copy, False, _check_filter=False)
+    assert galleries[0] in g_list and copy in g_list and galleries[2] not in g_list
+    assert sorted(g.id for g in g_list.galleries()) == [1, 2]
+    assert any(g is copy for g in g_list.galleries())
+
+    g_list.remove_gallery([2, 3])
+    assert [g.id for g in g_list.galleries()] == [1]
+    assert galleries[1] not in g_list
+
+
+def test_query_all_galleries(db_conn):
+    """the whole library is mapped to its lists with one query"""
+    for n in range(1, 5):
+        db_conn.execute("INSERT INTO series(series_id, title, series_path, profile) VALUES(?, 't', ?, ?)",
+                        (n, '/{}'.format(n).encode(), b''))
+    db_conn.execute("INSERT INTO list(list_id, list_name) VALUES(1, 'a')")
+    db_conn.execute("INSERT INTO list(list_id, list_name) VALUES(2, 'b')")
+    db_conn.executemany("INSERT INTO series_list_map(list_id, series_id) VALUES(?, ?)",
+                        [(1, 1), (1, 3), (2, 3), (2, 4)])
+    lists = {l._id: l for l in ListDB.init_lists()}
+    galleries = GalleryDB.gen_galleries(db_conn.execute('SELECT * FROM series WHERE series_id < 4').fetchall(),
+                                        chapters=False, tags=False, hashes=False, check_links=False, lists=False)
+    assert not lists[1].galleries()
+
+    ListDB.query_all_galleries(galleries)
+    assert sorted(g.id for g in lists[1].galleries()) == [1, 3]
+    # gallery 4 isn't loaded
+    assert [g.id for g in lists[2].galleries()] == [3]
+
+
+def test_update_enforced(db_conn, monkeypatch, make_gallery):
+    """only changed galleries are checked against the filters of enforced lists, ids of unloaded ones are skipped"""
+    monkeypatch.setattr(gallerydb, 'execute', lambda method, no_return, *args, **kwargs: None)
+    galleries = [make_gallery(id=n, tags={'default': [tag]})
+                 for n, tag in enumerate(['summer', 'summer', 'winter', 'winter'], 1)]
+    monkeypatch.setattr(gallerydb.app_constants, 'GALLERY_DATA', galleries)
+    monkeypatch.setattr(GalleryList, '_loaded', {})
+    GalleryList.track(galleries[:3])
+    g_list = GalleryList('l', filter='summer', _db=False)
+    g_list.enforce = True
+    gallerydb.app_constants.GALLERY_LISTS.add(g_list)
+    g_list.scan()
+    assert sorted(g.id for g in g_list.galleries()) == [1, 2]
+
+    checked = []
+    matches = g_list.matches
+    def counting_matches(gallery):
+        checked.append(gallery.id)
+        return matches(gallery)
+    monkeypatch.setattr(g_list, 'matches', counting_matches)
+    galleries[0].tags = {'default': ['autumn']}
+    galleries[2].tags = {'default': ['summer']}
+    galleries[3].tags = {'default': ['summer']}
+    GalleryList.update_enforced([1, 3, 4, 99])
+    assert sorted(g.id for g in g_list.galleries()) == [2, 3]
+    assert set(checked) == {1, 3}
+
+    # added galleries are passed as they are
+    GalleryList.update_enforced([galleries[3]])
+    assert sorted(g.id for g in g_list.galleries()) == [2, 3, 4]
+
+    GalleryList.forget([2])
+    assert sorted(g.id for g in g_list.galleries()) == [3, 4]
+    assert 2 not in GalleryList._loaded
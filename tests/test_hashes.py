@@ -0,0 +1,18 @@
+"""test page hashes."""
+from version.gallerydb import HashDB
+
+
+def test_shared_pages(db_conn):
+    """pages with the same hash are found across galleries, not within one"""
+    for g_id in (1, 2, 3):
+        db_conn.execute("INSERT INTO series(series_id, title) VALUES(?, 'a')", (g_id,))
+        db_conn.execute("INSERT INTO chapters(chapter_id, series_id, chapter_number, pages) VALUES(?, ?, 0, 3)",
+                        (g_id, g_id))
+    HashDB.add_hashes([('a' * 40, 1, 1, 0), ('b' * 40, 1, 1, 1), ('b' * 40, 1, 1, 2),
+                       ('a' * 40, 2, 2, 0), ('b' * 40, 2, 2, 1), ('c' * 40, 3, 3, 0), ('a' * 40, 3, 3, 1)])
+    assert HashDB.get_sharing_galleries(1) == [(2, 2), (3, 1)]
+    assert HashDB.get_sharing_galleries(3) == [(1, 1), (2, 1)]
+    assert HashDB.get_shared_pages() == {
+        'a' * 40: [(1, 0, 0), (2, 0, 0), (3, 0, 1)],
+        'b' * 40: [(1, 0, 1), (1, 0, 2), (2, 0, 1)]}
+    assert list(HashDB.get_shared_pages(3)) == ['a' * 40]
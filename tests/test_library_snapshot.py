@@ -0,0 +1,48 @@
+"""test startup snapshots of the library."""
+import pytest
+
+from version.gallerydb import ChapterDB, GalleryDB, LibrarySnapshot, TagDB
+from version import gallerydb
+
+
+@pytest.fixture(autouse=True)
+def no_saved_snapshot(monkeypatch):
+    monkeypatch.setattr(LibrarySnapshot, '_saved_count', None)
+
+
+def add_gallery(db_conn):
+    db_conn.execute("INSERT INTO series(series_id, title, series_path, profile, view) VALUES(1, 'a', ?, ?, 1)",
+                    (b'/a.zip', b''))
+    gallery = GalleryDB.gen_galleries(db_conn.execute('SELECT * FROM series').fetchall(),
+                                      chapters=False, tags=False, hashes=False)[0]
+    chap = gallery.chapters.create_chapter(0)
+    chap.path = '/a.zip'
+    chap.pages = 3
+    gallery.tags = {'default': ['tag']}
+    ChapterDB.add_chapters_for_galleries([gallery])
+    TagDB.add_tags_for_galleries([gallery])
+    return gallery
+
+
+def test_snapshot_roundtrip(db_conn):
+    """a snapshot is loaded until the galleries in DB change"""
+    gallery = add_gallery(db_conn)
+    assert LibrarySnapshot.load() is None
+
+    LibrarySnapshot.save([gallery])
+    loaded = LibrarySnapshot.load()[0]
+    assert (loaded.id, loaded.title, loaded.path, loaded.file_type, loaded.tags, loaded.date_added) == \
+        (1, 'a', '/a.zip', 'zip', {'default': ['tag']}, gallery.date_added)
+    assert [(c.number, c.path, c.pages) for c in loaded.chapters] == [(0, '/a.zip', 3)]
+
+    db_conn.execute("UPDATE series SET title='b'")
+    assert LibrarySnapshot.load() is None
+
+
+def test_snapshot_view_from_db(db_conn, make_gallery):
+    """the view is the one in DB, not the one set by the duplicate check, galleries not in DB are left out"""
+    gallery = add_gallery(db_conn)
+    gallery.view = gallerydb.app_constants.ViewType.Duplicate
+    LibrarySnapshot.save([gallery, make_gallery(id=2)])
+    loaded = LibrarySnapshot.load()
+    assert [(g.id, g.view) for g in loaded] == [(1, gallerydb.app_constants.ViewType.Default)]
@@ -0,0 +1,89 @@
+"""test page manifests of chapters."""
+from version.gallerydb import HashDB, PageDB
+from version import gallerydb
+from version.utils import Manifest, PageInfo
+
+
+def test_manifest_roundtrip(db_conn):
+    """a saved manifest is valid until the chapter's modification time changes"""
+    db_conn.execute("INSERT INTO series(series_id, title) VALUES(1, 'a')")
+    db_conn.execute("INSERT INTO chapters(chapter_id, series_id, chapter_number, pages) VALUES(5, 1, 0, 2)")
+    manifest = Manifest(10, [PageInfo('01.png', 100, 60, 80), PageInfo('02.png', 200, None, None)])
+    PageDB.save_manifest(1, 0, manifest)
+    assert PageDB.get_manifest(1, 0, 10) == manifest
+    assert PageDB.get_manifest(1, 0, 11) is None
+    assert PageDB.get_manifest(1, 1, 10) is None
+
+    PageDB.save_manifests([(5, Manifest(11, manifest.pages[:1]))])
+    assert PageDB.get_manifest(1, 0, 11).pages == manifest.pages[:1]
+    db_conn.execute('DELETE FROM chapters WHERE chapter_id=5')
+    assert db_conn.execute('SELECT count(*) FROM pages').fetchone()[0] == 0
+
+
+def test_gallery_img_without_manifest(db_conn, tmp_path, monkeypatch, make_gallery):
+    """the first page is taken from a saved manifest, without one the chapter is listed instead of read"""
+    monkeypatch.setattr(gallerydb, 'execute', lambda method, no_return, *args, read=False, priority=None, **kwargs:
+                        method(*args, **kwargs))
+    monkeypatch.setattr(gallerydb.utils, 'ARCHIVE_FILES', ('.zip',), raising=False)
+    monkeypatch.setattr(gallerydb.utils, 'IMG_FILES', ('.png',), raising=False)
+    # not next to the DB, whose journal changes the modification time of its folder
+    folder = tmp_path / 'chapter'
+    folder.mkdir()
+    for name in ('02.png', '01.png'):
+        (folder / name).write_bytes(name.encode())
+    db_conn.execute("INSERT INTO series(series_id, title) VALUES(1, 'a')")
+    db_conn.execute("INSERT INTO chapters(chapter_id, series_id, chapter_number, pages) VALUES(5, 1, 0, 2)")
+    gallery = make_gallery(id=1, path=str(folder))
+    chap = gallery.chapters.create_chapter(0)
+    chap.path = str(folder)
+    chap.pages = 2
+
+    def read_manifest(chapter):
+        raise AssertionError('pages were read')
+    with monkeypatch.context() as m:
+        m.setattr(gallerydb.utils, 'read_manifest', read_manifest)
+        assert gallerydb.utils.get_gallery_img(gallery) == str(folder / '01.png')
+        assert chap.get_manifest(saved_only=True) is None
+
+    mtime = gallerydb.utils.chapter_mtime(chap)
+    PageDB.save_manifest(1, 0, Manifest(mtime, [PageInfo('02.png', 6, None, None)]))
+    assert gallerydb.utils.get_gallery_img(gallery) == str(folder / '02.png')
+
+
+def test_unhashed_chapters(db_conn):
+    """chapters are picked up until all their pages, or the first max_pages, have hashes"""
+    db_conn.execute("INSERT INTO series(series_id, title) VALUES(1, 'a')")
+    db_conn.execute("INSERT INTO chapters(chapter_id, series_id, chapter_number, pages) VALUES(5, 1, 0, 3)")
+    assert HashDB.get_unhashed_chapters() == [(1, 0, 3)]
+    HashDB.add_hashes([('a' * 40, 1, 5, 0), ('b' * 40, 1, 5, 1)])
+    assert HashDB.get_unhashed_chapters(max_pages=2) == []
+    assert HashDB.get_unhashed_chapters() == [(1, 0, 3)]
+    assert HashDB.get_chapter_hashes(1, 0) == (5, {0: 'a' * 40, 1: 'b' * 40})
+
+
+def test_page_count_from_manifest(db_conn, tmp_path, monkeypatch, make_gallery):
+    """a chapter whose page count is off is hashed by its manifest and gets the right count"""
+    monkeypatch.setattr(gallerydb, 'execute', lambda method, no_return, *args, read=False, priority=None, **kwargs:
+                        method(*args, **kwargs))
+    monkeypatch.setattr(gallerydb.utils, 'ARCHIVE_FILES', ('.zip',), raising=False)
+    monkeypatch.setattr(gallerydb.utils, 'IMG_FILES', ('.png',), raising=False)
+    for n in range(3):
+        (tmp_path / '0{}.png'.format(n)).write_bytes(b'page %d' % n)
+    db_conn.execute("INSERT INTO series(series_id, title) VALUES(1, 'a')")
+    db_conn.execute("INSERT INTO chapters(chapter_id, series_id, chapter_number, pages) VALUES(5, 1, 0, 5)")
+    gallery = make_gallery(id=1)
+    chap = gallery.chapters.create_chapter(0)
+    chap.path = str(tmp_path)
+    chap.pages = 5
+
+    mid = HashDB.gen_gallery_hash(gallery, 0, 'mid')['mid']
+    assert mid == HashDB.get_chapter_hashes(1, 0)[1][1]
+    assert chap.pages == 3
+    assert db_conn.execute('SELECT pages FROM chapters WHERE chapter_id=5').fetchone()[0] == 3
+    # the saved hash is found without reading the pages again
+    with monkeypatch.context() as m:
+        m.setattr(type(chap), 'get_manifest', None)
+        assert HashDB.gen_gallery_hash(gallery, 0, 'mid') == {'mid': mid}
+
+    HashDB.gen_gallery_hash(gallery, 0)
+    assert HashDB.get_unhashed_chapters() == []
@@ -0,0 +1,53 @@
+"""test phash index module."""
+import io
+import random
+
+from PIL import Image, ImageDraw
+
+from version.phash_index import BKTree, PHashIndex, dhash, distance
+
+
+def make_page(seed, size=(600, 800), fmt='PNG', quality=95):
+    rnd = random.Random(seed)
+    im = Image.new('RGB', (600, 800), 'white')
+    draw = ImageDraw.Draw(im)
+    for _ in range(12):
+        x, y = rnd.randrange(500), rnd.randrange(700)
+        draw.rectangle([x, y, x + rnd.randrange(20, 200), y + rnd.randrange(20, 200)],
+                       fill=tuple(rnd.randrange(256) for _ in range(3)))
+    im = im.resize(size)
+    b = io.BytesIO()
+    im.save(b, fmt, quality=quality)
+    return b.getvalue()
+
+
+def test_dhash_near_copies():
+    """resized and re-encoded copies of a page are close, other pages aren't"""
+    page = dhash(make_page(1))
+    assert distance(page, dhash(make_page(1, (300, 400), 'JPEG', 60))) <= 8
+    assert distance(page, dhash(make_page(2))) > 8
+
+
+def test_bktree_search():
+    """the tree finds the same hashes as comparing every hash"""
+    rnd = random.Random(0)
+    hashes = [rnd.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for n, h in enumerate(hashes):
+        tree.add(h, n)
+    for h in hashes[:20] + [h ^ 0b1011 for h in hashes[20:40]]:
+        expected = {n for n, other in enumerate(hashes) if distance(h, other) <= 6}
+        assert tree.search(h, 6) == expected
+
+
+def test_similar_galleries():
+    """galleries sharing most pages are similar, a shared page alone isn't enough"""
+    rnd = random.Random(1)
+    pages = [rnd.getrandbits(64) for _ in range(30)]
+    index = PHashIndex(max_distance=4)
+    index.add(1, pages[:10])
+    index.add(2, [h ^ 0b11 for h in pages[1:10]])
+    index.add(3, pages[9:20])
+    index.add(4, [0] * 5)
+    assert index.similar(1) == [2]
+    assert index.duplicates() == [(1, 2)]
@@ -0,0 +1,36 @@
+"""test scan state of monitored folders."""
+import os
+
+from version.gallerydb import ScanStateDB
+
+
+def test_compare():
+    """entries are new, changed, removed or moved"""
+    old = {'a': (1, 10, 5), 'b': (2, 10, 5), 'c': (3, 10, 5), 'd': (None, 10, 5)}
+    new = {'a': (1, 10, 5), 'b': (2, 11, 5), 'c2': (3, 10, 5), 'e': (4, 10, 5)}
+    changed, removed, moved = ScanStateDB.compare(old, new)
+    assert sorted(changed) == ['b', 'c2', 'e']
+    assert removed == ['d']
+    assert moved == [('c', 'c2')]
+
+
+def test_snapshot_roundtrip(tmp_path, db_conn):
+    """a saved snapshot compares as unchanged until an entry changes"""
+    root = tmp_path / 'galleries'
+    root.mkdir()
+    (root / 'one').mkdir()
+    (root / 'two.zip').write_bytes(b'0')
+    entries = ScanStateDB.snapshot(str(root))
+    assert sorted(entries) == sorted(str(root / n) for n in ('one', 'two.zip'))
+    ScanStateDB.save_snapshot({str(root): entries})
+    assert ScanStateDB.compare(ScanStateDB.get_snapshot([str(root)]), ScanStateDB.snapshot(str(root))) == ([], [], [])
+
+    os.rename(str(root / 'one'), str(root / 'three'))
+    (root / 'two.zip').write_bytes(b'01')
+    changed, removed, moved = ScanStateDB.compare(ScanStateDB.get_snapshot([str(root)]), ScanStateDB.snapshot(str(root)))
+    assert sorted(changed) == sorted(str(root / n) for n in ('three', 'two.zip'))
+    assert removed == []
+    assert moved == [(str(root / 'one'), str(root / 'three'))]
+    ScanStateDB.save_snapshot({str(root): {str(root / 'three'): ScanStateDB.snapshot(str(root))[str(root / 'three')]}},
+                              [str(root / 'one')])
+    assert sorted(ScanStateDB.get_snapshot([str(root)])) == sorted(str(root / n) for n in ('three', 'two.zip'))
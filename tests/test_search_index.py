@@ -0,0 +1,60 @@
+"""test search index module."""
+import pytest
+
+from version.search_index import SearchIndex
+
+
+@pytest.fixture
+def galleries(make_gallery):
+    return [
+        make_gallery(id=1, title='Big Sister Summer', artist='Alpha', language='English',
+                     tags={'Female': ['glasses'], 'default': ['school']}),
+        make_gallery(id=2, title='Summer School', artist='Beta', language='Japanese',
+                     tags={'Female': ['twintails'], 'Male': ['glasses']}),
+        make_gallery(id=3, title='Quiet Days', artist='Alphabet', language='English'),
+    ]
+
+
+@pytest.mark.parametrize('terms', [
+    ['summer'], ['SUM'], ['-summer'], ['summer', '-glasses'], ['big sis'],
+    ['female:glasses'], ['male:glass'], ['artist:alpha'], ['lang:eng'],
+    ['title:school'], [':twin'], ['tag:none'], ['chapters:>0'], ['nothing'],
+])
+def test_search_matches_contains(galleries, terms):
+    """the index finds the same galleries as checking each gallery"""
+    index = SearchIndex(galleries)
+    expected = {g for g in galleries if all(g.contains(t) for t in terms)}
+    found = index.search(terms)
+    assert (set(galleries) if found is None else found) == expected
+
+
+def test_incremental_updates(galleries):
+    """added, removed and invalidated galleries are reflected in searches"""
+    index = SearchIndex(galleries[:2])
+    assert index.search(['quiet']) == set()
+    index.add(galleries[2:])
+    assert index.search(['quiet']) == {galleries[2]}
+    index.remove(galleries[:1])
+    assert index.search(['summer']) == {galleries[1]}
+    galleries[1].title = 'Winter'
+    SearchIndex.invalidate(galleries[1].id)
+    assert index.search(['summer']) == set()
+    assert index.search(['winter']) == {galleries[1]}
+
+
+def test_version_and_cancel(galleries):
+    """the version changes with the indexed galleries, a cancelled search stops before the next term"""
+    index = SearchIndex(galleries[:2])
+    version = index.version()
+    assert index.version() == version
+    index.add(galleries[2:])
+    assert index.version() != version
+    version = index.version()
+    SearchIndex.invalidate(galleries[0].id)
+    assert index.version() != version
+
+    checked = []
+    def cancelled():
+        checked.append(True)
+        return len(checked) > 1
+    assert index.search(['summer', 'school'], cancelled=cancelled) == {galleries[0], galleries[1]}
@@ -0,0 +1,84 @@
+"""test search query module."""
+import datetime
+
+import pytest
+
+from version import gallerydb
+from version.search_query import compile_query, compile_term, refines
+
+Search = gallerydb.app_constants.Search
+
+
+@pytest.fixture
+def galleries(make_gallery):
+    return [
+        make_gallery(id=1, title='Big Sister Summer', artist='Alpha', tags={'Female': ['glasses']},
+                     date_added=datetime.datetime(2020, 6, 15), pub_date=datetime.datetime(2019, 3, 2), rating=4),
+        make_gallery(id=2, title='summer school', artist='Beta', tags={'Male': ['Glasses']},
+                     date_added=datetime.datetime(2021, 2, 1)),
+        make_gallery(id=3, title='Quiet Days', date_added=datetime.datetime(2020, 1, 1), rating=2),
+    ]
+
+
+@pytest.mark.parametrize('terms, args, expected', [
+    (['summer'], [], [1, 2]),
+    (['Summer'], [Search.Case], [1]),
+    (['summer school'], [Search.Strict], [2]),
+    (['-summer'], [], [3]),
+    (['glasses'], [Search.Case], [1, 2]),
+    (['female:GLASSES'], [], [1]),
+    (['artist:alpha'], [Search.Case], [1]),
+    (['artist:none'], [], [3]),
+    (['date_added:>1/3/2020'], [], [1, 2]),
+    (['date_added:15/6/2020'], [], [1]),
+    (['pub_date:<2020'], [], [1]),
+    (['pub_date:none'], [], [2, 3]),
+    (['rating:>3'], [], [1]),
+    (['rating:x'], [], []),
+    (['^s.m+er'], [Search.Regex], [2]),
+    (['^s.m+er'], [Search.Regex, Search.Case], [2]),
+    (['fem.*:gla'], [Search.Regex], [1]),
+    (['[unclosed'], [Search.Regex], []),
+    (['summer', '-male:glasses'], [], [1]),
+])
+def test_query(galleries, terms, args, expected):
+    """compiled terms match the galleries Gallery.contains is documented to match"""
+    query = compile_query(terms, args)
+    assert [g.id for g in galleries if query(g)] == expected
+
+
+def test_terms_are_cached():
+    """the same term and args are only compiled once"""
+    assert compile_term('rating:>3', [Search.Case]) is compile_term('rating:>3', (Search.Case,))
+    assert compile_term('rating:>3') is not compile_term('rating:>3', [Search.Case])
+
+
+@pytest.mark.parametrize('terms, old_terms, args, expected', [
+    (['summer'], ['summe'], [], True),
+    (['Summer'], ['summe'], [], True),
+    (['Summer'], ['summe'], [Search.Case], False),
+    (['summe', 'big'], ['summe'], [], True),
+    (['summe'], ['summe', 'big'], [], False),
+    (['female:glasses'], ['female:glass'], [], True),
+    (['male:glasses'], ['female:glass'], [], False),
+    (['summer:'], ['summer'], [], False),
+    (['artist:none'], ['artist:non'], [], False),
+    (['rating:30'], ['rating:3'], [], False),
+    (['-summer'], ['-summe'], [], False),
+    (['-summe'], ['-summe'], [], True),
+    (['summer'], ['summe'], [Search.Regex], False),
+    (['summer'], ['summe'], [Search.Strict], False),
+])
+def test_refines(terms, old_terms, args, expected):
+    """only extending or adding terms narrows down a search"""
+    assert refines(terms, old_terms, args) == expected
+
+
+@pytest.mark.parametrize('terms, old_terms', [
+    (['summer'], ['summe']), (['female:glasses'], ['female:glas']), (['summer', 'artist:al'], ['sum']),
+])
+def test_refinement_is_subset(galleries, terms, old_terms):
+    """galleries matching a refined search also match the search it refines"""
+    assert refines(terms, old_terms)
+    query, old_query = compile_query(terms), compile_query(old_terms)
+    assert {g.id for g in galleries if query(g)} <= {g.id for g in galleries if old_query(g)}
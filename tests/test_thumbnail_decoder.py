@@ -0,0 +1,20 @@
+"""test thumbnail decoder module."""
+from PIL import Image
+
+from version.thumbnail_decoder import decode_thumbnail
+
+
+def test_decode_thumbnail(tmp_path):
+    """images are shrunk to fit the size and returned as rgba bytes"""
+    path = str(tmp_path / 'page.jpg')
+    Image.new('RGB', (1000, 2000), 'red').save(path)
+    width, height, data = decode_thumbnail(path, 100, 100)
+    assert (width, height) == (50, 100)
+    assert len(data) == width * height * 4
+
+
+def test_decode_thumbnail_small_image(tmp_path):
+    """images smaller than the size are left as they are"""
+    path = str(tmp_path / 'page.png')
+    Image.new('P', (20, 10)).save(path)
+    assert decode_thumbnail(path, 100, 100)[:2] == (20, 10)
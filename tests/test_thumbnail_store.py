@@ -0,0 +1,42 @@
+"""test thumbnail store module."""
+import os
+
+import pytest
+
+from version.thumbnail_store import ThumbnailStore
+from version import thumbnail_store
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnail_store.db_constants, 'THUMBNAIL_PATH', str(tmp_path))
+    return tmp_path
+
+
+def add_entry(fingerprint, mtime, size=1024 * 1024):
+    path = ThumbnailStore.entry_path(fingerprint * 40, 10, 20)
+    with open(path, 'wb') as f:
+        f.write(b'0' * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_lookup_and_is_entry(store_dir):
+    """entries are found by fingerprint and size only"""
+    path = add_entry('a', 1)
+    assert ThumbnailStore.is_entry(path)
+    assert ThumbnailStore.lookup('a' * 40, 10, 20) == path
+    assert os.path.getmtime(path) > 1
+    assert ThumbnailStore.lookup('a' * 40, 20, 20) is None
+    assert not ThumbnailStore.is_entry(str(store_dir / 'legacy.png'))
+
+
+def test_collect_garbage(store_dir):
+    """used files are kept, unused entries are evicted least recently used first"""
+    used = add_entry('a', 1)
+    old = add_entry('b', 2)
+    new = add_entry('c', 3)
+    legacy = store_dir / 'legacy.png'
+    legacy.write_bytes(b'0')
+    assert ThumbnailStore.collect_garbage([used], max_size=1) == 2
+    assert sorted(os.listdir(str(store_dir))) == sorted(os.path.basename(p) for p in (used, new))
@@ -1,10 +1,14 @@
 """test utils module."""
 from unittest import mock
 from itertools import product
+import zipfile
 
+import py7zr
 import pytest
 
-from version.utils import backup_database
+from version import utils
+from version.utils import backup_database, ArchiveFile, ArchiveIndex, verify_archive
+from version.gallerydb import Chapter
 
 
 @pytest.mark.parametrize(
@@ -62,3 +66,119 @@ def test_run_backup_database(mock_exists_retval, mock_isdir_retval):
         else:
             mock_os.mkdir.assert_called_once_with(mock_os.path.join.return_value)
         mock_os.assert_has_calls(os_calls, any_order=True)
+
+
+@pytest.fixture
+def archive_types(monkeypatch):
+    monkeypatch.setattr(utils, 'ZIP_FILES', ('.zip',), raising=False)
+    monkeypatch.setattr(utils, 'SEVENZIP_FILES', ('.7z',), raising=False)
+    monkeypatch.setattr(utils, 'ARCHIVE_FILES', ('.zip', '.7z'), raising=False)
+    monkeypatch.setattr(utils, 'SUPPORT_RAR', False, raising=False)
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_archive_read(tmp_path, archive_types, compression):
+    """archive members are read without extracting them"""
+    path = str(tmp_path / 'gallery.zip')
+    with zipfile.ZipFile(path, 'w', compression) as z:
+        z.writestr('a/', '')
+        z.writestr('a/01.png', b'first' * 100)
+        z.writestr('a/02.png', b'second')
+    with ArchiveFile(path) as arc:
+        assert bytes(arc.read('a/01.png')) == b'first' * 100
+        contents = arc.read_many(['a/01.png', 'a/02.png'])
+        assert {k: bytes(v) for k, v in contents.items()} == {'a/01.png': b'first' * 100, 'a/02.png': b'second'}
+        del contents
+    assert not list(tmp_path.glob('**/*.png'))
+
+
+
+@pytest.mark.parametrize('source', ['zip', '7z'])
+def test_archive_read_each(tmp_path, archive_types, source):
+    """each file is passed on once it's read and not kept afterwards"""
+    files = {'01.png': b'first' * 100, '02.png': b'second', '03.png': b'third'}
+    path = str(tmp_path / ('gallery.' + source))
+    if source == 'zip':
+        with zipfile.ZipFile(path, 'w') as z:
+            for name, data in files.items():
+                z.writestr(name, data)
+    else:
+        with py7zr.SevenZipFile(path, 'w') as z:
+            for name, data in files.items():
+                z.writestr(data, name)
+    read = []
+    with ArchiveFile(path) as arc:
+        arc.read_each(['02.png', '01.png'], lambda name, data: read.append((name, data)))
+        assert sorted(read) == [('01.png', files['01.png']), ('02.png', files['02.png'])]
+        if source == '7z':
+            with pytest.raises(utils.app_constants.FileNotFoundInArchive):
+                arc.read_each(['04.png'], lambda name, data: None)
+
+def test_archive_index(tmp_path, archive_types):
+    """the directory tree is built once per archive version and shared"""
+    path = str(tmp_path / 'gallery.zip')
+    with zipfile.ZipFile(path, 'w') as z:
+        for name in ('a/', 'a/01.png', 'a/b/', 'a/b/01.png', 'ab/', 'ab/01.png', 'info.txt'):
+            z.writestr(name, '')
+    with ArchiveFile(path) as arc:
+        index = arc.index
+        assert arc.dir_contents('') == ['a/', 'ab/', 'info.txt']
+        assert arc.dir_contents('a/') == ['a/01.png', 'a/b/']
+        assert arc.dir_list() == ['a/', 'a/b/', 'ab/']
+        assert arc.dir_list(True) == ['a/', 'ab/']
+        assert arc.is_dir('a/b/') and not arc.is_dir('a/01.png')
+        with pytest.raises(utils.app_constants.FileNotFoundInArchive):
+            arc.dir_contents('c/')
+    with ArchiveFile(path) as arc:
+        assert arc.index is index
+    with zipfile.ZipFile(path, 'a') as z:
+        z.writestr('a/02.png', '')
+    with ArchiveFile(path) as arc:
+        assert arc.index is not index
+        assert arc.dir_contents('a/') == ['a/01.png', 'a/b/', 'a/02.png']
+
+
+def test_verify_archive(tmp_path, archive_types):
+    """corrupt archives still open, verifying them finds the corrupt file"""
+    path = tmp_path / 'gallery.zip'
+    with zipfile.ZipFile(str(path), 'w') as z:
+        z.writestr('01.png', b'first')
+        z.writestr('02.png', b'second')
+    assert verify_archive(str(path)) is None
+    data = path.read_bytes()
+    path.write_bytes(data.replace(b'second', b'sec0nd', 1))
+    with ArchiveFile(str(path)) as arc:
+        assert arc.dir_contents('') == ['01.png', '02.png']
+    assert verify_archive(str(path)) == '02.png'
+
+
+@pytest.mark.parametrize('source', ['folder', 'zip', '7z'])
+def test_ingest_chapter(tmp_path, archive_types, monkeypatch, source):
+    """pages, hashes, metafile and cover are read in one go"""
+    monkeypatch.setattr(utils, 'IMG_FILES', ('.png',), raising=False)
+    files = {'02.png': b'second', '01.png': b'first', '.01.png': b'hidden', 'info.txt': b'Tags: a, b\n'}
+    chapter = Chapter(None, None)
+    if source == 'folder':
+        for name, data in files.items():
+            (tmp_path / name).write_bytes(data)
+        chapter.path = str(tmp_path)
+        metafile, cover = utils.ingest_chapter(chapter, hash_pages=1)
+    else:
+        path = str(tmp_path / ('gallery.' + source))
+        if source == 'zip':
+            with zipfile.ZipFile(path, 'w') as z:
+                for name, data in files.items():
+                    z.writestr(name, data)
+        else:
+            with py7zr.SevenZipFile(path, 'w') as z:
+                for name, data in files.items():
+                    z.writestr(data, name)
+        chapter.path = path
+        with ArchiveFile(path) as arc:
+            metafile, cover = utils.ingest_chapter(chapter, arc, hash_pages=1)
+    assert chapter.pages == 2
+    assert [p.name for p in chapter.manifest.pages] == ['01.png', '02.png']
+    assert [p.size for p in chapter.manifest.pages] == [len(files['01.png']), len(files['02.png'])]
+    assert chapter.hashes == {0: utils.generate_img_hash(b'first')}
+    assert cover == b'first'
+    assert sorted(metafile.metadata['tags']['default']) == ['a', 'b']
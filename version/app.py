@@ -40,6 +40,9 @@ import pewnet
 import utils
 import misc_db
 import database
+import executors
+import phash_index
+import duplicates
 
 log = logging.getLogger(__name__)
 log_i = log.info
@@ -207,6 +210,11 @@ class AppWindow(QMainWindow):
         def refresh_view():
             self.current_manga_view.sort_model.refresh()
         self.db_startup.DONE.connect(refresh_view)
+        def repaint_dead_links(galleries):
+            for v in gallery.MangaViews.manga_views:
+                v.list_view.viewport().update()
+                v.table_view.viewport().update()
+        self.db_startup.DEAD_LINKS.connect(repaint_dead_links)
         self.manga_list_view = self.default_manga_view.list_view
         self.manga_table_view = self.default_manga_view.table_view
         self.manga_list_view.gallery_model.STATUSBAR_MSG.connect(self.stat_temp_msg)
@@ -579,6 +587,12 @@ class AppWindow(QMainWindow):
         duplicate_check_simple.setIcon(app_constants.DUPLICATE_ICON)
         duplicate_check_simple.triggered.connect(lambda: self.duplicate_check()) # triggered emits False
         gallery_menu.addAction(duplicate_check_simple)
+        duplicate_check_advanced = QAction("Check for visually similar galleries", self)
+        duplicate_check_advanced.setIcon(app_constants.DUPLICATE_ICON)
+        duplicate_check_advanced.triggered.connect(lambda: self.duplicate_check(False))
+        duplicate_check_advanced.setStatusTip('Compare the pages of all galleries, finds resized or re-encoded copies too. '
+                                              'Pages of galleries not compared before are hashed first, which takes a while')
+        gallery_menu.addAction(duplicate_check_advanced)
 
         self.toolbar.addWidget(gallery_action)
 
@@ -879,7 +893,20 @@ class AppWindow(QMainWindow):
         fetch_spinner.set_text("Populating")
         fetch_spinner.show()
 
+        # galleries are added to the view and DB in batches
+        pending_galleries = []
+        def add_pending():
+            if pending_galleries:
+                self.addition_tab.view.add_gallery(pending_galleries[:], app_constants.KEEP_ADDED_GALLERIES)
+                pending_galleries.clear()
+        pending_timer = QTimer(self)
+        pending_timer.timeout.connect(add_pending)
+        pending_timer.start(500)
+
         def finished(status):
+            pending_timer.stop()
+            pending_timer.deleteLater()
+            add_pending()
             fetch_spinner.hide()
             ## attempts to fix the missing gallery in inbox issue after dropping multiple items at once
             # self.addition_tab.view.get_current_view().update()
@@ -925,7 +952,9 @@ class AppWindow(QMainWindow):
             fetch_spinner.set_text("Populating... {}/{}".format(prog, self._g_populate_count))
 
         def add_to_model(gallery):
-            self.addition_tab.view.add_gallery(gallery, app_constants.KEEP_ADDED_GALLERIES)
+            pending_galleries.append(gallery)
+            if len(pending_galleries) >= 100:
+                add_pending()
 
         def set_count(c):
             self._g_populate_count = c
@@ -952,6 +981,8 @@ class AppWindow(QMainWindow):
             try:
                 class ScanDir(QObject):
                     finished = pyqtSignal()
+                    DELETED_SIGNAL = pyqtSignal(str, object)
+                    MOVED_SIGNAL = pyqtSignal(str, object)
                     fetch_inst = fetch.Fetch(self)
                     def __init__(self, addition_view, addition_tab, parent=None):
                         super().__init__(parent)
@@ -964,30 +995,55 @@ class AppWindow(QMainWindow):
                             self.addition_tab.click()
                             self._switched = True
 
+                    def report_missing(self, removed, moved):
+                        "Reports galleries whose path was removed or moved since the last scan"
+                        galleries = {}
+                        for g in app_constants.GALLERY_DATA + app_constants.GALLERY_ADDITION_DATA:
+                            galleries.setdefault(os.path.normcase(g.path), []).append(g)
+                        for path in removed:
+                            for g in galleries.get(os.path.normcase(path), []):
+                                self.DELETED_SIGNAL.emit(path, g)
+                        for old_path, new_path in moved:
+                            for g in galleries.get(os.path.normcase(old_path), []):
+                                self.MOVED_SIGNAL.emit(new_path, g)
+
                     def scan_dirs(self):
-                        paths = []
+                        roots = []
+                        current = {}
                         for p in app_constants.MONITOR_PATHS:
                             if os.path.exists(p):
-                                dir_content = os.scandir(p)
-                                for d in dir_content:
-                                    paths.append(d.path)
+                                roots.append(p)
+                                current[p] = gallerydb.ScanStateDB.snapshot(p)
                             else:
                                 log_e("Monitored path does not exist: {}".format(p.encode(errors='ignore')))
 
-                        self.fetch_inst.series_path = paths
-                        self.fetch_inst.LOCAL_EMITTER.connect(lambda g:self.addition_view.add_gallery(g, app_constants.KEEP_ADDED_GALLERIES))
-                        self.fetch_inst.LOCAL_EMITTER.connect(self.switch_tab)
-                        self.fetch_inst.local()
-                        #contents = []
-                        #for g in self.scanned_data:
-                        #   contents.append(g)
-
-                        #paths = sorted(paths)
-                        #new_galleries = []
-                        #for x in contents:
-                        #   y = utils.b_search(paths, os.path.normcase(x.path))
-                        #   if not y:
-                        #       new_galleries.append(x)
+                        # only entries which are new or changed since the last scan are looked at
+                        saved = gallerydb.execute(gallerydb.ScanStateDB.get_snapshot, False, roots)
+                        entries = {}
+                        for p in current:
+                            entries.update(current[p])
+                        changed, removed, moved = gallerydb.ScanStateDB.compare(saved, entries)
+                        log_i('Scan: {} new or changed, {} removed and {} moved entries'.format(len(changed), len(removed), len(moved)))
+                        self.report_missing(removed, moved)
+                        if app_constants.SUBFOLDER_AS_GALLERY:
+                            # galleries can be anywhere below an entry, so its own state doesn't tell if any were added
+                            paths = [p for p in entries if os.path.isdir(p) or p in changed]
+                        else:
+                            paths = changed
+                        moved_paths = {new_path for _, new_path in moved}
+                        paths = sorted(p for p in paths if not p in moved_paths)
+
+                        if paths:
+                            self.fetch_inst.series_path = paths
+                            self.fetch_inst.LOCAL_EMITTER.connect(lambda g:self.addition_view.add_gallery(g, app_constants.KEEP_ADDED_GALLERIES))
+                            self.fetch_inst.LOCAL_EMITTER.connect(self.switch_tab)
+                            self.fetch_inst.local()
+                        # a cancelled scan looks at the same entries again next time
+                        if not self.fetch_inst.cancelled():
+                            changed = set(changed)
+                            gallerydb.execute(gallerydb.ScanStateDB.save_snapshot, True,
+                                {p: {e: s for e, s in current[p].items() if e in changed} for p in current},
+                                removed + [old_path for old_path, _ in moved])
                         self.finished.emit()
                         self.deleteLater()
                     #if app_constants.LOOK_NEW_GALLERY_AUTOADD:
@@ -1006,6 +1062,8 @@ class AppWindow(QMainWindow):
                 self.scan_inst = ScanDir(self.addition_tab.view, self.addition_tab)
                 self.scan_inst.moveToThread(thread)
                 self.scan_inst.finished.connect(finished)
+                self.scan_inst.DELETED_SIGNAL.connect(self.watchers.gallery_handler.DELETED_SIGNAL)
+                self.scan_inst.MOVED_SIGNAL.connect(self.watchers.gallery_handler.MOVED_SIGNAL)
                 self.scan_inst.finished.connect(new_gall_spinner.before_hide)
                 thread.started.connect(self.scan_inst.scan_dirs)
                 #self.scan_inst.scan_dirs()
@@ -1091,6 +1149,20 @@ class AppWindow(QMainWindow):
         except AttributeError:
             pass
 
+        # running gallery scans
+        try:
+            self.g_populate_inst.cancel()
+        except (AttributeError, RuntimeError):
+            pass
+        try:
+            self.scan_inst.fetch_inst.cancel()
+        except (AttributeError, RuntimeError):
+            pass
+        gallerydb.PageHasher.cancel()
+
+        # thumbnail worker processes
+        executors.Executors.shutdown()
+
         # settings
         if self.manga_list_view.current_sort != 'page_count':
             settings.set(self.manga_list_view.current_sort, 'General', 'current sort')
@@ -1111,6 +1183,13 @@ class AppWindow(QMainWindow):
             log.exception('Flush temp on exit: FAIL')
 
         # DB
+        if app_constants.STARTUP_SNAPSHOT:
+            try:
+                # queued after pending writes, so the snapshot matches the DB
+                gallerydb.execute(gallerydb.LibrarySnapshot.save, False,
+                                  app_constants.GALLERY_DATA + app_constants.GALLERY_ADDITION_DATA)
+            except Exception:
+                log.exception('Could not save startup snapshot')
         try:
             log_i("Analyzing database...")
             gallerydb.GalleryDB.analyze()
@@ -1121,14 +1200,14 @@ class AppWindow(QMainWindow):
         self.download_window.close()
 
         # check if there is db activity
-        if not gallerydb.method_queue.empty():
+        if not gallerydb.db_executor.idle():
             class DBActivityChecker(QObject):
                 FINISHED = pyqtSignal()
                 def __init__(self, **kwargs):
                     super().__init__(**kwargs)
 
                 def check(self):
-                    gallerydb.method_queue.join()
+                    gallerydb.db_executor.join()
                     self.FINISHED.emit()
                     self.deleteLater()
 
@@ -1153,7 +1232,13 @@ class AppWindow(QMainWindow):
         else:
             return 0
 
-    def duplicate_check(self, simple=True):
+    def duplicate_check(self, simple=True, similar_to=None):
+        """
+        Shows duplicate galleries in a new Duplicate tab.
+        The simple mode compares titles, paths and page hashes, the advanced mode compares pages by their perceptual hashes.
+        Galleries which are duplicates of each other are added as a group.
+        If a gallery is given as similar_to, only galleries similar to it are looked for.
+        """
         try:
             self.duplicate_check_invoker.disconnect()
         except TypeError:
@@ -1176,19 +1261,44 @@ class AppWindow(QMainWindow):
 
             def checkSimple(self, model):
                 galleries = model._data
+                progress = lambda n, total: notifbar.add_text('Checking gallery {}/{}'.format(n, total))
+                for group in duplicates.duplicate_groups(galleries, progress):
+                    self.found_duplicates.emit(tuple(group))
+                self.finished.emit()
 
-                duplicates = []
-                for n, g in enumerate(galleries, 1):
-                    notifbar.add_text('Checking gallery {}'.format(n))
-                    log_d('Checking gallery {}'.format(g.title.encode(errors="ignore")))
-                    for y in galleries:
-                        title = g.title.strip().lower() == y.title.strip().lower()
-                        path = os.path.normcase(g.path) == os.path.normcase(y.path)
-                        if g.id != y.id and (title or path):
-                            if g not in duplicates:
-                                duplicates.append(y)
-                                duplicates.append(g)
-                                self.found_duplicates.emit((g, y))
+            def checkAdvanced(self, model):
+                galleries = {g.id: g for g in model._data}
+                saved = gallerydb.execute(gallerydb.PHashDB.get_all_phashes, False, read=True)
+                index = phash_index.PHashIndex(app_constants.PHASH_DISTANCE)
+                for g in galleries.values():
+                    if saved.get(g.id):
+                        index.add(g.id, saved[g.id])
+                unhashed = [g for g in galleries.values() if not saved.get(g.id)]
+                if similar_to:
+                    # only the gallery looked for is hashed, the others are left to PageHasher.backfill_phashes
+                    skipped = [g for g in unhashed if g.id != similar_to.id]
+                    if skipped:
+                        notifbar.add_text('{} galleries without hashed pages were not compared, '
+                                          'see Generate Hashes in the settings'.format(len(skipped)))
+                    unhashed = [] if saved.get(similar_to.id) else [similar_to]
+                elif unhashed:
+                    notifbar.add_text('Hashing pages of {} galleries not compared before, this can take a while...'.format(
+                        len(unhashed)))
+                for n, g in enumerate(unhashed, 1):
+                    notifbar.add_text('Hashing pages of gallery {}/{}'.format(n, len(unhashed)))
+                    try:
+                        index.add(g.id, gallerydb.PHashDB.gen_gallery_phashes(g))
+                    except Exception:
+                        log.exception('Could not hash pages of {}'.format(g.title.encode(errors='ignore')))
+
+                notifbar.add_text('Comparing pages...')
+                if similar_to:
+                    similar = index.similar(similar_to.id)
+                    groups = [[similar_to.id] + similar] if similar else []
+                else:
+                    groups = duplicates.group_pairs(index.duplicates())
+                for group in groups:
+                    self.found_duplicates.emit(tuple(galleries[g_id] for g_id in group))
                 self.finished.emit()
 
         self._d_checker = DuplicateCheck()
@@ -1199,6 +1309,8 @@ class AppWindow(QMainWindow):
         self._d_checker.finished.connect(duplicate_spinner.before_hide)
         if simple:
             self.duplicate_check_invoker.connect(self._d_checker.checkSimple)
+        else:
+            self.duplicate_check_invoker.connect(self._d_checker.checkAdvanced)
         self.duplicate_check_invoker.emit(self.default_manga_view.gallery_model)
 
     def excepthook(self, ex_type, ex, tb):
@@ -199,6 +199,7 @@ MONITOR_PATHS = [p for p in get([], 'Application', 'monitor paths', list) if os.
 IGNORE_PATHS = get([], 'Application', 'ignore paths', list)
 IGNORE_EXTS = get([], 'Application', 'ignore exts', list)
 SCANNING_FOR_GALLERIES = False # if a scan for new galleries is being done
+SCAN_WORKERS = get(8, 'Application', 'scan workers', int) # paths scanned at once when looking for galleries
 TEMP_PATH_IGNORE = []
 
 # GENERAL
@@ -216,6 +217,7 @@ SHOW_SIDEBAR_WIDGET = get(False, 'Application', 'show sidebar widget', bool)
 ENABLE_NOTIFICATIONS = get(True, 'Application', 'enable notifications', bool)
 ALWAYS_DROP_TO_INBOX = get(False, 'Application', 'always send to inbox', bool)
 DATABASE_STARTUP_FETCH_LIMIT = get(1000, 'Application', 'db startup fetch limit', int)
+STARTUP_SNAPSHOT = get(True, 'Application', 'startup snapshot', bool)
 
 # ADVANCED
 GALLERY_DATA_FIX_REGEX = get("", 'Advanced', 'gallery data fix regex', str)
@@ -231,6 +233,8 @@ EXPORT_PATH = ''
 
 # HASH
 HASH_GALLERY_PAGES = get('all', 'Advanced', 'hash gallery pages', int, str)
+HASH_BACKFILL_DELAY = get(0.0, 'Advanced', 'hash backfill delay', float) # seconds between chapters when generating missing hashes
+PHASH_DISTANCE = get(8, 'Advanced', 'perceptual hash distance', int) # max differing bits of visually similar pages
 
 # WEB
 INCLUDE_EH_EXPUNGED = get(False, 'Web', 'include eh expunged', bool)
@@ -262,6 +266,8 @@ _REFRESH_EXTERNAL_VIEWER = False
 
 # controls
 THUMBNAIL_CACHE_SIZE = (1024, get(200, 'Advanced', 'cache size', int)) #1024 is 1mib
+THUMBNAIL_STORE_SIZE = get(100, 'Advanced', 'thumbnail store size', int) # mib of unused thumbnails kept for reuse
+DEAD_LINK_TTL = get(300, 'Advanced', 'dead link ttl', int) # seconds a checked gallery source directory is trusted
 PREFETCH_ITEM_AMOUNT = get(50, 'Advanced', 'prefetch item amount', int)# amount of items to prefetch
 SCROLL_SPEED = get(7, 'Advanced', 'scroll speed', int) # controls how many steps it takes when scrolling
 
@@ -14,5 +14,6 @@ along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
 
 from . import db
 from . import db_constants
+from . import db_executor
 
-__all__ = ['db', 'db_constants']
\ No newline at end of file
+__all__ = ['db', 'db_constants', 'db_executor']
\ No newline at end of file
@@ -14,6 +14,7 @@
 
 import os, sqlite3, threading, queue
 import logging, time, shutil
+import contextlib
 
 from . import db_constants
 log = logging.getLogger(__name__)
@@ -26,16 +27,18 @@ log_c = log.critical
 def hashes_sql(cols=False):
     col_list = [
     'hash_id INTEGER PRIMARY KEY',
-    'hash BLOB',
+    'hash BLOB', # the 20 bytes of the SHA-1 digest
     'series_id INTEGER',
     'chapter_id INTEGER',
     'page INTEGER',
     'FOREIGN KEY(series_id) REFERENCES series(series_id) ON DELETE CASCADE',
     'FOREIGN KEY(chapter_id) REFERENCES chapters(chapter_id) ON DELETE CASCADE',
-    'UNIQUE(hash, series_id, chapter_id, page)'
+    'UNIQUE(series_id, chapter_id, page)'
     ]
 
     sql = "CREATE TABLE IF NOT EXISTS hashes({});".format(",".join(col_list))
+    # covers looking up and grouping pages by hash across galleries
+    sql += "CREATE INDEX IF NOT EXISTS idx_hashes_hash ON hashes(hash, series_id);"
 
     if cols:
         return sql, col_list
@@ -179,8 +182,95 @@ def series_list_map_sql(cols=False):
         return sql, col_list
     return sql
 
+def scan_state_sql(cols=False):
+    col_list = [
+        'path TEXT PRIMARY KEY',
+        'root TEXT NOT NULL',
+        'inode INTEGER',
+        'mtime INTEGER',
+        'size INTEGER'
+        ]
+
+    sql = "CREATE TABLE IF NOT EXISTS scan_state({});".format(",".join(col_list))
+
+    if cols:
+        return sql, col_list
+    return sql
+
+def archive_integrity_sql(cols=False):
+    col_list = [
+        'path TEXT PRIMARY KEY',
+        'size INTEGER',
+        'mtime INTEGER',
+        'bad_file TEXT'
+        ]
+
+    sql = "CREATE TABLE IF NOT EXISTS archive_integrity({});".format(",".join(col_list))
+
+    if cols:
+        return sql, col_list
+    return sql
+
+def pages_sql(cols=False):
+    col_list = [
+        'chapter_id INTEGER NOT NULL',
+        'page INTEGER NOT NULL',
+        'name TEXT',
+        'size INTEGER',
+        'width INTEGER',
+        'height INTEGER',
+        'mtime INTEGER',
+        'FOREIGN KEY(chapter_id) REFERENCES chapters(chapter_id) ON DELETE CASCADE',
+        'PRIMARY KEY(chapter_id, page)'
+        ]
+
+    sql = "CREATE TABLE IF NOT EXISTS pages({});".format(",".join(col_list))
+
+    if cols:
+        return sql, col_list
+    return sql
+
+def phashes_sql(cols=False):
+    col_list = [
+        'chapter_id INTEGER NOT NULL',
+        'page INTEGER NOT NULL',
+        'series_id INTEGER',
+        'phash INTEGER',
+        'FOREIGN KEY(series_id) REFERENCES series(series_id) ON DELETE CASCADE',
+        'FOREIGN KEY(chapter_id) REFERENCES chapters(chapter_id) ON DELETE CASCADE',
+        'PRIMARY KEY(chapter_id, page)'
+        ]
+
+    sql = "CREATE TABLE IF NOT EXISTS phashes({});".format(",".join(col_list))
+
+    if cols:
+        return sql, col_list
+    return sql
+
+# tables the galleries are loaded from, every write to them increases the change counter
+COUNTED_TABLES = ('series', 'chapters', 'namespaces', 'tags', 'tags_mappings', 'series_tags_map', 'series_list_map')
+
+def change_counter_sql(cols=False):
+    col_list = [
+        'counter INTEGER NOT NULL',
+        'token TEXT' # tells DBs apart which happen to have the same count
+        ]
+
+    sql = "CREATE TABLE IF NOT EXISTS change_counter({});".format(",".join(col_list))
+    sql += "INSERT INTO change_counter(counter, token) SELECT 0, hex(randomblob(8)) \
+        WHERE NOT EXISTS (SELECT 1 FROM change_counter);"
+    for table in COUNTED_TABLES:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            sql += "CREATE TRIGGER IF NOT EXISTS {0}_{1}_count AFTER {2} ON {0} \
+                BEGIN UPDATE change_counter SET counter = counter + 1; END;".format(table, event.lower(), event)
+
+    if cols:
+        return sql, col_list
+    return sql
+
 STRUCTURE_SCRIPT = series_sql()+chapters_sql()+namespaces_sql()+tags_sql()+tags_mappings_sql()+\
-    series_tags_mappings_sql()+hashes_sql()+list_sql()+series_list_map_sql()
+    series_tags_mappings_sql()+hashes_sql()+list_sql()+series_list_map_sql()+scan_state_sql()+\
+    archive_integrity_sql()+pages_sql()+phashes_sql()+change_counter_sql()
 
 def global_db_convert(conn):
     """
@@ -198,6 +288,11 @@ def global_db_convert(conn):
     hashes, hashes_cols = hashes_sql(True)
     _list, list_cols = list_sql(True)
     series_list_map, series_list_map_cols = series_list_map_sql(True)
+    scan_state, scan_state_cols = scan_state_sql(True)
+    archive_integrity, archive_integrity_cols = archive_integrity_sql(True)
+    pages, pages_cols = pages_sql(True)
+    phashes, phashes_cols = phashes_sql(True)
+    change_counter, change_counter_cols = change_counter_sql(True)
     
     t_d = {}
     t_d['series'] = series_cols
@@ -209,6 +304,11 @@ def global_db_convert(conn):
     t_d['hashes'] = hashes_cols
     t_d['list'] = list_cols
     t_d['series_list_map'] = series_list_map_cols
+    t_d['scan_state'] = scan_state_cols
+    t_d['archive_integrity'] = archive_integrity_cols
+    t_d['pages'] = pages_cols
+    t_d['phashes'] = phashes_cols
+    t_d['change_counter'] = change_counter_cols
 
     log_d('Checking table structures')
     c.executescript(STRUCTURE_SCRIPT)
@@ -226,6 +326,40 @@ def global_db_convert(conn):
     log_d('Commited DB changes')
     return c
 
+def convert_hashes(conn):
+    """
+    Rebuilds the hashes table of DBs older than v0.27,
+    which stored hex digests and couldn't look up hashes by page.
+    Don't use this method directly. Use the add_db_revisions instead.
+    """
+    c = conn.cursor()
+    row = c.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='hashes'").fetchone()
+    if not row or 'UNIQUE(hash,' not in row[0].replace(' ', ''):
+        return
+    log_i('Converting hashes')
+
+    def digest(h):
+        if isinstance(h, str):
+            try:
+                return bytes.fromhex(h)
+            except ValueError:
+                return None
+        return h
+
+    conn.create_function('digest', 1, digest)
+    # pages of which the hash changed were stored twice, the newest row is kept
+    c.executescript("""BEGIN;
+        DROP INDEX IF EXISTS idx_hashes_hash;
+        ALTER TABLE hashes RENAME TO hashes_old;
+        {}
+        INSERT OR REPLACE INTO hashes(hash, series_id, chapter_id, page)
+            SELECT digest(hash) AS d, series_id, chapter_id, page FROM hashes_old
+            WHERE d IS NOT NULL ORDER BY hash_id;
+        DROP TABLE hashes_old;
+        COMMIT;""".format(hashes_sql()))
+    log_d('Reclaiming space')
+    c.execute('VACUUM')
+
 def add_db_revisions(old_db):
     """
     Adds specific DB revisions items.
@@ -235,6 +369,8 @@ def add_db_revisions(old_db):
     conn = sqlite3.connect(old_db, check_same_thread=False)
     conn.row_factory = sqlite3.Row
 
+    convert_hashes(conn)
+
     log_i('Converting tables and columns')
     c = global_db_convert(conn)
 
@@ -307,13 +443,43 @@ def init_db(path=db_constants.DB_PATH):
 
     conn.isolation_level = None
     conn.execute("PRAGMA foreign_keys = on")
+    # lets the DB reader connections query while the writer connection is busy
+    conn.execute("PRAGMA journal_mode = WAL")
+    return conn
+
+def db_file_path(conn):
+    "Returns the path to the file of the main database of the given connection or an empty string for in-memory DBs"
+    for row in conn.execute('PRAGMA database_list').fetchall():
+        if row[1] == 'main':
+            return row[2] or ''
+    return ''
+
+def init_reader_db(path):
+    """Opens a read-only connection to the DB at the given path.
+    Meant to be used by a single DB reader thread.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.isolation_level = None
+    conn.execute("PRAGMA query_only = on")
     return conn
 
+# the most ? a statement can have, older SQLite versions only allow 999
+MAX_SQL_VARIABLES = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+def chunks(seq, size=500):
+    "Splits seq into lists of at most size items, e.g. to stay under the SQL variable limit"
+    seq = list(seq)
+    for i in range(0, len(seq), size):
+        yield seq[i:i+size]
+
 class DBBase:
     "The base DB class. _DB_CONN should be set at runtime on startup"
     _DB_CONN = None
     _AUTO_COMMIT = True
     _STATE = {'active':False}
+    # holds the read-only connection of DB reader threads
+    _READER = threading.local()
 
     def __init__(self, **kwargs):
         pass
@@ -322,7 +488,8 @@ class DBBase:
     def begin(cls):
         "Useful when modifying for a large amount of data"
         if not cls._STATE['active']:
-            cls._AUTO_COMMIT = False
+            # set on DBBase so that every subclass joins the transaction
+            DBBase._AUTO_COMMIT = False
             cls.execute(cls, "BEGIN TRANSACTION")
             cls._STATE['active'] = True
         #print("STARTED DB OPTIMIZE")
@@ -335,15 +502,52 @@ class DBBase:
                 cls.execute(cls, "COMMIT")
             except sqlite3.OperationalError:
                 pass
-            cls._AUTO_COMMIT = True
+            DBBase._AUTO_COMMIT = True
             cls._STATE['active'] = False
         #print("ENDED DB OPTIMIZE")
 
+    @classmethod
+    def rollback(cls):
+        "Called to discard and end transaction"
+        if cls._STATE['active']:
+            try:
+                cls.execute(cls, "ROLLBACK")
+            except sqlite3.OperationalError:
+                pass
+            DBBase._AUTO_COMMIT = True
+            cls._STATE['active'] = False
+
+    @classmethod
+    @contextlib.contextmanager
+    def transaction(cls):
+        """
+        Runs the with-block in a transaction which is committed at the end or rolled back on an exception.
+        Joins the transaction already started by begin instead, leaving the commit or rollback to its owner.
+        """
+        if cls._STATE['active']:
+            yield
+            return
+        cls.begin()
+        try:
+            yield
+        except:
+            cls.rollback()
+            raise
+        cls.end()
+
+    @staticmethod
+    def reader_connection():
+        "Returns the read-only connection of the current thread or None if it isn't a DB reader thread"
+        return getattr(DBBase._READER, 'conn', None)
+
     def execute(self, *args):
         "Same as cursor.execute"
         if not self._DB_CONN:
             raise db_constants.NoDatabaseConnection
         log_d('DB Query: {}'.format(args).encode(errors='ignore'))
+        reader = DBBase.reader_connection()
+        if reader:
+            return reader.execute(*args)
         if self._AUTO_COMMIT:
             try:
                 with self._DB_CONN:
@@ -359,6 +563,9 @@ class DBBase:
         if not self._DB_CONN:
             raise db_constants.NoDatabaseConnection
         log_d('DB Query: {}'.format(args).encode(errors='ignore'))
+        reader = DBBase.reader_connection()
+        if reader:
+            return reader.executemany(*args)
         if self._AUTO_COMMIT:
             with self._DB_CONN:
                 return self._DB_CONN.executemany(*args)
@@ -25,11 +25,11 @@ else:
     THUMBNAIL_PATH = os.path.join("db", THUMB_NAME)
     DB_PATH = os.path.join(DB_ROOT, DB_NAME)
 
-DB_VERSION = [0.26] # a list of accepted db versions. E.g. v3.5 will be backward compatible with v3.1 etc.
+DB_VERSION = [0.27] # a list of accepted db versions. E.g. v3.5 will be backward compatible with v3.1 etc.
 CURRENT_DB_VERSION = DB_VERSION[0]
 REAL_DB_VERSION = DB_VERSION[len(DB_VERSION)-1]
-METHOD_QUEUE = None
-METHOD_RETURN = None
+DB_EXECUTOR = None
+DB_READERS = min(4, os.cpu_count() or 1) # amount of read-only connections used by the DB executor
 DATABASE = None
 
 class NoDatabaseConnection(Exception): pass
@@ -0,0 +1,170 @@
+#"""
+#This file is part of Happypanda.
+#Happypanda is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 2 of the License, or
+#any later version.
+#Happypanda is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#You should have received a copy of the GNU General Public License
+#along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+#"""
+
+import itertools
+import logging
+import queue
+import threading
+from concurrent import futures
+from dataclasses import dataclass, field
+
+from . import db
+from . import db_constants
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+@dataclass(order=True, repr=False)
+class DBTask:
+    priority: float
+    sequence: int # keeps tasks with the same priority in submission order
+    future: futures.Future = field(compare=False)
+    method: object = field(compare=False)
+    args: tuple = field(compare=False)
+    kwargs: dict = field(compare=False)
+
+class DBExecutor:
+    """
+    Runs DB methods on one writer thread and a pool of reader threads.
+
+    The writer thread uses the shared DBBase._DB_CONN connection and processes
+    its queue strictly by priority (lower first) and then by submission order.
+    Methods submitted with read=True are handed to the reader threads instead.
+    Every reader thread owns a read-only connection to the same DB file, which
+    thanks to WAL mode can query while the writer is busy.
+    Reads fall back to the writer thread for in-memory DBs or if no readers are set.
+
+    submit -> queues one method call and returns a future
+    submit_batch -> queues many method calls at once and returns their futures
+    idle -> True if no work is queued
+    join -> blocks until all queued work is done
+    """
+
+    def __init__(self, readers=db_constants.DB_READERS):
+        self._readers = max(0, readers)
+        self._write_queue = queue.PriorityQueue()
+        self._read_queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._writer_thread = None
+        self._reader_idents = set()
+        self._readable_conn = None # the writer connection the readable status was checked for
+        self._readable = False
+
+    def start(self):
+        "Starts the writer and reader threads"
+        with self._lock:
+            if self._threads:
+                return
+            self._writer_thread = threading.Thread(name='DB Writer Thread', target=self._process,
+                                                   args=(self._write_queue,), daemon=True)
+            self._threads.append(self._writer_thread)
+            for n in range(self._readers):
+                self._threads.append(threading.Thread(name='DB Reader Thread {}'.format(n), target=self._process,
+                                                      args=(self._read_queue, True), daemon=True))
+            for t in self._threads:
+                t.start()
+
+    def _can_read(self):
+        "Checks if the current writer connection is backed by a file the reader threads can open"
+        conn = db.DBBase._DB_CONN
+        if not self._readers or not conn:
+            return False
+        if conn is not self._readable_conn:
+            try:
+                self._readable = bool(db.db_file_path(conn))
+            except Exception:
+                self._readable = False
+            self._readable_conn = conn
+        return self._readable
+
+    def _reader_connection(self, local):
+        "Makes sure the current reader thread has a connection to the DB the writer is using"
+        writer = db.DBBase._DB_CONN
+        if writer is None:
+            raise db_constants.NoDatabaseConnection
+        if getattr(local, 'writer', None) is not writer:
+            if getattr(local, 'conn', None):
+                local.conn.close()
+            local.conn = db.init_reader_db(db.db_file_path(writer))
+            local.writer = writer
+        return local.conn
+
+    def _process(self, work_queue, reader=False):
+        if reader:
+            self._reader_idents.add(threading.get_ident())
+        while True:
+            task = work_queue.get()
+            try:
+                if not task.future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if reader:
+                        self._reader_connection(db.DBBase._READER)
+                    r = task.method(*task.args, **task.kwargs)
+                except BaseException as exc:
+                    log.exception('DB method failed: {}'.format(getattr(task.method, '__name__', task.method)))
+                    task.future.set_exception(exc)
+                else:
+                    task.future.set_result(r)
+            finally:
+                work_queue.task_done()
+
+    def is_worker_thread(self, read=False):
+        """
+        Returns True if the current thread would process the given kind of call itself.
+        Waiting on such a call from the current thread would deadlock.
+        """
+        if threading.current_thread() is self._writer_thread:
+            return True
+        return read and threading.get_ident() in self._reader_idents
+
+    def submit(self, method, *args, priority=999, read=False, **kwargs):
+        "Queues a method call and returns a future for its return value"
+        log_d('Added method to queue: {}'.format(getattr(method, '__name__', method)))
+        if not self._threads:
+            self.start()
+        f = futures.Future()
+        work_queue = self._read_queue if read and self._can_read() else self._write_queue
+        work_queue.put(DBTask(priority, next(self._sequence), f, method, args, kwargs))
+        return f
+
+    def submit_batch(self, calls, priority=999, read=True):
+        """
+        Queues many method calls at once. Each call is a list or tuple where the first
+        index is the method, followed by its arguments. Named arguments are put in a dict as last item.
+        Returns a list of futures in the same order as the calls.
+        """
+        fs = []
+        for call in calls:
+            method, *args = call
+            kwargs = {}
+            if args and isinstance(args[-1], dict):
+                kwargs = args.pop()
+            fs.append(self.submit(method, *args, priority=priority, read=read, **kwargs))
+        return fs
+
+    def idle(self):
+        "Returns True if there is no queued or running DB work"
+        return not self._write_queue.unfinished_tasks and not self._read_queue.unfinished_tasks
+
+    def join(self):
+        "Blocks until all queued DB work is done"
+        self._write_queue.join()
+        self._read_queue.join()
@@ -0,0 +1,109 @@
+#"""
+#This file is part of Happypanda.
+#Happypanda is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 2 of the License, or
+#any later version.
+#Happypanda is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#You should have received a copy of the GNU General Public License
+#along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+#"""
+
+import logging
+import os
+import threading
+import time
+
+import app_constants
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+class DeadLinkChecker:
+    """
+    Finds galleries whose source doesn't exist anymore.
+    Instead of a stat per gallery, the directory containing a gallery is listed once
+    and its entries are kept for DEAD_LINK_TTL seconds, so galleries in the same directory cost nothing.
+    Only paths missing from a listing are checked on their own.
+    Safe to use from any thread.
+
+    exists -> checks if a path exists
+    check -> sets dead_link of galleries, returns the ones that changed
+    invalidate <- forgets the entries of a directory, or of all directories
+    """
+    _lock = threading.Lock()
+    # normcased directory -> (time listed, set of normcased entry names or None if it couldn't be listed)
+    _dirs = {}
+
+    @classmethod
+    def _entries(cls, directory, now, ttl):
+        key = os.path.normcase(directory)
+        with cls._lock:
+            cached = cls._dirs.get(key)
+        if cached and now - cached[0] < ttl:
+            return cached[1]
+        try:
+            with os.scandir(directory) as it:
+                # broken symlinks are listed too, but don't exist
+                entries = {os.path.normcase(e.name) for e in it if not e.is_symlink() or os.path.exists(e.path)}
+        except (FileNotFoundError, NotADirectoryError):
+            entries = set()
+        except OSError:
+            # e.g. no permission to list it, the paths in it are checked one by one
+            entries = None
+        with cls._lock:
+            cls._dirs[key] = (now, entries)
+        return entries
+
+    @classmethod
+    def exists(cls, path, now=None, ttl=None):
+        "Checks if the given path exists, with the entries of its directory listed at most ttl seconds ago"
+        if not path:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if ttl is None:
+            ttl = app_constants.DEAD_LINK_TTL
+        directory, name = os.path.split(os.path.normpath(os.path.abspath(path)))
+        entries = cls._entries(directory, now, ttl) if name else None
+        if entries is not None and os.path.normcase(name) in entries:
+            return True
+        # missing ones are rare, and might have been created after the directory was listed
+        return os.path.exists(path)
+
+    @classmethod
+    def check(cls, galleries, progress=None, batch=500):
+        """
+        Sets dead_link of the given galleries and returns a list of the galleries where it changed.
+        progress is called with a list of the galleries that changed after every batch of galleries.
+        """
+        now = time.monotonic()
+        changed = []
+        batch_changed = []
+        for n, g in enumerate(galleries, 1):
+            dead = not cls.exists(g.path, now)
+            if dead != g.dead_link:
+                g.dead_link = dead
+                batch_changed.append(g)
+            if n % batch == 0 or n == len(galleries):
+                if progress and batch_changed:
+                    progress(batch_changed)
+                changed.extend(batch_changed)
+                batch_changed = []
+        return changed
+
+    @classmethod
+    def invalidate(cls, directory=None):
+        "Forgets the listed entries of the given directory, or of all directories"
+        with cls._lock:
+            if directory is None:
+                cls._dirs.clear()
+            else:
+                cls._dirs.pop(os.path.normcase(os.path.normpath(os.path.abspath(directory))), None)
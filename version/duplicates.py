@@ -0,0 +1,89 @@
+#"""
+#This file is part of Happypanda.
+#Happypanda is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 2 of the License, or
+#any later version.
+#Happypanda is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#You should have received a copy of the GNU General Public License
+#along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+#"""
+
+import logging
+import os
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+class _Groups:
+    "Disjoint sets of items, merged with union by size and path halving"
+
+    def __init__(self):
+        self._parent = {}
+        self._size = {}
+
+    def find(self, item):
+        parent = self._parent.setdefault(item, item)
+        while parent != item:
+            grandparent = self._parent[parent]
+            self._parent[item] = grandparent
+            item, parent = grandparent, self._parent[grandparent]
+        return item
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self._size.get(a, 1) < self._size.get(b, 1):
+            a, b = b, a
+        self._parent[b] = a
+        self._size[a] = self._size.get(a, 1) + self._size.get(b, 1)
+
+    def groups(self):
+        "Returns a list of the sets with more than one item, in the order their first item was added"
+        groups = {}
+        for item in self._parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return [g for g in groups.values() if len(g) > 1]
+
+def group_pairs(pairs):
+    "Merges pairs of duplicates into groups, returns a list of lists"
+    groups = _Groups()
+    for a, b in pairs:
+        groups.union(a, b)
+    return groups.groups()
+
+def duplicate_groups(galleries, progress=None, batch=1000, max_shared=5):
+    """
+    Returns a list of lists of galleries which are duplicates of each other,
+    because they have the same title, the same path or a page in common.
+    Galleries are put into buckets by each of these keys, so each gallery is only looked at once.
+    Pages found in more than max_shared galleries, like blank or credit pages, don't make galleries duplicates.
+    progress is called with the amount of galleries done and the total amount after every batch of galleries.
+    """
+    by_title = {}
+    by_path = {}
+    by_page = {}
+    groups = _Groups()
+    for n, g in enumerate(galleries, 1):
+        groups.find(g)
+        for bucket, key in ((by_title, g.title.strip().lower()), (by_path, os.path.normcase(g.path))):
+            first = bucket.setdefault(key, g)
+            if first is not g:
+                groups.union(first, g)
+        for h in set(g.hashes or ()):
+            by_page.setdefault(h, []).append(g)
+        if progress and (n % batch == 0 or n == len(galleries)):
+            progress(n, len(galleries))
+    for page_galleries in by_page.values():
+        if len(page_galleries) <= max_shared:
+            for g in page_galleries[1:]:
+                groups.union(page_galleries[0], g)
+    return groups.groups()
@@ -1,12 +1,15 @@
-﻿import logging, uuid, os
+﻿import logging, uuid, os, threading, multiprocessing
 
 from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QImage, QPainter, QBrush, QPen
 
 from database import db_constants
 import utils
 import app_constants
+import thumbnail_store
+import thumbnail_decoder
 
 log = logging.getLogger(__name__)
 log_i = log.info
@@ -32,7 +35,6 @@ def _rounded_qimage(qimg, radius):
 def _task_thumbnail(gallery_or_path, img: str = None, width: int = None, height: int = None):
     """
     """
-    if img is None: img = utils.get_gallery_img(gallery_or_path)
     if width is None: width = app_constants.THUMB_W_SIZE
     if height is None: height = app_constants.THUMB_H_SIZE
 
@@ -43,36 +45,43 @@ def _task_thumbnail(gallery_or_path, img: str = None, width: int = None, height:
 
     try:
         if not img:
-            img_path = utils.get_gallery_img(gallery_or_path)
+            # images in archives are read into memory instead of being extracted
+            img_path = utils.get_gallery_img(gallery_or_path, in_memory=True)
         else:
             img_path = img
         if not img_path:
             raise IndexError
-        for ext in utils.IMG_FILES:
-            if img_path.lower().endswith(ext):
-                suff = ext # the image ext with dot
-
-        # generate unique file name
-        file_name = str(uuid.uuid4()) + ".png"
-        new_img_path = os.path.join(db_constants.THUMBNAIL_PATH, (file_name))
-        if not os.path.isfile(img_path):
+        in_memory = isinstance(img_path, bytes)
+        if not in_memory and not os.path.isfile(img_path):
             raise IndexError
 
-        # Do the scaling
+        # reuse the thumbnail if this image was already scaled to this size
+        fingerprint = thumbnail_store.ThumbnailStore.fingerprint(img_path)
+        new_img_path = thumbnail_store.ThumbnailStore.lookup(fingerprint, width, height)
+        if new_img_path:
+            return new_img_path
+        new_img_path = thumbnail_store.ThumbnailStore.entry_path(fingerprint, width, height)
+
+        # Do the scaling, decoding and shrinking happens in a worker process
         try:
-            im_data = utils.PToQImageHelper(img_path)
-            image = QImage(im_data['data'], im_data['im'].size[0], im_data['im'].size[1], im_data['format'])
-            if im_data['colortable']:
-                image.setColorTable(im_data['colortable'])
-        except ValueError:
+            w, h, data = Executors.decode_thumbnail(img_path, width, height)
+            image = QImage(data, w, h, w * 4, QImage.Format_RGBA8888).copy()
+        except (OSError, ValueError, BrokenProcessPool):
             image = QImage()
-            image.load(img_path)
+            if in_memory:
+                image.loadFromData(img_path)
+            else:
+                image.load(img_path)
         if image.isNull():
             raise IndexError
         radius = 5
         image = image.scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
         r_image = _rounded_qimage(image, radius)
-        r_image.save(new_img_path, "PNG", quality=80)
+        # written under a temporary name first so a partial thumbnail is never picked up as an entry
+        temp_img_path = "{}.{}.tmp".format(new_img_path, uuid.uuid4())
+        if not r_image.save(temp_img_path, "PNG", quality=80):
+            raise IndexError
+        os.replace(temp_img_path, new_img_path)
     except IndexError:
         new_img_path = app_constants.NO_IMAGE_PATH
 
@@ -91,8 +100,40 @@ def _task_load_thumbnail(ppath, thumb_size, on_method=None, **kwargs):
             return img
 
 class Executors:
-    _thumbnail_exec = futures.ThreadPoolExecutor(3)
+    # the thumbnail threads mostly wait on disk and the decode processes
+    _thumbnail_exec = futures.ThreadPoolExecutor(max(3, os.cpu_count() or 1))
     _profile_exec = futures.ThreadPoolExecutor(2)
+    _decode_exec = None
+    _decode_lock = threading.Lock()
+
+    @classmethod
+    def decode_thumbnail(cls, img_path, width, height):
+        """
+        Decodes and shrinks an image, given as a path or bytes, in the thumbnail worker processes.
+        Returns a tuple of width, height and RGBA bytes, see thumbnail_decoder.decode_thumbnail
+        """
+        with cls._decode_lock:
+            if cls._decode_exec is None:
+                # spawned, forking would copy the state of the Qt and DB threads
+                cls._decode_exec = futures.ProcessPoolExecutor(os.cpu_count() or 1,
+                                                              mp_context=multiprocessing.get_context('spawn'))
+            decode_exec = cls._decode_exec
+        try:
+            return decode_exec.submit(thumbnail_decoder.decode_thumbnail, img_path, width, height).result()
+        except BrokenProcessPool:
+            log.exception("Thumbnail worker process died")
+            with cls._decode_lock:
+                if cls._decode_exec is decode_exec:
+                    cls._decode_exec = None
+            raise
+
+    @classmethod
+    def shutdown(cls):
+        "Stops the thumbnail worker processes"
+        with cls._decode_lock:
+            if cls._decode_exec is not None:
+                cls._decode_exec.shutdown(wait=False, cancel_futures=True)
+                cls._decode_exec = None
     
     @classmethod
     def generate_thumbnail(cls, gallery_or_path, img: str = None, width: int = None, height: int = None, on_method = None, blocking = False):
@@ -108,6 +149,43 @@ class Executors:
         if not on_method:
             return f
 
+    @classmethod
+    def generate_thumbnails(cls, galleries, on_method=None, batch_size=100):
+        """
+        Generates thumbnails for many galleries and sets them as their profile.
+        on_method is called with lists of up to batch_size galleries as their thumbnails are done,
+        so the results can be saved together instead of one by one.
+        Returns a list of futures.
+        """
+        log_i("Generating {} thumbnails".format(len(galleries)))
+        lock = threading.Lock()
+        done = []
+        remaining = [len(galleries)]
+
+        def finished(gallery, f):
+            try:
+                gallery.profile = f.result()
+            except Exception:
+                log.exception("Failed generating thumbnail")
+                gallery.profile = app_constants.NO_IMAGE_PATH
+            with lock:
+                done.append(gallery)
+                remaining[0] -= 1
+                if len(done) < batch_size and remaining[0]:
+                    return
+                batch = done[:]
+                done.clear()
+            if on_method:
+                on_method(batch)
+
+        fs = []
+        for g in galleries:
+            f = cls._thumbnail_exec.submit(_task_thumbnail, g, width=app_constants.THUMB_W_SIZE,
+                                           height=app_constants.THUMB_H_SIZE)
+            f.add_done_callback(lambda f, g=g: finished(g, f))
+            fs.append(f)
+        return fs
+
     @classmethod
     def load_thumbnail(cls, ppath, thumb_size: tuple[int, int] = None, on_method=None, **kwargs):
         "**kwargs will be passed to on_method"
@@ -17,11 +17,15 @@ import time
 import logging
 import random
 import queue
+import collections
+import threading
+from concurrent import futures
 
 from PyQt5.QtCore import QObject, pyqtSignal # need this for interaction with main thread
 
 import gallerydb
 import app_constants
+import executors
 import pewnet
 import settings
 import utils
@@ -41,6 +45,8 @@ class Fetch(QObject):
     Should be executed in a new thread.
     Contains following methods:
     local -> runs a local search in the given series_path
+    cancel -> stops a running local search
+    cancelled -> checks if the local search was cancelled
     auto_web_metadata -> does a search online for the given galleries and returns their metdata
     """
 
@@ -64,6 +70,7 @@ class Fetch(QObject):
         self._data = []
         self._curr_gallery = '' # for debugging purposes
         self.skipped_paths = []
+        self._cancel = threading.Event()
 
         # web
         self._default_ehen_url = app_constants.DEFAULT_EHEN_URL
@@ -73,7 +80,7 @@ class Fetch(QObject):
         self._hen_list = []
 
         #filter
-        self.galleries_from_db = []
+        self.galleries_from_db = set()
         self._refresh_filter_list()
 
         #download
@@ -82,12 +89,26 @@ class Fetch(QObject):
 
     def _refresh_filter_list(self):
             gallery_data = app_constants.GALLERY_DATA + app_constants.GALLERY_ADDITION_DATA
-            filter_list = []
-            for g in gallery_data:
-                filter_list.append(os.path.normcase(g.path))
-            self.galleries_from_db = sorted(filter_list)
+            # a set, so checking if a gallery exists doesn't need a sorted list
+            self.galleries_from_db = {os.path.normcase(g.path) for g in gallery_data}
 
     def create_gallery(self, path, folder_name, do_chapters=True, archive=None):
+        gallery, skipped = self._make_gallery(path, folder_name, do_chapters, archive)
+        self._add_result(gallery, skipped)
+        return gallery is not None
+
+    def _add_result(self, gallery, skipped):
+        if skipped:
+            self.skipped_paths.append(skipped)
+        if gallery:
+            self.LOCAL_EMITTER.emit(gallery)
+            self._data.append(gallery)
+
+    def _make_gallery(self, path, folder_name, do_chapters=True, archive=None):
+        """
+        Creates a gallery from path without emitting it, safe to run in the scan workers.
+        Returns a tuple of the gallery or None and the (path, reason) it was skipped for or None
+        """
         is_archive = True if archive else False
         temp_p = archive if is_archive else path
         folder_name = folder_name or path if folder_name or path else os.path.split(archive)[1]
@@ -96,6 +117,8 @@ class Fetch(QObject):
             log_i('Creating gallery: {}'.format(folder_name.encode('utf-8', 'ignore')))
             new_gallery = gallerydb.Gallery()
             metafile = utils.GMetafile()
+            # each chapter is read once for its pages, hashes, metafile and the cover
+            cover = None
             if os.path.isdir(temp_p):
                 con = os.scandir(temp_p) #all of content in the gallery folder
                 log_i('Gallery source is a directory')
@@ -108,75 +131,72 @@ class Fetch(QObject):
                         chap = new_gallery.chapters.create_chapter()
                         chap.title = utils.title_parser(ch)['title']
                         chap.path = os.path.join(path, ch)
-                        chap.pages = len([x for x in os.scandir(chap.path) if x.name.lower().endswith(utils.IMG_FILES)])
-                        metafile.update(utils.GMetafile(chap.path))
+                        if os.path.isdir(chap.path):
+                            cover = self._ingest(chap, metafile, cover)
+                        else:
+                            with utils.ArchiveFile(chap.path) as arch:
+                                cover = self._ingest(chap, metafile, cover, arch)
 
                 else: #else assume that all images are in gallery folder
                     chap = new_gallery.chapters.create_chapter()
                     chap.title = utils.title_parser(os.path.split(path)[1])['title']
                     chap.path = path
-                    metafile.update(utils.GMetafile(chap.path))
-                    chap.pages = len(list(os.scandir(path)))
+                    cover = self._ingest(chap, metafile, cover)
                 
                 parsed = utils.title_parser(folder_name)
             else:
                 try:
                     if is_archive or temp_p.endswith(utils.ARCHIVE_FILES):
                         log_i('Gallery source is an archive')
-                        contents = utils.check_archive(temp_p)
-                        if contents:
-                            new_gallery.is_archive = 1
-                            new_gallery.path_in_archive = '' if not is_archive else path
-                            if folder_name.endswith('/'):
-                                folder_name = folder_name[:-1]
-                                fn = os.path.split(folder_name)
-                                folder_name = fn[1] or fn[2]
-                            folder_name = folder_name.replace('/','')
-                            if folder_name.endswith(utils.ARCHIVE_FILES):
-                                n = folder_name
-                                for ext in utils.ARCHIVE_FILES:
-                                    n = n.replace(ext, '')
-                                parsed = utils.title_parser(n)
-                            else:
-                                parsed = utils.title_parser(folder_name)
+                        # opened once for all chapters
+                        with utils.ArchiveFile(temp_p) as arch:
+                            contents = utils.check_archive(arch)
+                            if contents:
+                                new_gallery.is_archive = 1
+                                new_gallery.path_in_archive = '' if not is_archive else path
+                                if folder_name.endswith('/'):
+                                    folder_name = folder_name[:-1]
+                                    fn = os.path.split(folder_name)
+                                    folder_name = fn[1] or fn[2]
+                                folder_name = folder_name.replace('/','')
+                                if folder_name.endswith(utils.ARCHIVE_FILES):
+                                    n = folder_name
+                                    for ext in utils.ARCHIVE_FILES:
+                                        n = n.replace(ext, '')
+                                    parsed = utils.title_parser(n)
+                                else:
+                                    parsed = utils.title_parser(folder_name)
                                                 
-                            if do_chapters:
-                                archive_g = sorted(contents)
-                                if not archive_g:
-                                    log_w('No chapters found for {}'.format(temp_p.encode(errors='ignore')))
-                                    raise ValueError
-                                for g in archive_g:
+                                if do_chapters:
+                                    archive_g = sorted(contents)
+                                    if not archive_g:
+                                        log_w('No chapters found for {}'.format(temp_p.encode(errors='ignore')))
+                                        raise ValueError
+                                    for g in archive_g:
+                                        chap = new_gallery.chapters.create_chapter()
+                                        chap.in_archive = 1
+                                        chap.title = parsed['title'] if not g else utils.title_parser(g.replace('/', ''))['title']
+                                        chap.path = g
+                                        cover = self._ingest(chap, metafile, cover, arch)
+                                else:
                                     chap = new_gallery.chapters.create_chapter()
+                                    chap.title = utils.title_parser(os.path.split(path)[1])['title']
                                     chap.in_archive = 1
-                                    chap.title = parsed['title'] if not g else utils.title_parser(g.replace('/', ''))['title']
-                                    chap.path = g
-                                    metafile.update(utils.GMetafile(g, temp_p))
-                                    with utils.ArchiveFile(temp_p) as arch:
-                                        chap.pages = len([x for x in arch.dir_contents(g) if x.lower().endswith(utils.IMG_FILES)])
+                                    chap.path = path
+                                    cover = self._ingest(chap, metafile, cover, arch)
                             else:
-                                chap = new_gallery.chapters.create_chapter()
-                                chap.title = utils.title_parser(os.path.split(path)[1])['title']
-                                chap.in_archive = 1
-                                chap.path = path
-                                metafile.update(utils.GMetafile(path, temp_p))
-                                with utils.ArchiveFile(temp_p) as arch:
-                                    chap.pages = len(arch.dir_contents(''))
-                        else:
-                            raise ValueError
+                                raise ValueError
                     else:
                         raise ValueError
                 except ValueError:
                     log_w('Skipped {} in local search'.format(path.encode(errors='ignore')))
-                    self.skipped_paths.append((temp_p, 'Empty archive',))
-                    return
+                    return None, (temp_p, 'Empty archive')
                 except app_constants.CreateArchiveFail:
                     log_w('Skipped {} in local search'.format(path.encode(errors='ignore')))
-                    self.skipped_paths.append((temp_p, 'Error creating archive',))
-                    return
+                    return None, (temp_p, 'Error creating archive')
                 except app_constants.TitleParsingError:
                     log_w('Skipped {} in local search'.format(path.encode(errors='ignore')))
-                    self.skipped_paths.append((temp_p, 'Error while parsing folder/archive name',))
-                    return
+                    return None, (temp_p, 'Error while parsing folder/archive name')
 
             new_gallery.title = parsed['title']
             new_gallery.path = temp_p
@@ -185,18 +205,112 @@ class Fetch(QObject):
             new_gallery.info = ""
             new_gallery.view = app_constants.ViewType.Addition
             metafile.apply_gallery(new_gallery)
+            if cover is not None:
+                new_gallery.profile = executors.Executors.generate_thumbnail(new_gallery, img=cover, blocking=True)
 
             if app_constants.MOVE_IMPORTED_GALLERIES and not app_constants.OVERRIDE_MOVE_IMPORTED_IN_FETCH:
                 new_gallery.move_gallery()
 
-            self.LOCAL_EMITTER.emit(new_gallery)
-            self._data.append(new_gallery)
             log_i('Gallery successful created: {}'.format(folder_name.encode('utf-8', 'ignore')))
-            return True
+            return new_gallery, None
         else:
             log_i('Gallery already exists or ignored: {}'.format(folder_name.encode('utf-8', 'ignore')))
-            self.skipped_paths.append((temp_p, 'Already exists or ignored'))
-            return False
+            return None, (temp_p, 'Already exists or ignored')
+
+    def _ingest(self, chapter, metafile, cover, archive=None):
+        """
+        Reads the chapter in a single pass with utils.ingest_chapter and adds its metafile to metafile.
+        Returns the content of the first page of the first chapter, or cover if it's already known
+        """
+        hash_pages = app_constants.HASH_GALLERY_PAGES
+        chap_metafile, first_page = utils.ingest_chapter(chapter, archive,
+            hash_pages if isinstance(hash_pages, int) else None, cover=chapter.number == 0)
+        metafile.update(chap_metafile)
+        return cover if first_page is None else first_page
+
+    def _scan_path(self, path, folder_name, subfolder_as_gallery):
+        """
+        Looks for galleries in path, runs in the scan workers.
+        Returns a list of (gallery, skipped) tuples, see _make_gallery
+        """
+        results = []
+        if self._cancel.is_set():
+            return results
+        if subfolder_as_gallery:
+            log_i("Treating each subfolder as gallery")
+            if os.path.isdir(path):
+                gallery_folders, gallery_archives = utils.recursive_gallery_check(path)
+                for gs in gallery_folders:
+                    if self._cancel.is_set():
+                        break
+                    results.append(self._make_gallery(gs, os.path.split(gs)[1], False))
+                for gs in gallery_archives:
+                    if self._cancel.is_set():
+                        break
+                    results.append(self._make_gallery(gs[0], os.path.split(gs[0])[1], False, archive=gs[1]))
+            elif path.endswith(utils.ARCHIVE_FILES):
+                for g in utils.check_archive(path):
+                    if self._cancel.is_set():
+                        break
+                    results.append(self._make_gallery(g, os.path.split(g)[1], False, archive=path))
+        else:
+            try:
+                if os.path.isdir(path):
+                    if not list(os.scandir(path)):
+                        raise ValueError
+                elif not path.endswith(utils.ARCHIVE_FILES):
+                    raise NotADirectoryError
+
+                log_i("Treating each subfolder as chapter")
+                results.append(self._make_gallery(path, folder_name, do_chapters=True))
+
+            except ValueError:
+                log_w('Directory is empty: {}'.format(path.encode(errors='ignore')))
+                results.append((None, (path, 'Empty directory')))
+            except NotADirectoryError:
+                log_w('Unsupported file: {}'.format(path.encode(errors='ignore')))
+                results.append((None, (path, 'Unsupported file')))
+        return results
+
+    def _scan(self, paths, subfolder_as_gallery):
+        """
+        Scans (path, folder_name) tuples with up to SCAN_WORKERS at a time.
+        Yields (path, results) in the order of paths, no matter which finishes first.
+        Paths not yet scanned are dropped when cancelled.
+        """
+        workers = max(1, app_constants.SCAN_WORKERS)
+        paths = iter(paths)
+        pending = collections.deque()
+        with futures.ThreadPoolExecutor(workers, thread_name_prefix='gallery-scan') as executor:
+            try:
+                while True:
+                    # only a few paths ahead are queued so results don't pile up
+                    while len(pending) < workers * 2 and not self._cancel.is_set():
+                        try:
+                            path, folder_name = next(paths)
+                        except StopIteration:
+                            break
+                        pending.append((path, executor.submit(self._scan_path, path, folder_name, subfolder_as_gallery)))
+                    if not pending or self._cancel.is_set():
+                        break
+                    path, f = pending.popleft()
+                    try:
+                        results = f.result()
+                    except Exception:
+                        log.exception('Failed scanning {}'.format(path.encode(errors='ignore')))
+                        results = [(None, (path, 'Error while scanning'))]
+                    yield path, results
+            finally:
+                for path, f in pending:
+                    f.cancel()
+
+    def cancel(self):
+        "Stops a running local search, galleries found so far are still emitted. Safe to call from any thread"
+        self._cancel.set()
+
+    def cancelled(self):
+        "Returns True if the local search was cancelled"
+        return self._cancel.is_set()
 
     def local(self, s_path=None):
         """
@@ -217,49 +331,28 @@ class Fetch(QObject):
                 self._refresh_filter_list()
             self.DATA_COUNT.emit(len(gallery_l)) #tell model how many items are going to be added
             log_i('Received {} paths'.format(len(gallery_l)))
-            progress = 0
+            subfolder_as_gallery = app_constants.SUBFOLDER_AS_GALLERY or app_constants.OVERRIDE_SUBFOLDER_AS_GALLERY
+            app_constants.OVERRIDE_SUBFOLDER_AS_GALLERY = False
 
+            paths = []
             for folder_name in gallery_l: # folder_name = gallery folder title
-                self._curr_gallery = folder_name
                 if mixed:
                     path = folder_name
                     folder_name = os.path.split(path)[1]
                 else:
                     path = os.path.join(self.series_path, folder_name)
-                if app_constants.SUBFOLDER_AS_GALLERY or app_constants.OVERRIDE_SUBFOLDER_AS_GALLERY:
-                    if app_constants.OVERRIDE_SUBFOLDER_AS_GALLERY:
-                        app_constants.OVERRIDE_SUBFOLDER_AS_GALLERY = False
-                    log_i("Treating each subfolder as gallery")
-                    if os.path.isdir(path):
-                        gallery_folders, gallery_archives = utils.recursive_gallery_check(path)
-                        for gs in gallery_folders:
-                                self.create_gallery(gs, os.path.split(gs)[1], False)
-                        p_saving = {}
-                        for gs in gallery_archives:
-                                self.create_gallery(gs[0], os.path.split(gs[0])[1], False, archive=gs[1])
-                    elif path.endswith(utils.ARCHIVE_FILES):
-                        for g in utils.check_archive(path):
-                            self.create_gallery(g, os.path.split(g)[1], False, archive=path)
-                else:
-                    try:
-                        if os.path.isdir(path):
-                            if not list(os.scandir(path)):
-                                raise ValueError
-                        elif not path.endswith(utils.ARCHIVE_FILES):
-                            raise NotADirectoryError
-
-                        log_i("Treating each subfolder as chapter")
-                        self.create_gallery(path, folder_name, do_chapters=True)
-
-                    except ValueError:
-                        self.skipped_paths.append((path, 'Empty directory'))
-                        log_w('Directory is empty: {}'.format(path.encode(errors='ignore')))
-                    except NotADirectoryError:
-                        self.skipped_paths.append((path, 'Unsupported file'))
-                        log_w('Unsupported file: {}'.format(path.encode(errors='ignore')))
+                paths.append((path, folder_name))
 
+            # paths are scanned in parallel, results are still emitted in order
+            progress = 0
+            for path, results in self._scan(paths, subfolder_as_gallery):
+                self._curr_gallery = path
+                for gallery, skipped in results:
+                    self._add_result(gallery, skipped)
                 progress += 1 # update the progress bar
                 self.PROGRESS.emit(progress)
+            if self._cancel.is_set():
+                log_i('Local search cancelled')
         else: # if gallery folder is empty
             log_e('Local search error: Invalid directory')
             log_e('Gallery folder is empty')
@@ -372,7 +465,7 @@ class Fetch(QObject):
             try:
                 if not gallery.hashes:
                     color_img = kwargs['color'] if 'color' in kwargs else False # used for similarity search on EH
-                    hash_dict = gallerydb.execute(gallerydb.HashDB.gen_gallery_hash, False, gallery, 0, 'mid', color_img)
+                    hash_dict = gallerydb.HashDB.gen_gallery_hash(gallery, 0, 'mid', color_img)
                     if color_img and 'color' in hash_dict:
                         custom_args['color'] = hash_dict['color'] # will be path to filename
                         g_hash = hash_dict['color']
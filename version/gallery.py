@@ -37,6 +37,8 @@ import app_constants
 import misc
 import gallerydialog
 import utils
+import search_index
+import search_query
 
 log = logging.getLogger(__name__)
 log_i = log.info
@@ -90,11 +92,25 @@ log_c = log.critical
 #       return len(node.subnodes)
 
 class GallerySearch(QObject):
-    FINISHED = pyqtSignal()
+    """
+    Searches the galleries of a model on a worker thread.
+    Every search gets a generation from the model, a search is abandoned as soon as a newer one is requested.
+    A search that only narrows down the last one, like typing one more character, only looks at its matches.
+    FINISHED is emitted with the generation and the result of a search which ran to the end.
+    """
+    FINISHED = pyqtSignal(int, object)
+    # galleries looked at between checks for a newer search
+    _CANCEL_CHECK = 1000
+
     def __init__(self, data):
         super().__init__()
         self._data = data
+        self._index = search_index.SearchIndex(data)
         self.result = {}
+        # set by the model before it requests a search
+        self.generation = 0
+        # terms, args, index version and matches of the last finished search
+        self._last = None
 
         # filtering
         self.fav = False
@@ -105,45 +121,80 @@ class GallerySearch(QObject):
 
     def set_data(self, new_data):
         self._data = new_data
+        self._index = search_index.SearchIndex(new_data)
+        self._last = None
         self.result = {g.id: True for g in self._data}
 
+    def add_galleries(self, galleries):
+        self._index.add(galleries)
+
+    def remove_galleries(self, galleries):
+        self._index.remove(galleries)
+
     def set_fav(self, new_fav):
         self.fav = new_fav
 
-    def search(self, term, args):
+    def search(self, term, args, generation=None):
+        "Searches the galleries, the search is abandoned if the generation isn't the latest anymore"
+        if generation is None:
+            generation = self.generation
+        cancelled = lambda: generation != self.generation
+        if cancelled():
+            return
         term = ' '.join(term.split())
         search_pieces = utils.get_terms(term)
 
-        self._filter(search_pieces, args)
-        self.FINISHED.emit()
-
-    def _filter(self, terms, args):
-        self.result.clear()
-        for gallery in self._data:
+        result = self._filter(search_pieces, args, cancelled)
+        if result is not None:
+            self.result = result
+            self.FINISHED.emit(generation, result)
+
+    def _matches(self, terms, args, cancelled):
+        "Returns the galleries matching terms, or None if all galleries match"
+        version = self._index.version()
+        last = self._last
+        if last and last[3] is not None and set(last[1]) == set(args) and last[2] == version and \
+                search_query.refines(terms, last[0], args):
+            if last[0] == terms:
+                return last[3]
+            matches = self._index.search(terms, args, cancelled, within=last[3])
+        else:
+            matches = self._index.search(terms, args, cancelled)
+        if not cancelled():
+            self._last = (terms, args, version, matches)
+        return matches
+
+    def _filter(self, terms, args, cancelled=lambda: False):
+        "Returns a dict of gallery id to whether it's shown, or None if the search was cancelled"
+        matches = None
+        if not utils.all_opposite(terms):
+            matches = self._matches(terms, args, cancelled)
+            if cancelled():
+                return None
+
+        if not self.fav and not self._gallery_list:
+            if matches is None:
+                return dict.fromkeys((g.id for g in self._data), True)
+            result = dict.fromkeys((g.id for g in self._data), False)
+            result.update((g.id, True) for g in matches)
+            return result
+
+        result = {}
+        for n, gallery in enumerate(self._data):
+            if n % self._CANCEL_CHECK == 0 and cancelled():
+                return None
             if self.fav:
                 if not gallery.fav:
                     continue
             if self._gallery_list:
                 if not gallery in self._gallery_list:
                     continue
-            all_terms = {t: False for t in terms}
-            allow = False
-            if utils.all_opposite(terms):
-                self.result[gallery.id] = True
-                continue
-            
-            for t in terms:
-                if gallery.contains(t, args):
-                    all_terms[t] = True
-
-            if all(all_terms.values()):
-                allow = True
-
-            self.result[gallery.id] = allow
+            result[gallery.id] = matches is None or gallery in matches
+        return result
 
 class SortFilterModel(QSortFilterProxyModel):
     ROWCOUNT_CHANGE = pyqtSignal()
-    _DO_SEARCH = pyqtSignal(str, object)
+    _DO_SEARCH = pyqtSignal(str, object, int)
     _CHANGE_SEARCH_DATA = pyqtSignal(list)
     _CHANGE_FAV = pyqtSignal(bool)
     _SET_GALLERY_LIST = pyqtSignal(object)
@@ -173,6 +224,9 @@ class SortFilterModel(QSortFilterProxyModel):
         self.setSortCaseSensitivity(Qt.CaseInsensitive)
         self.enable_drag = False
         self.for_inbox = False
+        # generation of the latest search and the result filterAcceptsRow reads, only replaced on this thread
+        self._generation = 0
+        self._result = {}
 
     def navigate_history(self, direction=PREV):
         new_term = ''
@@ -206,18 +260,33 @@ class SortFilterModel(QSortFilterProxyModel):
     def setup_search(self):
         if not self._search_ready:
             self.gallery_search = GallerySearch(self.sourceModel()._data)
-            self.gallery_search.FINISHED.connect(self.invalidateFilter)
-            self.gallery_search.FINISHED.connect(lambda: self.ROWCOUNT_CHANGE.emit())
+            self.gallery_search.FINISHED.connect(self._publish_result)
             self.gallery_search.moveToThread(app_constants.GENERAL_THREAD)
             self._DO_SEARCH.connect(self.gallery_search.search)
             self._SET_GALLERY_LIST.connect(self.gallery_search.set_gallery_list)
             self._CHANGE_SEARCH_DATA.connect(self.gallery_search.set_data)
             self._CHANGE_FAV.connect(self.gallery_search.set_fav)
+            self.sourceModel().GALLERIES_ADDED.connect(self.gallery_search.add_galleries)
+            self.sourceModel().GALLERIES_REMOVED.connect(self.gallery_search.remove_galleries)
             self.sourceModel().rowsInserted.connect(self.refresh)
             self._search_ready = True
 
     def refresh(self):
-        self._DO_SEARCH.emit(self.current_term, self.current_args)
+        self._search(self.current_term, self.current_args)
+
+    def _search(self, term, args):
+        self._generation += 1
+        if self._search_ready:
+            # searches still queued or running on the search thread are abandoned
+            self.gallery_search.generation = self._generation
+        self._DO_SEARCH.emit(term, args, self._generation)
+
+    def _publish_result(self, generation, result):
+        if generation != self._generation:
+            return
+        self._result = result
+        self.invalidateFilter()
+        self.ROWCOUNT_CHANGE.emit()
 
     def init_search(self, term, args=None, **kwargs):
         """
@@ -249,7 +318,7 @@ class SortFilterModel(QSortFilterProxyModel):
         if not history:
             self.HISTORY_SEARCH_TERM.emit(term)
         self.current_args = args
-        self._DO_SEARCH.emit(term, args)
+        self._search(term, args)
 
     def filterAcceptsRow(self, source_row, parent_index):
         if self.for_inbox and not app_constants.SEARCHABLE_INBOX:
@@ -261,7 +330,7 @@ class SortFilterModel(QSortFilterProxyModel):
                 if self._search_ready:
                     gallery = index.data(Qt.UserRole + 1)
                     try:
-                        return self.gallery_search.result[gallery.id]
+                        return self._result[gallery.id]
                     except KeyError:
                         # pass
                         # this might fix the missing gallery in inbox issue after dropping multiple items
@@ -426,6 +495,8 @@ class GalleryModel(QAbstractTableModel):
     CUSTOM_STATUS_MSG = pyqtSignal(str)
     ADDED_ROWS = pyqtSignal()
     ADD_MORE = pyqtSignal()
+    GALLERIES_ADDED = pyqtSignal(list)
+    GALLERIES_REMOVED = pyqtSignal(list)
 
     REMOVING_ROWS = False
 
@@ -451,6 +522,8 @@ class GalleryModel(QAbstractTableModel):
         self._data_count = 0 # number of items added to model
         self._gallery_to_add = []
         self._gallery_to_remove = []
+        # lets galleries modified by id move in and out of enforced lists
+        self.GALLERIES_ADDED.connect(gallerydb.GalleryList.track)
 
     def status_b_msg(self, msg):
         self.STATUSBAR_MSG.emit(msg)
@@ -649,13 +722,18 @@ class GalleryModel(QAbstractTableModel):
             return False
 
         self.beginInsertRows(QModelIndex(), position, position + rows - 1)
+        added = []
         for r in range(rows):
-            self._data.insert(position, self._gallery_to_add.pop())
+            added.append(self._gallery_to_add.pop())
+            self._data.insert(position, added[-1])
+        # emitted before the rows are announced so searches triggered by them see the new galleries
+        self.GALLERIES_ADDED.emit(added)
         self.endInsertRows()
         return True
 
     def replaceRows(self, list_of_gallery, position, rows=1, index=QModelIndex()):
         "replaces gallery data to the data list WITHOUT adding to DB"
+        gallerydb.GalleryList.track(list_of_gallery)
         for pos, gallery in enumerate(list_of_gallery):
             del self._data[position + pos]
             self._data.insert(position + pos, gallery)
@@ -664,11 +742,15 @@ class GalleryModel(QAbstractTableModel):
     def removeRows(self, position, rows, index=QModelIndex()):
         self._data_count -= rows
         self.beginRemoveRows(QModelIndex(), position, position + rows - 1)
+        removed = []
         for r in range(rows):
             try:
-                self._data.remove(self._gallery_to_remove.pop())
+                removed.append(self._gallery_to_remove.pop())
+                self._data.remove(removed[-1])
             except ValueError:
+                self.GALLERIES_REMOVED.emit(removed)
                 return False
+        self.GALLERIES_REMOVED.emit(removed)
         self.endRemoveRows()
         return True
 
@@ -1696,15 +1778,14 @@ class MangaViews:
                 g.view = self.view_type
                 if self.view_type != app_constants.ViewType.Duplicate:
                     g.state = app_constants.GalleryState.New
-                if db:
-                    gallerydb.execute(gallerydb.GalleryDB.add_gallery, True, g)
-                else:
-                    if not g.profile:
-                        executors.Executors.generate_thumbnail(g, on_method=g.set_profile)
+                if not db and not g.profile:
+                    executors.Executors.generate_thumbnail(g, on_method=g.set_profile)
+                if record_time:
+                    g.qtime = QTime.currentTime()
+            if db:
+                gallerydb.execute(gallerydb.GalleryDB.add_galleries, True, list(gallery))
             rows = len(gallery)
             self.list_view.gallery_model._gallery_to_add.extend(gallery)
-            if record_time:
-                g.qtime = QTime.currentTime()
         else:
             gallery.view = self.view_type
             if self.view_type != app_constants.ViewType.Duplicate:
@@ -1712,7 +1793,7 @@ class MangaViews:
             rows = 1
             self.list_view.gallery_model._gallery_to_add.append(gallery)
             if record_time:
-                g.qtime = QTime.currentTime()
+                gallery.qtime = QTime.currentTime()
             if db:
                 gallerydb.execute(gallerydb.GalleryDB.add_gallery, True, gallery)
             else:
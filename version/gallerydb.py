@@ -14,13 +14,15 @@
 
 import datetime
 import os
-import threading
+import sys
 import logging
-import queue
 import io
+import pickle
 import uuid
-from dateutil import parser as dateparser
-from dataclasses import dataclass, field
+import sqlite3
+import threading
+import weakref
+from concurrent import futures
 from collections import defaultdict
 
 from PyQt5.QtCore import QObject, pyqtSignal, QTime
@@ -29,6 +31,11 @@ import app_constants
 import database
 import utils
 import executors
+import search_index
+import search_query
+import thumbnail_store
+import dead_links
+import phash_index
 
 
 log = logging.getLogger(__name__)
@@ -39,74 +46,46 @@ log_e = log.error
 log_c = log.critical
 
 
-method_queue = queue.PriorityQueue()
-method_return = queue.Queue()
-database.db_constants.METHOD_QUEUE = method_queue
-database.db_constants.METHOD_RETURN = method_return
-
-@dataclass(order=True, repr=False)
-class PriorityObject:
-    priority: float
-    data: list=field(compare=False)
+db_executor = database.db_executor.DBExecutor()
+database.db_constants.DB_EXECUTOR = db_executor
+db_executor.start()
 
-def process_methods():
+def execute(method, no_return, *args, **kwargs):
     """
-    Methods are objects.
-    Put a list in the method queue where first index is the
-    method. Named arguments are put in a dict.
+    Runs the method on the DB executor.
+    Pass priority=<number> to change the position in the queue (lower first) and
+    read=True to let one of the read-only connections run it in parallel with other reads.
+    Blocks and returns the return value of the method unless no_return is set.
+    Named arguments can also be put in a dict.
     """
-    while True:
-        l = method_queue.get().data
-        log_d('Processing a method from queue...')
-        method = l.pop(0)
-        log_d(method)
-        args = []
-        kwargs = {}
-        get_args = 1
-        no_return = False
-        while get_args:
-            try:
-                a = l.pop(0)
-                if a == 'no return':
-                    no_return = True
-                    continue
-                if isinstance(a, dict):
-                    kwargs = a
-                else:
-                    args.append(a)
-            except IndexError:
-                get_args = 0
-        args = tuple(args)
-        if args and kwargs:
-            r = method(*args, **kwargs)
-        elif args:
-            r = method(*args)
-        elif kwargs:
-            r = method(**kwargs)
-        else:
-            r = method()
-        if not no_return:
-            method_return.put(r)
-        method_queue.task_done()
-
-method_queue_thread = threading.Thread(name='Method Queue Thread', target=process_methods, daemon=True)
-method_queue_thread.start()
-
-def execute(method, no_return, *args, **kwargs):
-    log_d('Added method to queue')
     log_d('Method name: {}'.format(method.__name__))
-    arg_list = [method]
     priority = kwargs.pop("priority", 999)
-    if no_return:
-        arg_list.append('no return')
-    if args:
-        for x in args:
-            arg_list.append(x)
-    if kwargs:
-        arg_list.append(kwargs)
-    method_queue.put(PriorityObject(priority, arg_list))
+    read = kwargs.pop("read", False)
+    for a in args:
+        if isinstance(a, dict):
+            kwargs.update(a)
+    args = [a for a in args if not isinstance(a, dict)]
+    if not no_return and db_executor.is_worker_thread(read):
+        # already on a thread that would process this call, waiting for it would deadlock
+        return method(*args, **kwargs)
+    f = db_executor.submit(method, *args, priority=priority, read=read, **kwargs)
     if not no_return:
-        return method_return.get()
+        return f.result()
+
+def execute_batch(calls, read=True, priority=999):
+    """
+    Runs many method calls at once on the DB executor and blocks until all of them are done.
+    Each call is a list where the first index is the method followed by its arguments.
+    Named arguments are put in a dict. Returns the return values in the order of the calls.
+    """
+    if db_executor.is_worker_thread(read):
+        results = []
+        for method, *args in calls:
+            kwargs = args.pop() if args and isinstance(args[-1], dict) else {}
+            results.append(method(*args, **kwargs))
+        return results
+    fs = db_executor.submit_batch(calls, priority=priority, read=read)
+    return [f.result() for f in fs]
 
 def chapter_map(row, chapter):
     assert isinstance(chapter, Chapter)
@@ -185,18 +164,20 @@ def default_chap_exec(gallery_or_id, chap, only_values=False):
                 'in_archive':in_archive})
     return execute
 
-def default_exec(object):
+def default_exec(object, with_id=False):
+    "Returns the insert query for the given gallery. The series_id column is included if with_id is True"
     object.set_defaults()
     def check(obj):
         if obj == "None":
             return None
         else:
             return obj
-    executing = ["""INSERT INTO series(title, artist, profile, series_path, is_archive, path_in_archive,
+    executing = ["""INSERT INTO series({}title, artist, profile, series_path, is_archive, path_in_archive,
                     info, type, fav, language, rating, status, pub_date, date_added, last_read, link,
                     times_read, db_v, exed, view)
-                VALUES(:title, :artist, :profile, :series_path, :is_archive, :path_in_archive, :info, :type, :fav, :language,
-                    :rating, :status, :pub_date, :date_added, :last_read, :link, :times_read, :db_v, :exed, :view)""",
+                VALUES({}:title, :artist, :profile, :series_path, :is_archive, :path_in_archive, :info, :type, :fav, :language,
+                    :rating, :status, :pub_date, :date_added, :last_read, :link, :times_read, :db_v, :exed, :view)""".format(
+                    *(('series_id, ', ':series_id, ') if with_id else ('', ''))),
                 {
                 'title':check(object.title),
                 'artist':check(object.artist),
@@ -219,6 +200,8 @@ def default_exec(object):
                 'exed':check(object.exed),
                 'view':check(object.view)
                 }]
+    if with_id:
+        executing[1]['series_id'] = object.id
     return executing
 
 class GalleryDB(database.db.DBBase):
@@ -231,12 +214,15 @@ class GalleryDB(database.db.DBBase):
         get_gallery_by_path -> Returns gallery with given path
         get_gallery_by_id -> Returns gallery with given id
         add_gallery -> adds gallery into db
+        add_galleries -> adds many galleries into db in one transaction
+        set_profiles -> saves the thumbnail paths of many galleries
         set_gallery_title -> changes gallery title
         gallery_count -> returns amount of gallery (can be used for indexing)
         del_gallery -> deletes the gallery with the given id recursively
         check_exists -> Checks if provided string exists
         clear_thumb -> Deletes a thumbnail
         clear_thumb_dir -> Dletes everything in the thumbnail directory
+        collect_thumb_garbage -> Removes thumbnails no gallery or list uses anymore
     """
     def __init__(self):
         raise Exception("GalleryDB should not be instantiated")
@@ -246,11 +232,14 @@ class GalleryDB(database.db.DBBase):
         "Rebuilds gallery thumbnail"
         try:
             log_i('Recreating thumb {}'.format(gallery.title.encode(errors='ignore')))
-            if gallery.profile:
-                GalleryDB.clear_thumb(gallery.profile)
+            old_profile = gallery.profile
+            # an unchanged cover image resolves to the same thumbnail in the store
             gallery.profile = executors.Executors.generate_thumbnail(gallery, blocking=True)
-            GalleryDB.modify_gallery(gallery.id,
-                profile=gallery.profile)
+            if gallery.profile != old_profile:
+                if old_profile:
+                    GalleryDB.clear_thumb(old_profile)
+                GalleryDB.modify_gallery(gallery.id,
+                    profile=gallery.profile)
         except:
             log.exception("Failed rebuilding thumbnail")
             return False
@@ -258,7 +247,13 @@ class GalleryDB(database.db.DBBase):
 
     @staticmethod
     def clear_thumb(path):
-        "Deletes a thumbnail"
+        """
+        Deletes a thumbnail.
+        Thumbnails in the thumbnail store might be shared by other galleries,
+        they are left for collect_thumb_garbage to remove.
+        """
+        if thumbnail_store.ThumbnailStore.is_entry(path):
+            return
         try:
             if os.path.samefile(path, app_constants.NO_IMAGE_PATH):
                 return
@@ -277,7 +272,22 @@ class GalleryDB(database.db.DBBase):
         "Deletes everything in the thumbnail directory"
         if os.path.exists(database.db_constants.THUMBNAIL_PATH):
             for thumbfile in os.scandir(database.db_constants.THUMBNAIL_PATH):
-                GalleryDB.clear_thumb(thumbfile.path)
+                try:
+                    os.unlink(thumbfile.path)
+                except FileNotFoundError:
+                    pass
+                except:
+                    log.exception('Failed to delete thumb {}'.format(thumbfile.name.encode(errors='ignore')))
+
+    @classmethod
+    def collect_thumb_garbage(cls):
+        "Removes thumbnails no gallery or list uses anymore, see ThumbnailStore.collect_garbage"
+        used = []
+        for table in ('series', 'list'):
+            for r in cls.execute(cls, 'SELECT profile FROM {}'.format(table)):
+                if r[0]:
+                    used.append(r[0] if isinstance(r[0], str) else bytes.decode(r[0]))
+        return thumbnail_store.ThumbnailStore.collect_garbage(used)
 
     @staticmethod
     def rebuild_gallery(gallery, thumb=False):
@@ -385,6 +395,10 @@ class GalleryDB(database.db.DBBase):
         for query in executing:
             cls.execute(cls, *query)
 
+        # also for attributes that aren't indexed, so searches narrowing down the last one don't reuse its matches
+        search_index.SearchIndex.invalidate(series_id)
+        execute(GalleryList.update_enforced, True, [series_id])
+
     @classmethod
     def get_all_gallery(cls, chapters=True, tags=True, hashes=True):
         """
@@ -396,19 +410,22 @@ class GalleryDB(database.db.DBBase):
         return GalleryDB.gen_galleries(all_gallery, chapters, tags, hashes)
 
     @staticmethod
-    def gen_galleries(gallery_dict, chapters=True, tags=True, hashes=True):
+    def gen_galleries(gallery_dict, chapters=True, tags=True, hashes=True, check_links=True, lists=True):
         """
         Map galleries fetched from DB
+        Pass check_links=False to leave finding dead links to a DeadLinkChecker later,
+        and lists=False to map the galleries to their lists later
         """
         gallery_list = []
         for gallery_row in gallery_dict:
             gallery = Gallery()
             gallery.id = gallery_row['series_id']
             gallery = gallery_map(gallery_row, gallery, chapters, tags, hashes)
-            if not os.path.exists(gallery.path):
-                gallery.dead_link = True
-            ListDB.query_gallery(gallery)
             gallery_list.append(gallery)
+        if check_links:
+            dead_links.DeadLinkChecker.check(gallery_list)
+        if lists:
+            ListDB.query_galleries(gallery_list)
 
         return gallery_list
 
@@ -447,9 +464,6 @@ class GalleryDB(database.db.DBBase):
         assert isinstance(object, Gallery), "add_gallery method only accepts gallery items"
         log_i('Recevied gallery: {}'.format(object.path.encode(errors='ignore')))
 
-        #TODO: implement mass gallery adding!  User execute_many method for
-        #effeciency!
-
         cursor = cls.execute(cls, *default_exec(object))
         series_id = cursor.lastrowid
         object.id = series_id
@@ -458,6 +472,50 @@ class GalleryDB(database.db.DBBase):
         if object.tags:
             TagDB.add_tags(object)
         ChapterDB.add_chapters(object)
+        execute(GalleryList.update_enforced, True, [object])
+
+    @classmethod
+    def add_galleries(cls, galleries):
+        """
+        Adds a list of galleries of <Gallery> class into database.
+        Everything is inserted in one transaction with a handful of batched queries,
+        so it's a lot faster than calling add_gallery for every gallery.
+        Missing thumbnails are generated afterwards and saved together.
+        """
+        assert isinstance(galleries, list), "add_galleries method only accepts a list of galleries"
+        assert all(isinstance(g, Gallery) for g in galleries), "add_galleries method only accepts gallery items"
+        if not galleries:
+            return
+        log_i('Recevied {} galleries'.format(len(galleries)))
+
+        try:
+            with cls.transaction():
+                # series ids are assigned here instead of by sqlite so we know them without a query per gallery,
+                # this is safe since all writes happen on the same thread
+                next_id = (cls.execute(cls, 'SELECT MAX(series_id) FROM series').fetchone()[0] or 0) + 1
+                for g in galleries:
+                    g.id = next_id
+                    next_id += 1
+                cls.executemany(cls, default_exec(galleries[0], True)[0],
+                                [default_exec(g, True)[1] for g in galleries])
+                TagDB.add_tags_for_galleries([g for g in galleries if g.tags])
+                ChapterDB.add_chapters_for_galleries(galleries)
+        except:
+            for g in galleries:
+                g.id = None
+            raise
+        execute(GalleryList.update_enforced, True, galleries)
+
+        no_profile = [g for g in galleries if not g.profile]
+        if no_profile:
+            executors.Executors.generate_thumbnails(no_profile,
+                on_method=lambda gs: execute(GalleryDB.set_profiles, True, gs, priority=0))
+
+    @classmethod
+    def set_profiles(cls, galleries):
+        "Saves the thumbnail paths of the given galleries"
+        cls.executemany(cls, 'UPDATE series SET profile=? WHERE series_id=?',
+                        [(str.encode(g.profile), g.id) for g in galleries if g.profile and g.id])
 
     @classmethod
     def gallery_count(cls):
@@ -490,9 +548,12 @@ class GalleryDB(database.db.DBBase):
                     log_e('Failed to delete gallery:{}, {}'.format(gallery.id,
                                                       gallery.title.encode('utf-8', 'ignore')))
                     continue
+                # the cached listing would still have it
+                dead_links.DeadLinkChecker.invalidate(os.path.dirname(gallery.path))
 
             GalleryDB.clear_thumb(gallery.profile)
             cls.execute(cls, 'DELETE FROM series WHERE series_id=?', (gallery.id,))
+            GalleryList.forget([gallery.id])
             gallery.id = None
             log_i('Successfully deleted: {}'.format(gallery.title.encode('utf-8', 'ignore')))
             app_constants.NOTIF_BAR.add_text('Successfully deleted: {}'.format(gallery.title))
@@ -502,6 +563,7 @@ class GalleryDB(database.db.DBBase):
         """
         Checks if provided string exists in provided sorted
         list based on path name.
+        A set of normcased paths can be given instead of the sorted list.
         Note: key will be normcased
         """
         #pdb.set_trace()
@@ -516,6 +578,8 @@ class GalleryDB(database.db.DBBase):
             filter_list = sorted(filter_list)
         else:
             filter_list = galleries
+            if isinstance(filter_list, (set, frozenset)):
+                return os.path.normcase(name) in filter_list
 
         def binary_search(key):
             low = 0
@@ -536,8 +600,10 @@ class ChapterDB(database.db.DBBase):
     """
     Provides the following database methods:
         update_chapter -> Updates an existing chapter in DB
+        update_chapter_pages -> Updates the page count of a chapter in DB
         add_chapter -> adds chapter into db
         add_chapter_raw -> links chapter to the given seires id, and adds into db
+        add_chapters_for_galleries -> adds the chapters of many galleries into db
         get_chapters_for_gallery -> returns a dict with chapters linked to the given series_id
         get_chapters_for_galleries -> assign chapters to galleries according to their id as series_id
         get_chapter-> returns a dict with chapter matching the given chapter_number
@@ -573,6 +639,12 @@ class ChapterDB(database.db.DBBase):
         cls.executemany(cls, "UPDATE chapters SET chapter_title=?, chapter_path=?, pages=?, in_archive=? WHERE series_id=? AND chapter_number=?",
             executing)
 
+    @classmethod
+    def update_chapter_pages(cls, series_id, chapter_number, pages):
+        "Updates the page count of the chapter with the given number"
+        cls.execute(cls, 'UPDATE chapters SET pages=? WHERE series_id=? AND chapter_number=?',
+                    (pages, series_id, chapter_number))
+
     @classmethod
     def add_chapters(cls, gallery_object):
         "Adds chapters linked to gallery into database"
@@ -585,6 +657,31 @@ class ChapterDB(database.db.DBBase):
             raise Exception
         cls.executemany(cls, 'INSERT INTO chapters VALUES(NULL, ?, ?, ?, ?, ?, ?)', executing)
 
+    @classmethod
+    def add_chapters_for_galleries(cls, galleries):
+        """
+        Adds the chapters of many galleries with a single query.
+        Page hashes and manifests already known by the chapters are added as well.
+        """
+        next_id = (cls.execute(cls, 'SELECT MAX(chapter_id) FROM chapters').fetchone()[0] or 0) + 1
+        executing = []
+        hashes = []
+        manifests = []
+        for gallery in galleries:
+            for chap in gallery.chapters:
+                executing.append((next_id,) + default_chap_exec(gallery, chap, True))
+                if chap.hashes:
+                    hashes.extend((h, gallery.id, next_id, page) for page, h in chap.hashes.items())
+                    chap.hashes = None
+                if chap.manifest:
+                    manifests.append((next_id, chap.manifest))
+                next_id += 1
+        cls.executemany(cls, 'INSERT INTO chapters VALUES(?, ?, ?, ?, ?, ?, ?)', executing)
+        if hashes:
+            HashDB.add_hashes(hashes)
+        if manifests:
+            PageDB.save_manifests(manifests)
+
     @classmethod
     def add_chapters_raw(cls, series_id, chapters_container):
         "Adds chapter(s) to a gallery with the received series_id"
@@ -699,11 +796,13 @@ class TagDB(database.db.DBBase):
     del_tags <- Deletes the tags with corresponding tag_ids from DB
     del_gallery_tags_mapping <- Deletes the tags and gallery mappings with corresponding series_ids from DB
     get_gallery_tags -> Returns all tags and namespaces found for the given series_id;
+    get_tags_for_galleries -> Assigns tags to galleries according to their id as series_id
     get_tag_gallery -> Returns all galleries with the given tag
     get_ns_tags -> "Returns a dict with namespace as key and list of tags as value"
     get_ns_tags_to_gallery -> Returns all galleries linked to the namespace tags. Receives a dict like this: {"namespace":["tag1","tag2"]}
     get_tags_from_namespace -> Returns all galleries linked to the namespace
     add_tags <- Adds the given dict_of_tags to the given series_id
+    add_tags_for_galleries <- Adds the tags of many galleries at once
     modify_tags <- Modifies the given tags
     get_all_tags -> Returns all tags in database
     get_all_ns -> Returns all namespaces in database
@@ -755,83 +854,101 @@ class TagDB(database.db.DBBase):
 
         return dict(tags)
 
+    @classmethod
+    def get_tags_for_galleries(cls, galleries: list['Gallery']):
+        """
+        Loads the tags of all given galleries with one query and sets their tags attribute
+        according to their id ("series_id").
+        Namespace and tag strings are interned since the same ones are shared by many galleries.
+        """
+        galleries_by_id = {g.id: g for g in galleries}
+
+        # same joins as in get_gallery_tags but for all galleries, rows arrive grouped by series_id
+        cursor = cls.execute(cls, 'SELECT series_tags_map.series_id, namespaces.namespace, tags.tag FROM series_tags_map \
+                                    INNER JOIN tags_mappings ON tags_mappings.tags_mappings_id=series_tags_map.tags_mappings_id \
+                                    INNER JOIN namespaces ON tags_mappings.namespace_id=namespaces.namespace_id \
+                                    INNER JOIN tags ON tags_mappings.tag_id=tags.tag_id \
+                                    ORDER BY series_tags_map.series_id')
+
+        current_id = None
+        tags = None
+
+        def assign(series_id, tags):
+            gallery = galleries_by_id.pop(series_id, None)
+            if gallery is not None:
+                gallery.tags = dict(tags)
+
+        for series_id, namespace, tag in cursor:
+            if series_id != current_id:
+                if current_id is not None:
+                    assign(current_id, tags)
+                current_id = series_id
+                tags = defaultdict(list)
+            tags[sys.intern(namespace)].append(sys.intern(tag))
+
+        if current_id is not None:
+            assign(current_id, tags)
+
+        # galleries without any tags
+        for gallery in galleries_by_id.values():
+            gallery.tags = {}
+
+        return True
+
     @classmethod
     def add_tags(cls, object):
         "Adds the given dict_of_tags to the given series_id"
         assert isinstance(object, Gallery), "Please provide a valid gallery of class gallery"
+        cls.add_tags_for_galleries([object])
 
-        series_id = object.id
-        dict_of_tags = object.tags
-
-        def look_exists(tag_or_ns, what):
-            """Check if tag or namespace already exists in base. Return id if it does else None."""
-            c = cls.execute(cls, 'SELECT {}_id FROM {}s WHERE {} = ?'.format(what, what, what),
-                (tag_or_ns,))
-            try: # exists
-                return c.fetchone()['{}_id'.format(what)]
-            except TypeError: # doesnt exist
-                return None
-            except IndexError:
-                return None
-
-        tags_mappings_id_list = []
-        # first let's add the tags and namespaces to db
-        for namespace in dict_of_tags:
-            tags_list = dict_of_tags[namespace]
-            # don't add if it already exists
-            try:
-                namespace_id = look_exists(namespace, "namespace")
-                if not namespace_id:
-                    raise ValueError
-            except ValueError:
-                c = cls.execute(cls, 'INSERT INTO namespaces(namespace) VALUES(?)', (namespace,))
-                namespace_id = c.lastrowid
-
-            tags_id_list = []
-            for tag in tags_list:
-                try:
-                    tag_id = look_exists(tag, "tag")
-                    if not tag_id:
-                        raise ValueError
-                except ValueError:
-                    c = cls.execute(cls, 'INSERT INTO tags(tag) VALUES(?)', (tag,))
-                    tag_id = c.lastrowid
-
-                tags_id_list.append(tag_id)
-
-
-            def look_exist_tag_map(tag_id):
-                "Checks DB if the tag_id already exists with the namespace_id, returns id else None"
-                c = cls.execute(cls, 'SELECT tags_mappings_id FROM tags_mappings WHERE namespace_id=? AND tag_id=?',
-                    (namespace_id, tag_id,))
-                try: # exists
-                    return c.fetchone()['tags_mappings_id']
-                except TypeError: # doesnt exist
-                    return None
-                except IndexError:
-                    return None
+    @classmethod
+    def add_tags_for_galleries(cls, galleries):
+        """
+        Adds the tags of many galleries at once.
+        Namespaces, tags and their mappings are inserted as sets and their ids looked up
+        in chunks afterwards, instead of checking every tag on its own.
+        """
+        namespaces = set()
+        tags = set()
+        ns_tags = set()
+        for g in galleries:
+            for ns, tag_list in g.tags.items():
+                namespaces.add(ns)
+                for tag in tag_list:
+                    tags.add(tag)
+                    ns_tags.add((ns, tag))
+        if not namespaces:
+            return
 
-            # time to map the tags to the namespace now
-            for tag_id in tags_id_list:
-                # First check if tags mappings exists
-                try:
-                    t_map_id = look_exist_tag_map(tag_id)
-                    if t_map_id:
-                        tags_mappings_id_list.append(t_map_id)
-                    else:
-                        raise TypeError
-                except TypeError:
-                    c = cls.execute(cls, 'INSERT INTO tags_mappings(namespace_id, tag_id) VALUES(?, ?)',
-                     (namespace_id, tag_id,))
-                    # add the tags_mappings_id to our list
-                    tags_mappings_id_list.append(c.lastrowid)
+        def ids_of(what, values):
+            "Inserts the namespaces or tags that don't exist yet and returns a dict of value and id"
+            cls.executemany(cls, 'INSERT OR IGNORE INTO {0}s({0}) VALUES(?)'.format(what), ((v,) for v in values))
+            found = {}
+            for chunk in database.db.chunks(values):
+                c = cls.execute(cls, 'SELECT {0}_id, {0} FROM {0}s WHERE {0} IN ({1})'.format(
+                    what, ','.join('?'*len(chunk))), chunk)
+                found.update((r[what], r['{}_id'.format(what)]) for r in c)
+            return found
+
+        ns_ids = ids_of('namespace', namespaces)
+        tag_ids = ids_of('tag', tags)
+        id_pairs = {(ns_ids[ns], tag_ids[tag]) for ns, tag in ns_tags}
+        cls.executemany(cls, 'INSERT OR IGNORE INTO tags_mappings(namespace_id, tag_id) VALUES(?, ?)', id_pairs)
+        mapping_ids = {}
+        for chunk in database.db.chunks({t for _, t in id_pairs}):
+            c = cls.execute(cls, 'SELECT tags_mappings_id, namespace_id, tag_id FROM tags_mappings WHERE tag_id IN ({})'.format(
+                ','.join('?'*len(chunk))), chunk)
+            for r in c:
+                pair = (r['namespace_id'], r['tag_id'])
+                if pair in id_pairs:
+                    mapping_ids[pair] = r['tags_mappings_id']
 
         # Lastly we map the series_id to the tags_mappings
         executing = []
-        for tags_map in tags_mappings_id_list:
-            executing.append((series_id, tags_map,))
-            #cls.execute(cls, 'INSERT INTO series_tags_map(series_id, tags_mappings_id)
-            #VALUES(?, ?)', (series_id, tags_map,))
+        for g in galleries:
+            for ns, tag_list in g.tags.items():
+                for tag in tag_list:
+                    executing.append((g.id, mapping_ids[(ns_ids[ns], tag_ids[tag])]))
         cls.executemany(cls, 'INSERT OR IGNORE INTO series_tags_map(series_id, tags_mappings_id) VALUES(?, ?)', executing)
 
     @staticmethod
@@ -944,12 +1061,37 @@ class ListDB(database.db.DBBase):
     @classmethod
     def query_gallery(cls, gallery):
         "Maps gallery to the correct lists"
+        cls.query_galleries([gallery])
 
-        c = cls.execute(cls, 'SELECT list_id FROM series_list_map WHERE series_id=?', (gallery.id,))
-        list_rows = [x['list_id'] for x in c.fetchall()]
+    @classmethod
+    def query_galleries(cls, galleries):
+        "Maps many galleries to the correct lists, looking up the lists of a batch of galleries at once"
+        by_id = {g.id: g for g in galleries}
+        members = defaultdict(list)
+        for chunk in database.db.chunks(by_id):
+            c = cls.execute(cls, 'SELECT series_id, list_id FROM series_list_map WHERE series_id IN ({})'.format(
+                ','.join('?' * len(chunk))), chunk)
+            for r in c.fetchall():
+                members[r['list_id']].append(by_id[r['series_id']])
+        cls._add_members(members)
+
+    @classmethod
+    def query_all_galleries(cls, galleries):
+        "Maps the whole library to the correct lists with one pass over the list map, for when all galleries are loaded"
+        by_id = {g.id: g for g in galleries}
+        members = defaultdict(list)
+        c = cls.execute(cls, 'SELECT list_id, series_id FROM series_list_map')
+        for r in c.fetchall():
+            gallery = by_id.get(r['series_id'])
+            if gallery is not None:
+                members[r['list_id']].append(gallery)
+        cls._add_members(members)
+
+    @staticmethod
+    def _add_members(members):
         for l in app_constants.GALLERY_LISTS:
-            if l._id in list_rows:
-                l.add_gallery(gallery, False, _check_filter=False)
+            if l._id in members:
+                l.add_gallery(members[l._id], False, _check_filter=False)
 
     @classmethod
     def modify_list(cls, gallery_list):
@@ -1021,86 +1163,79 @@ class ListDB(database.db.DBBase):
 
 class HashDB(database.db.DBBase):
     """
+    Hashes are hex digests, they're stored as bytes in DB.
     Contains the following methods:
 
+    digest -> returns the bytes of a hex digest as stored in DB
+    hexdigest -> returns the hex digest of the bytes stored in DB
     find_gallery -> returns galleries which matches the given list of hashes
     get_gallery_hashes -> returns all hashes with the given gallery id in a list
     get_multiple_gallery_hashes -> retrieves all hashes and assigns them to multiple galleries based on their id
     get_gallery_hash -> returns hash of chapter specified. If page is specified, returns hash of chapter page
+    get_chapter_hashes -> returns the id and the saved hashes of a chapter
+    add_hashes <- saves many hashes at once
+    get_unhashed_chapters -> returns the chapters with missing hashes
+    get_sharing_galleries -> returns the galleries sharing pages with a gallery and how many
+    get_shared_pages -> returns every page found in more than one gallery
+    gen_gallery_hash -> returns hashes of a chapter, generating and saving missing ones
     gen_gallery_hashes <- generates hashes for gallery's chapters and inserts them to db
     rebuild_gallery_hashes <- inserts hashes into DB only if it doesnt already exist
     """
 
+    @staticmethod
+    def digest(hash):
+        "Returns the bytes of the given hex digest as they are stored in DB"
+        return bytes.fromhex(hash) if isinstance(hash, str) else hash
+
+    @staticmethod
+    def hexdigest(digest):
+        "Returns the hex digest of the given bytes stored in DB"
+        return digest.hex() if isinstance(digest, bytes) else digest
+
     @classmethod
     def find_gallery(cls, hashes):
+        """
+        Returns a weak gallery with only the id set of the gallery with the most matching hashes,
+        None if any of the hashes isn't found
+        """
         assert isinstance(hashes, list)
-        gallery_ids = {}
-        hash_status = []
+        found = defaultdict(list)
+        for chunk in database.db.chunks({cls.digest(h) for h in hashes}, database.db.MAX_SQL_VARIABLES):
+            c = cls.execute(cls, 'SELECT hash, series_id FROM hashes WHERE hash IN ({})'.format(
+                ','.join('?' * len(chunk))), chunk)
+            for r in c.fetchall():
+                found[r['hash']].append(r['series_id'])
+
+        gallery_ids = defaultdict(int)
         for hash in hashes:
-            r = cls.execute(cls, 'SELECT series_id FROM hashes WHERE hash=?', (hash,))
-            try:
-                g_ids = r.fetchall()
-                for r in g_ids:
-                    g_id = r['series_id']
-                    if g_id not in gallery_ids:
-                        gallery_ids[g_id] = 1
-                    else:
-                        gallery_ids[g_id] = gallery_ids[g_id] + 1
-                if g_ids:
-                    hash_status.append(True)
-                else:
-                    hash_status.append(False)
-            except KeyError:
-                hash_status.append(False)
-            except TypeError:
-                hash_status.append(False)
+            g_ids = found.get(cls.digest(hash))
+            if not g_ids:
+                return None
+            for g_id in g_ids:
+                gallery_ids[g_id] += 1
 
-        if all(hash_status):
+        if gallery_ids:
             # the one with most matching hashes
-            g_id = None
-            h_match_count = 0
-            for g in gallery_ids:
-                if gallery_ids[g] > h_match_count:
-                    h_match_count = gallery_ids[g]
-                    g_id = g
-            if g_id:
-                weak_gallery = Gallery()
-                weak_gallery.id = g_id
-                return weak_gallery
-
+            weak_gallery = Gallery()
+            weak_gallery.id = max(gallery_ids, key=gallery_ids.get)
+            return weak_gallery
         return None
-    
+
     @classmethod
     def get_gallery_hashes(cls, gallery_id):
         "Returns all hashes with the given gallery id in a list"
         cursor = cls.execute(cls, 'SELECT hash FROM hashes WHERE series_id=?', (gallery_id,))
-        hashes = []
-        try:
-            for row in cursor.fetchall():
-                hashes.append(row['hash'])
-        except IndexError:
-            return []
-        return hashes
+        return [cls.hexdigest(row['hash']) for row in cursor.fetchall()]
 
     @classmethod
     def get_multiple_gallery_hashes(cls, galleries: list['Gallery']):
         """Assign lists of hashes to galleries based on their id ("series_id")"""
-        # hashes(
-        #     hash_id INTEGER PRIMARY KEY,
-        #     hash BLOB,
-        #     series_id INTEGER,
-        #     chapter_id INTEGER,
-        #     page INTEGER,
-        #     FOREIGN KEY(series_id) REFERENCES series(series_id) ON DELETE CASCADE,
-        #     FOREIGN KEY(chapter_id) REFERENCES chapters(chapter_id) ON DELETE CASCADE,
-        #     UNIQUE(hash, series_id, chapter_id, page)
-        # )
         hashes = defaultdict(list)
-        
-        cursor = cls.execute(cls, 'SELECT series_id, hash FROM hashes')
-        rows = cursor.fetchall()
-        for row in rows:
-            hashes[row['series_id']].append(row['hash'])
+        for chunk in database.db.chunks({g.id for g in galleries if g.id != None}, database.db.MAX_SQL_VARIABLES):
+            cursor = cls.execute(cls, 'SELECT series_id, hash FROM hashes WHERE series_id IN ({})'.format(
+                ','.join('?' * len(chunk))), chunk)
+            for row in cursor.fetchall():
+                hashes[row['series_id']].append(cls.hexdigest(row['hash']))
 
         for gallery in galleries:
             gallery.hashes = hashes[gallery.id]
@@ -1123,14 +1258,65 @@ class HashDB(database.db.DBBase):
             executing = ["SELECT hash FROM hashes WHERE series_id=? AND chapter_id=? AND page=?", (gallery_id, chap_id, page)]
         else:
             executing = ["SELECT hash FROM hashes WHERE series_id=? AND chapter_id=?", (gallery_id, chap_id)]
-        hashes = []
         c = cls.execute(cls, *executing)
-        for h in c.fetchall():
-            try:
-                hashes.append(h['hash'])
-            except KeyError:
-                pass
-        return hashes
+        return [cls.hexdigest(h['hash']) for h in c.fetchall()]
+
+    @classmethod
+    def get_chapter_hashes(cls, series_id, chapter_number):
+        "Returns a tuple of the chapter id, or None if it's not in DB, and a dict of page and hash of its saved hashes"
+        chap_id = ChapterDB.get_chapter_id(series_id, chapter_number)
+        if chap_id is None:
+            return None, {}
+        c = cls.execute(cls, 'SELECT hash, page FROM hashes WHERE series_id=? AND chapter_id=?', (series_id, chap_id))
+        return chap_id, {r['page']: cls.hexdigest(r['hash']) for r in c.fetchall() if r['hash'] and r['page'] != None}
+
+    @classmethod
+    def add_hashes(cls, hashes):
+        "Saves a list of (hash, series_id, chapter_id, page) in one transaction, replacing older hashes of the pages"
+        if not hashes:
+            return
+        with cls.transaction():
+            cls.executemany(cls, 'INSERT OR REPLACE INTO hashes(hash, series_id, chapter_id, page) VALUES(?, ?, ?, ?)',
+                            [(cls.digest(h),) + tuple(r) for h, *r in hashes])
+
+    @classmethod
+    def get_unhashed_chapters(cls, max_pages=None):
+        """
+        Returns a list of (series_id, chapter_number, pages) of the chapters with missing hashes,
+        only the first max_pages pages of a chapter count if given
+        """
+        c = cls.execute(cls, """SELECT chapters.series_id, chapters.chapter_number, chapters.pages FROM chapters
+            LEFT JOIN hashes ON hashes.chapter_id = chapters.chapter_id
+            GROUP BY chapters.chapter_id HAVING COUNT(hashes.hash_id) < MIN(chapters.pages, ?)
+            ORDER BY chapters.series_id, chapters.chapter_number""",
+            (max_pages if max_pages is not None else sys.maxsize,))
+        return [(r['series_id'], r['chapter_number'], r['pages']) for r in c.fetchall()]
+
+    @classmethod
+    def get_sharing_galleries(cls, gallery_id):
+        """
+        Returns a list of (gallery id, amount of shared pages) of the galleries
+        which have pages with the same hash as pages of the given gallery, most shared pages first
+        """
+        c = cls.execute(cls, """SELECT other.series_id, COUNT(DISTINCT other.hash) AS shared FROM hashes AS mine
+            JOIN hashes AS other ON other.hash = mine.hash AND other.series_id != mine.series_id
+            WHERE mine.series_id=? GROUP BY other.series_id ORDER BY shared DESC, other.series_id""", (gallery_id,))
+        return [(r['series_id'], r['shared']) for r in c.fetchall()]
+
+    @classmethod
+    def get_shared_pages(cls, min_galleries=2):
+        """
+        Returns a dict of hash and a list of (gallery id, chapter number, page) of the pages
+        found in at least min_galleries galleries
+        """
+        c = cls.execute(cls, """SELECT hashes.hash, hashes.series_id, chapters.chapter_number, hashes.page FROM hashes
+            JOIN chapters ON chapters.chapter_id = hashes.chapter_id
+            WHERE hashes.hash IN (SELECT hash FROM hashes GROUP BY hash HAVING COUNT(DISTINCT series_id) >= ?)
+            ORDER BY hashes.hash, hashes.series_id, chapters.chapter_number, hashes.page""", (min_galleries,))
+        pages = defaultdict(list)
+        for r in c.fetchall():
+            pages[cls.hexdigest(r['hash'])].append((r['series_id'], r['chapter_number'], r['page']))
+        return dict(pages)
 
     @classmethod
     def gen_gallery_hash(cls, gallery, chapter, page=None, color_img=False, _name=None):
@@ -1140,183 +1326,87 @@ class HashDB(database.db.DBBase):
         page: 'mid' or number or list of numbers
         color_img: if true then a hash to colored img will be returned if possible
         Returns dict with chapter number or 'mid' as key and hash as value
+        Can be called from any thread, saved hashes are looked up with one query and
+        missing ones are generated by the PageHasher, away from the DB thread, and saved in a batch.
         """
         assert isinstance(gallery, Gallery)
         assert isinstance(chapter, int)
         if page != None:
             assert isinstance(page, (int, str, list))
-        skip_gen = False
-        if gallery.id:
-            chap_id = ChapterDB.get_chapter_id(gallery.id, chapter)
-            
-            c = cls.execute(cls, 'SELECT hash, page FROM hashes WHERE series_id=? AND chapter_id=?',
-                   (gallery.id, chap_id,))
-            hashes = {}
-            for r in c.fetchall():
-                try:
-                    if r['hash'] and r['page'] != None:
-                        hashes[r['page']] = r['hash']
-                except TypeError:
-                    pass
-            if isinstance(page, (int, list)):
-                if isinstance(page, int):
-                    _page = [page]
-                else:
-                    _page = page
-                h = {}
-                t = False
-                for p in _page:
-                    if p in hashes:
-                        h[p] = hashes[p]
-                    else:
-                        t = True
-                if not t:
-                    skip_gen = True
-                    hashes = h
-
-            elif gallery.chapters[chapter].pages == len(hashes.keys()):
-                skip_gen = True
-                if page == "mid":
-                    try:
-                        hashes = {'mid':hashes[len(hashes) // 2]}
-                    except KeyError:
-                        skip_gen = False
-
-
-        if not skip_gen or color_img:
-
-            def look_exists(page):
-                """check if hash already exists in database
-                returns hash, else returns None"""
-                c = cls.execute(cls, 'SELECT hash FROM hashes WHERE page=? AND chapter_id=?',
-                       (page, chap_id,))
-                try: # exists
-                    return c.fetchone()['hash']
-                except TypeError: # doesnt exist
-                    return None
-                except IndexError:
-                    return None
 
-            if gallery.dead_link:
-                log_e("Could not generate hash of dead gallery: {}".format(gallery.title.encode(errors='ignore')))
-                return {}
+        if gallery.dead_link:
+            log_e("Could not generate hash of dead gallery: {}".format(gallery.title.encode(errors='ignore')))
+            return {}
 
+        try:
+            chap = gallery.chapters[chapter]
+        except KeyError:
+            utils.make_chapters(gallery)
             try:
                 chap = gallery.chapters[chapter]
             except KeyError:
-                utils.make_chapters(gallery)
-                try:
-                    chap = gallery.chapters[chapter]
-                except KeyError:
-                    return {}
-                
-            executing = []
-            try:
-                if gallery.is_archive:
-                    raise NotADirectoryError
-                imgs = sorted([x.path for x in os.scandir(chap.path) if x.path.lower().endswith(utils.IMG_FILES)])
-                pages = {}
-                for n, i in enumerate(imgs):
-                    pages[n] = i
-
-                if page != None:
-                    pages = {}
-                    if color_img:
-                        # if first img is colored, then return filepath of that
-                        if not utils.image_greyscale(imgs[0]):
-                            return {'color':imgs[0]}
-                    if page == 'mid':
-                        imgs = imgs[len(imgs) // 2]
-                        pages[len(imgs) // 2] = imgs
-                    elif isinstance(page, list):
-                        try:
-                            for p in page:
-                                pages[p] = imgs[p]
-                        except IndexError:
-                            raise app_constants.InternalPagesMismatch
-                    else:
-                        imgs = imgs[page]
-                        pages = {page:imgs}
-
-                hashes = {}
-                if gallery.id != None:
-                    for p in pages:
-                        h = look_exists(p)
-                        if not h:
-                            with open(pages[p], 'rb') as f:
-                                h = utils.generate_img_hash(f)
-                            executing.append((h, gallery.id, chap_id, p,))
-                        hashes[p] = h
-                else:
-                    for i in pages:
-                        with open(pages[i], 'rb') as f:
-                            hashes[i] = utils.generate_img_hash(f)
+                return {}
 
-            except (NotADirectoryError, OSError):
-                temp_dir = os.path.join(app_constants.temp_dir, str(uuid.uuid4()))
-                is_archive = gallery.is_archive
-                try:
-                    if is_archive:
-                        arch = utils.ArchiveFile(gallery.path)
-                    else:
-                        arch = utils.ArchiveFile(chap.path)
-                except app_constants.CreateArchiveFail:
-                    log_e('Could not generate hash: CreateZipFail')
-                    return {}
+        chap_id, saved = None, {}
+        if gallery.id != None:
+            chap_id, saved = execute(HashDB.get_chapter_hashes, False, gallery.id, chapter, read=True)
 
-                try:
-                    pages = {}
-                    if page != None:
-                        p = 0
-                        con = sorted(arch.dir_contents(chap.path))
-                        if color_img:
-                            # if first img is colored, then return hash of that
-                            with io.BytesIO(arch.open(con[0], False)) as f_bytes:
-                                if not utils.image_greyscale(f_bytes):
-                                    return {'color': arch.extract(con[0])}
-                        if page == 'mid':
-                            p = len(con) // 2
-                            img = con[p]
-                            pages = {p: arch.open(img, True)}
-                        elif isinstance(page, list):
-                            for x in page:
-                                pages[x] = arch.open(con[x], True)
-                        else:
-                            p = page
-                            img = con[p]
-                            pages = {p: arch.open(img, True)}
-                    else:
-                        imgs = sorted(arch.dir_contents(chap.path))
-                        for n, img in enumerate(imgs):
-                            pages[n] = arch.open(img, True)
-                finally:
-                    arch.close()
-
-                hashes = {}
-                if gallery.id != None:
-                    for p in pages:
-                        h = look_exists(p)
-                        if not h:
-                            h = utils.generate_img_hash(pages[p])
-                            executing.append((h, gallery.id, chap_id, p,))
-                        hashes[p] = h
-                else:
-                    for i in pages:
-                        hashes[i] = utils.generate_img_hash(pages[i])
+        # the manifest isn't needed if all the hashes asked for are saved
+        if not color_img:
+            wanted = cls._wanted_pages(page, chap.pages)
+            if wanted and all(p in saved for p in wanted):
+                return cls._hash_result({p: saved[p] for p in wanted}, page, _name)
+
+        try:
+            # also corrects the page count of the chapter if it's off
+            names = [p.name for p in chap.get_manifest().pages]
+        except (OSError, app_constants.CreateArchiveFail, app_constants.FileNotFoundInArchive):
+            log.exception('Could not generate hash: could not read pages of {}'.format(chap.path.encode(errors='ignore')))
+            return {}
+        if not names:
+            return {}
+
+        wanted = cls._wanted_pages(page, chap.pages)
+        if any(p >= len(names) for p in wanted):
+            raise app_constants.InternalPagesMismatch
+
+        if page != None and color_img:
+            # if first img is colored, then return filepath of that
+            color = PageHasher.color_page(chap, names[0])
+            if color:
+                return {'color': color}
+
+        missing = {p: names[p] for p in wanted if not p in saved}
+        try:
+            generated = PageHasher.hash_pages(chap, missing) if missing else {}
+        except (OSError, app_constants.CreateArchiveFail, app_constants.FileNotFoundInArchive):
+            log.exception('Could not generate hash of {}'.format(chap.path.encode(errors='ignore')))
+            return {}
+        if chap_id != None and generated:
+            execute(HashDB.add_hashes, True, [(h, gallery.id, chap_id, p) for p, h in generated.items()])
+        hashes = {p: saved[p] if p in saved else generated[p] for p in wanted if p in saved or p in generated}
+        return cls._hash_result(hashes, page, _name)
 
-            if executing:
-                cls.executemany(cls, 'INSERT INTO hashes(hash, series_id, chapter_id, page) VALUES(?, ?, ?, ?)',
-                       executing)
+    @staticmethod
+    def _wanted_pages(page, pages):
+        "Returns a list of the page numbers asked for, pages is the page count of the chapter"
+        if page == None:
+            return list(range(pages))
+        elif page == 'mid':
+            return [pages // 2]
+        return [page] if isinstance(page, int) else page
 
+    @staticmethod
+    def _hash_result(hashes, page, _name):
         if page == 'mid':
-            r_hash = {'mid':list(hashes.values())[0]}
+            r_hash = {'mid': list(hashes.values())[0]} if hashes else {}
         else:
             r_hash = hashes
 
         if _name != None:
             try:
                 r_hash[_name] = r_hash[page]
-            except KeyError:
+            except (KeyError, TypeError):
                 pass
         return r_hash
 
@@ -1340,6 +1430,381 @@ class HashDB(database.db.DBBase):
         "Deletes all hashes linked to the given gallery id"
         cls.execute(cls, 'DELETE FROM hashes WHERE series_id=?', (gallery_id,))
 
+class PHashDB(database.db.DBBase):
+    """
+    Keeps the perceptual hashes of the pages of the first chapter of galleries,
+    which stay close for resized or re-encoded copies of a page, see phash_index.
+    Like page hashes, only the first HASH_GALLERY_PAGES pages are hashed.
+
+    get_all_phashes -> returns the saved perceptual hashes of all galleries
+    add_phashes <- saves many perceptual hashes at once
+    gen_gallery_phashes -> returns the perceptual hashes of a gallery, generating and saving missing ones
+    """
+
+    @staticmethod
+    def _to_db(phash):
+        # sqlite integers are signed 64 bit
+        return phash - (1 << 64) if phash >= 1 << 63 else phash
+
+    @staticmethod
+    def _from_db(value):
+        return value + (1 << 64) if value < 0 else value
+
+    @classmethod
+    def get_all_phashes(cls):
+        "Returns a dict of gallery id and a list of the saved perceptual hashes of its pages"
+        phashes = defaultdict(list)
+        c = cls.execute(cls, 'SELECT series_id, phash FROM phashes')
+        for r in c.fetchall():
+            phashes[r['series_id']].append(cls._from_db(r['phash']))
+        return phashes
+
+    @classmethod
+    def get_chapter_phashes(cls, series_id, chapter_number):
+        "Returns a tuple of the chapter id, or None if it's not in DB, and a dict of page and perceptual hash"
+        chap_id = ChapterDB.get_chapter_id(series_id, chapter_number)
+        if chap_id is None:
+            return None, {}
+        c = cls.execute(cls, 'SELECT page, phash FROM phashes WHERE chapter_id=?', (chap_id,))
+        return chap_id, {r['page']: cls._from_db(r['phash']) for r in c.fetchall()}
+
+    @classmethod
+    def add_phashes(cls, phashes):
+        "Saves a list of (series_id, chapter_id, page, phash) in one transaction"
+        if not phashes:
+            return
+        with cls.transaction():
+            cls.executemany(cls, 'INSERT OR REPLACE INTO phashes(series_id, chapter_id, page, phash) VALUES(?, ?, ?, ?)',
+                            [(g_id, chap_id, page, cls._to_db(h)) for g_id, chap_id, page, h in phashes])
+
+    @classmethod
+    def gen_gallery_phashes(cls, gallery):
+        """
+        Returns a list of the perceptual hashes of the pages of the gallery's first chapter.
+        Missing ones are generated by the PageHasher and saved. Can be called from any thread.
+        """
+        assert isinstance(gallery, Gallery)
+        if gallery.dead_link:
+            return []
+        try:
+            chap = gallery.chapters[0]
+        except KeyError:
+            return []
+
+        chap_id, saved = None, {}
+        if gallery.id != None:
+            chap_id, saved = execute(PHashDB.get_chapter_phashes, False, gallery.id, 0, read=True)
+
+        try:
+            names = [p.name for p in chap.get_manifest().pages]
+        except (OSError, app_constants.CreateArchiveFail, app_constants.FileNotFoundInArchive):
+            log.exception('Could not generate perceptual hashes: could not read pages of {}'.format(
+                chap.path.encode(errors='ignore')))
+            return list(saved.values())
+        hash_pages = app_constants.HASH_GALLERY_PAGES
+        if isinstance(hash_pages, int):
+            names = names[:hash_pages]
+
+        missing = {p: name for p, name in enumerate(names) if not p in saved}
+        generated = {}
+        if missing:
+            try:
+                generated = PageHasher.phash_pages(chap, missing)
+            except (OSError, app_constants.CreateArchiveFail, app_constants.FileNotFoundInArchive):
+                log.exception('Could not generate perceptual hashes of {}'.format(chap.path.encode(errors='ignore')))
+            if chap_id != None and generated:
+                execute(PHashDB.add_phashes, True, [(gallery.id, chap_id, p, h) for p, h in generated.items()])
+        return [saved[p] if p in saved else generated[p] for p in range(len(names)) if p in saved or p in generated]
+
+class PageHasher:
+    """
+    Generates page hashes on a pool of threads instead of the DB thread.
+    hashlib releases the GIL while hashing, so the pages of a folder are read and hashed in parallel.
+    Archives are read in a single pass, see utils.ArchiveFile.scan.
+
+    hash_pages -> returns the hashes of the given pages of a chapter
+    phash_pages -> returns the perceptual hashes of the given pages of a chapter
+    color_page -> returns the path to the given page of a chapter if it's in color
+    backfill -> generates the missing hashes of all galleries, can be throttled and resumed
+    backfill_phashes -> generates the missing perceptual hashes of all galleries, like backfill
+    cancel -> stops a running backfill
+    """
+    _exec = futures.ThreadPoolExecutor(max(2, os.cpu_count() or 1), thread_name_prefix='page-hash')
+    _cancel = threading.Event()
+    # pages of an archive read but not perceptually hashed yet, they're held in memory until then
+    _PENDING_PAGES = 32
+
+    @classmethod
+    def hash_pages(cls, chapter, pages):
+        "Takes a dict of page number and name from the chapter's manifest, returns a dict of page number and hash"
+        archive_path = utils.chapter_archive(chapter)
+        if archive_path:
+            with utils.ArchiveFile(archive_path) as archive:
+                hashes = archive.scan(list(pages.values()))[0]
+            return {n: hashes[name] for n, name in pages.items()}
+        paths = {n: os.path.join(chapter.path, name) for n, name in pages.items()}
+        return dict(zip(paths, cls._exec.map(utils.hash_file, paths.values())))
+
+    @classmethod
+    def phash_pages(cls, chapter, pages):
+        """
+        Takes a dict of page number and name from the chapter's manifest, returns a dict of page number and
+        perceptual hash. Pages which can't be decoded are left out.
+        """
+        archive_path = utils.chapter_archive(chapter)
+        if archive_path:
+            numbers = defaultdict(list)
+            for n, name in pages.items():
+                numbers[name].append(n)
+            # pages are hashed while the archive is read in one pass, reading waits while too many are pending
+            pending = threading.BoundedSemaphore(cls._PENDING_PAGES)
+            fs = []
+            def hash_page(name, data):
+                pending.acquire()
+                f = cls._exec.submit(cls._dhash, data)
+                f.add_done_callback(lambda f: pending.release())
+                fs.append((name, f))
+            with utils.ArchiveFile(archive_path) as archive:
+                archive.read_each(list(numbers), hash_page)
+                phashes = {n: f.result() for name, f in fs for n in numbers[name]}
+        else:
+            paths = {n: os.path.join(chapter.path, name) for n, name in pages.items()}
+            phashes = dict(zip(paths, cls._exec.map(cls._dhash, paths.values())))
+        return {n: h for n, h in phashes.items() if h is not None}
+
+    @staticmethod
+    def _dhash(img):
+        try:
+            return phash_index.dhash(img)
+        except Exception:
+            log.exception('Could not generate perceptual hash of a page')
+            return None
+
+    @staticmethod
+    def color_page(chapter, name):
+        "Returns the path to the page, extracted if it's in an archive, if the page is in color, else None"
+        archive_path = utils.chapter_archive(chapter)
+        if archive_path:
+            with utils.ArchiveFile(archive_path) as archive:
+                with io.BytesIO(archive.read(name)) as f_bytes:
+                    if utils.image_greyscale(f_bytes):
+                        return None
+                return archive.extract(name)
+        path = os.path.join(chapter.path, name)
+        return None if utils.image_greyscale(path) else path
+
+    @classmethod
+    def backfill(cls, delay=None, progress=None):
+        """
+        Generates the missing hashes of all galleries in DB, one chapter at a time.
+        Only chapters with missing hashes are looked at, so a stopped backfill continues where it left off.
+        Waits delay seconds, HASH_BACKFILL_DELAY by default, after each chapter to leave the disk to other work.
+        progress is called with the amount of chapters done and the total amount.
+        Returns the amount of chapters hashed.
+        """
+        if delay is None:
+            delay = app_constants.HASH_BACKFILL_DELAY
+        cls._cancel.clear()
+        hash_pages = app_constants.HASH_GALLERY_PAGES
+        max_pages = hash_pages if isinstance(hash_pages, int) else None
+        chapters = execute(HashDB.get_unhashed_chapters, False, max_pages, read=True)
+        galleries = {g.id: g for g in app_constants.GALLERY_DATA}
+        log_i('Generating missing hashes of {} chapters'.format(len(chapters)))
+        hashed = 0
+        for n, (series_id, chap_number, pages) in enumerate(chapters, 1):
+            if cls._cancel.is_set():
+                log_i('Stopped generating hashes')
+                break
+            gallery = galleries.get(series_id)
+            if gallery and not gallery.dead_link:
+                try:
+                    page = None if max_pages is None else list(range(min(pages, max_pages)))
+                    if HashDB.gen_gallery_hash(gallery, chap_number, page):
+                        hashed += 1
+                except app_constants.InternalPagesMismatch:
+                    log_w('Pages of {} changed, skipped generating hashes'.format(gallery.title.encode(errors='ignore')))
+                except Exception:
+                    log.exception('Could not generate hashes of {}'.format(gallery.title.encode(errors='ignore')))
+            if progress:
+                progress(n, len(chapters))
+            if delay:
+                cls._cancel.wait(delay)
+        return hashed
+
+    @classmethod
+    def backfill_phashes(cls, delay=None, progress=None):
+        """
+        Generates the missing perceptual hashes of all loaded galleries, one gallery at a time.
+        Galleries with saved perceptual hashes are skipped, so a stopped backfill continues where it left off.
+        delay and progress work like in backfill, but per gallery. Returns the amount of galleries hashed.
+        """
+        if delay is None:
+            delay = app_constants.HASH_BACKFILL_DELAY
+        cls._cancel.clear()
+        saved = execute(PHashDB.get_all_phashes, False, read=True)
+        galleries = [g for g in app_constants.GALLERY_DATA if g.id != None and not g.dead_link and not g.id in saved]
+        log_i('Generating missing perceptual hashes of {} galleries'.format(len(galleries)))
+        hashed = 0
+        for n, gallery in enumerate(galleries, 1):
+            if cls._cancel.is_set():
+                log_i('Stopped generating perceptual hashes')
+                break
+            try:
+                if PHashDB.gen_gallery_phashes(gallery):
+                    hashed += 1
+            except Exception:
+                log.exception('Could not generate perceptual hashes of {}'.format(gallery.title.encode(errors='ignore')))
+            if progress:
+                progress(n, len(galleries))
+            if delay:
+                cls._cancel.wait(delay)
+        return hashed
+
+    @classmethod
+    def cancel(cls):
+        "Stops a running backfill after the current chapter. Safe to call from any thread"
+        cls._cancel.set()
+
+class ScanStateDB(database.db.DBBase):
+    """
+    Keeps a snapshot of the entries in the monitored folders, so a rescan only has to look at
+    new or changed entries. Entries are compared by their inode, modification time and size.
+
+    snapshot -> returns the current state of the entries in a folder
+    compare -> returns the new or changed, removed and moved entries between two snapshots
+    get_snapshot -> returns the saved state of the entries in the given folders
+    save_snapshot <- saves changed entries and forgets removed ones
+    """
+
+    @staticmethod
+    def snapshot(root):
+        "Returns a dict of path and (inode, mtime, size) of the entries in root"
+        entries = {}
+        for entry in os.scandir(root):
+            try:
+                stat = entry.stat()
+                entries[entry.path] = (entry.inode() or None, stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                log.exception('Could not stat {}'.format(entry.path.encode(errors='ignore')))
+        return entries
+
+    @staticmethod
+    def compare(old, new):
+        """
+        Compares two snapshots. Returns a list of new or changed paths, a list of removed paths
+        and a list of (old path, new path) for entries which were renamed or moved between folders.
+        """
+        changed = [p for p, state in new.items() if old.get(p) != state]
+        removed = []
+        moved = []
+        changed_inodes = {new[p][0]: p for p in changed if new[p][0] and not p in old}
+        for p in old:
+            if not p in new:
+                new_path = changed_inodes.get(old[p][0]) if old[p][0] else None
+                if new_path:
+                    moved.append((p, new_path))
+                else:
+                    removed.append(p)
+        return changed, removed, moved
+
+    @classmethod
+    def get_snapshot(cls, roots):
+        "Returns a dict of path and (inode, mtime, size) of the saved entries in the given folders"
+        entries = {}
+        for chunk in database.db.chunks(roots):
+            c = cls.execute(cls, 'SELECT path, inode, mtime, size FROM scan_state WHERE root IN ({})'.format(
+                ','.join('?' * len(chunk))), tuple(chunk))
+            for row in c.fetchall():
+                entries[row['path']] = (row['inode'], row['mtime'], row['size'])
+        return entries
+
+    @classmethod
+    def save_snapshot(cls, entries, removed=[]):
+        "Saves entries, a dict of root folder and a dict of its changed entries, and forgets the removed paths"
+        rows = [(path, root) + state for root in entries for path, state in entries[root].items()]
+        with cls.transaction():
+            if rows:
+                cls.executemany(cls, 'INSERT OR REPLACE INTO scan_state(path, root, inode, mtime, size) VALUES(?, ?, ?, ?, ?)', rows)
+            if removed:
+                cls.executemany(cls, 'DELETE FROM scan_state WHERE path=?', [(p,) for p in removed])
+
+class ArchiveIntegrityDB(database.db.DBBase):
+    """
+    Keeps the results of checking archives for corruption.
+    A result is only valid as long as the size and modification time of the archive don't change.
+
+    get_results -> returns the saved results for the given archive paths
+    get_corrupt -> returns the archives found to be corrupt
+    save_results <- saves results of checked archives
+    """
+
+    @classmethod
+    def get_results(cls, paths):
+        "Returns a dict of path and (size, mtime, bad_file) for the given archive paths which have been checked"
+        results = {}
+        for chunk in database.db.chunks(paths):
+            c = cls.execute(cls, 'SELECT path, size, mtime, bad_file FROM archive_integrity WHERE path IN ({})'.format(
+                ','.join('?' * len(chunk))), tuple(chunk))
+            for row in c.fetchall():
+                results[row['path']] = (row['size'], row['mtime'], row['bad_file'])
+        return results
+
+    @classmethod
+    def get_corrupt(cls):
+        "Returns a list of (path, bad_file) of the archives found to be corrupt"
+        c = cls.execute(cls, 'SELECT path, bad_file FROM archive_integrity WHERE bad_file IS NOT NULL')
+        return [(row['path'], row['bad_file']) for row in c.fetchall()]
+
+    @classmethod
+    def save_results(cls, results):
+        "Saves a list of (path, size, mtime, bad_file), bad_file is None for archives which are fine"
+        if not results:
+            return
+        with cls.transaction():
+            cls.executemany(cls, 'INSERT OR REPLACE INTO archive_integrity(path, size, mtime, bad_file) VALUES(?, ?, ?, ?)',
+                            results)
+
+class PageDB(database.db.DBBase):
+    """
+    Keeps the manifest of each chapter, its pages in order with their size and image dimensions,
+    so the pages don't have to be listed from the folder or archive every time.
+    A manifest is only valid as long as the modification time of its chapter doesn't change.
+
+    get_manifest -> returns the saved manifest of a chapter if it's still valid
+    save_manifest <- replaces the saved manifest of a chapter
+    save_manifests <- replaces the saved manifests of many chapters by their ids
+    """
+
+    @classmethod
+    def get_manifest(cls, series_id, chap_number, mtime):
+        "Returns the utils.Manifest of the chapter if it was saved at the given modification time, else None"
+        c = cls.execute(cls, """SELECT pages.name, pages.size, pages.width, pages.height, pages.mtime FROM pages
+            JOIN chapters ON pages.chapter_id = chapters.chapter_id
+            WHERE chapters.series_id=? AND chapters.chapter_number=? ORDER BY pages.page""",
+            (series_id, chap_number))
+        rows = c.fetchall()
+        if not rows or rows[0]['mtime'] != mtime:
+            return None
+        return utils.Manifest(mtime, [utils.PageInfo(r['name'], r['size'], r['width'], r['height']) for r in rows])
+
+    @classmethod
+    def save_manifest(cls, series_id, chap_number, manifest):
+        "Replaces the saved manifest of the chapter with the given utils.Manifest"
+        chap_id = ChapterDB.get_chapter_id(series_id, chap_number)
+        if chap_id is not None:
+            cls.save_manifests([(chap_id, manifest)])
+
+    @classmethod
+    def save_manifests(cls, manifests):
+        "Replaces the saved manifests of many chapters, takes a list of (chapter id, utils.Manifest)"
+        if not manifests:
+            return
+        with cls.transaction():
+            cls.executemany(cls, 'DELETE FROM pages WHERE chapter_id=?', [(chap_id,) for chap_id, m in manifests])
+            cls.executemany(cls, 'INSERT INTO pages(chapter_id, page, name, size, width, height, mtime) VALUES(?, ?, ?, ?, ?, ?, ?)',
+                            [(chap_id, n, p.name, p.size, p.width, p.height, m.mtime)
+                             for chap_id, m in manifests for n, p in enumerate(m.pages)])
+
 class GalleryList:
     """
     Provides access to lists..
@@ -1349,9 +1814,16 @@ class GalleryList:
     - clear <- removes all galleries from the list
     - galleries -> returns a list with all galleries in list
     - scan <- scans for galleries matching the listfilter and adds them to gallery
+    - matches -> checks if a gallery matches the listfilter
+    - track <- remembers loaded galleries by id, so changes made by id can be applied to enforced lists
+    - update_enforced <- checks changed galleries against the filters of enforced lists
+    - forget <- removes deleted galleries from all lists
     """
     # types
     REGULAR, COLLECTION = range(2)
+    # gallery id -> loaded gallery, see track
+    _loaded = weakref.WeakValueDictionary()
+    _loaded_lock = threading.Lock()
 
     def __init__(self, name, list_of_galleries=[], filter=None, id=None, _db=True):
         self._id = id # shouldnt ever be touched
@@ -1363,9 +1835,9 @@ class GalleryList:
         self.regex = False
         self.case = False
         self.strict = False
-        self._galleries = set()
-        self._ids_chache = []
+        self._galleries = {} # gallery id -> gallery
         self._scanning = False
+        self._compiled = (None, None)
         self.add_gallery(list_of_galleries, _db)
 
     def add_gallery(self, gallery_or_list_of, _db=True, _check_filter=True):
@@ -1378,12 +1850,9 @@ class GalleryList:
             return
         new_galleries = []
         for gallery in gallery_or_list_of:
-            self._galleries.add(gallery)
-            if not utils.b_search(self._ids_chache, gallery.id):
+            if gallery.id not in self._galleries:
                 new_galleries.append(gallery)
-                self._ids_chache.append(gallery.id)
-                # uses timsort algorithm so it's ok
-                self._ids_chache.sort()
+            self._galleries[gallery.id] = gallery
         if _db:
             execute(ListDB.add_gallery_to_list, True, new_galleries, self)
 
@@ -1391,19 +1860,10 @@ class GalleryList:
         "remove_gallery <- removes galleries matching the provided gallery id"
         if isinstance(gallery_id_or_list_of, int):
             gallery_id_or_list_of = [gallery_id_or_list_of]
-        g_ids = gallery_id_or_list_of
         g_ids_to_delete = []
-        g_to_delete = []
-        for g in self._galleries:
-            if g.id in g_ids:
-                g_to_delete.append(g)
-                try:
-                    self._ids_chache.remove(g.id)
-                except ValueError:
-                    pass
-                g_ids_to_delete.append(g.id)
-        for g in g_to_delete:
-            self._galleries.remove(g)
+        for g_id in gallery_id_or_list_of:
+            if self._galleries.pop(g_id, None) is not None:
+                g_ids_to_delete.append(g_id)
         execute(ListDB.remove_gallery_from_list, True, g_ids_to_delete, self)
 
     def clear(self):
@@ -1411,28 +1871,22 @@ class GalleryList:
         if self._galleries:
             execute(ListDB.remove_gallery_from_list, True, list(self._galleries), self)
         self._galleries.clear()
-        self._ids_chache.clear()
 
     def galleries(self):
         "returns a list with all galleries in list"
-        return list(self._galleries)
+        return list(self._galleries.values())
 
     def __contains__(self, g):
-        return utils.b_search(self._ids_chache, g.id)
+        return g.id in self._galleries
 
     def add_to_db(self):
         app_constants.GALLERY_LISTS.add(self)
         execute(ListDB.add_list, True, self)
 
-    def scan(self, galleries=None):
-        if self.filter and not self._scanning:
-            self._scanning = True
-            if isinstance(galleries, Gallery):
-                galleries = [galleries]
-            if not galleries:
-                galleries = app_constants.GALLERY_DATA
-            new_galleries = []
-            filter_term = ' '.join(self.filter.split())
+    def _filter_query(self):
+        "Returns the compiled listfilter, it's only compiled again when the filter or its options change"
+        key = (self.filter, self.regex, self.case, self.strict)
+        if self._compiled[0] != key:
             args = []
             if self.regex:
                 args.append(app_constants.Search.Regex)
@@ -1440,32 +1894,81 @@ class GalleryList:
                 args.append(app_constants.Search.Case)
             if self.strict:
                 args.append(app_constants.Search.Strict)
-            search_pieces = utils.get_terms(filter_term)
+            terms = utils.get_terms(' '.join(self.filter.split())) if self.filter else []
+            self._compiled = (key, search_query.compile_query(terms, args))
+        return self._compiled[1]
 
-            def _search_g(gallery):
-                all_terms = {t: False for t in search_pieces}
+    def matches(self, gallery):
+        "Checks if the given gallery matches all terms of the listfilter"
+        return self._filter_query()(gallery)
 
-                for t in search_pieces:
-                    if gallery.contains(t, args):
-                        all_terms[t] = True
+    def scan(self, galleries=None):
+        """
+        Adds the galleries matching the listfilter, all galleries if none are given.
+        If the list is enforced, members not matching anymore are removed. Only the given galleries are checked,
+        or all members when scanning all galleries.
+        """
+        if self.filter and not self._scanning:
+            self._scanning = True
+            try:
+                if isinstance(galleries, Gallery):
+                    galleries = [galleries]
+                if not galleries:
+                    galleries = app_constants.GALLERY_DATA
+                    members = self.galleries()
+                else:
+                    members = [g for g in galleries if g in self]
+                new_galleries = [g for g in galleries if self.matches(g)]
+
+                if self.enforce:
+                    g_to_remove = [g.id for g in members if not self.matches(g)]
+                    if g_to_remove:
+                        self.remove_gallery(g_to_remove)
+                new_galleries = [g for g in new_galleries if g not in self]
+                if new_galleries:
+                    self.add_gallery(new_galleries, _check_filter=False)
+            finally:
+                self._scanning = False
 
-                if all(all_terms.values()):
-                    return True
-                return False
+    @classmethod
+    def track(cls, galleries):
+        "Remembers the given galleries by id, until they aren't used anymore. Safe to call from any thread"
+        with cls._loaded_lock:
+            for g in galleries:
+                if g.id is not None:
+                    cls._loaded[g.id] = g
 
-            for gallery in galleries:
-                if _search_g(gallery):
-                    new_galleries.append(gallery)
-
-            if self.enforce:
-                g_to_remove = []
-                for g in self.galleries():
-                    if not _search_g(g):
-                        g_to_remove.append(g.id)
-                if g_to_remove:
-                    self.remove_gallery(g_to_remove)
-            self.add_gallery(new_galleries, _check_filter=False)
-            self._scanning = False
+    @classmethod
+    def update_enforced(cls, galleries):
+        """
+        Checks the given galleries against the filters of enforced lists, so keeping them in sync
+        only costs as much as the galleries that changed. Ids are looked up in the galleries passed to track,
+        ids of galleries that aren't loaded are skipped.
+        Run by the methods adding or modifying galleries, on the DB thread so lists are changed by one thread only.
+        """
+        lists = [l for l in app_constants.GALLERY_LISTS if l.enforce and l.filter]
+        if not lists:
+            return
+        changed = []
+        with cls._loaded_lock:
+            for g in galleries:
+                if not isinstance(g, Gallery):
+                    g = cls._loaded.get(g)
+                if g is not None:
+                    changed.append(g)
+        if changed:
+            for l in lists:
+                l.scan(changed)
+
+    @classmethod
+    def forget(cls, gallery_ids):
+        "Removes deleted galleries from all lists, without touching DB since it removes them from its lists itself"
+        with cls._loaded_lock:
+            for g_id in gallery_ids:
+                cls._loaded.pop(g_id, None)
+        for l in app_constants.GALLERY_LISTS:
+            for g_id in gallery_ids:
+                l._galleries.pop(g_id, None)
 
     def __lt__(self, other):
         return self.name < other.name
@@ -1637,182 +2140,14 @@ class Gallery:
         """
         return []
 
-    def _keyword_search(self, ns, tag, args=[]):
-        term = ''
-        lt, gt = range(2)
-        def _search(term):
-            if app_constants.Search.Regex in args:
-                if utils.regex_search(tag, term, args):
-                    return True
-            else:
-                if app_constants.DEBUG:
-                    log_d("{} {}".format(tag, term))
-                if utils.search_term(tag, term, args):
-                    return True
-            return False
-
-        def _operator_parse(tag):
-            o = None
-            if tag:
-                if tag[0] == '<':
-                    o = lt
-                    tag = tag[1:]
-                elif tag[0] == '>':
-                    o = gt
-                    tag = tag[1:]
-            return tag, o
-
-        def _operator_supported(attr, date=False):
-            try:
-                o_tag, o = _operator_parse(tag)
-                if date:
-                    o_tag = dateparser.parse(o_tag, dayfirst=True)
-                    if o_tag:
-                        o_tag = o_tag.date()
-                else:
-                    o_tag = int(o_tag)
-                if o != None:
-                    if o == gt:
-                        return o_tag < attr
-                    elif o == lt:
-                        return o_tag > attr
-                else:
-                    return o_tag == attr
-            except ValueError:
-                return False
-
-        if ns == 'Title':
-            term = self.title
-        elif ns in ['Language', 'Lang']:
-            term = self.language
-        elif ns == 'Type':
-            term = self.type
-        elif ns == 'Status':
-            term = self.status
-        elif ns == 'Artist':
-            term = self.artist
-        elif ns == 'Url':
-            term = self.link
-        elif ns in ['Descr', 'Description']:
-            term = self.info
-        elif ns in ['Chapter', 'Chapters']:
-            return _operator_supported(self.chapters.count())
-        elif ns in ['Read_count', 'Read count', 'Times_read', 'Times read']:
-            return _operator_supported(self.times_read)
-        elif ns in ['Rating', 'Stars']:
-            return _operator_supported(self.rating)
-        elif ns in ['Date_added', 'Date added']:
-            return _operator_supported(self.date_added.date(), True)
-        elif ns in ['Pub_date', 'Publication', 'Pub date']:
-            if self.pub_date:
-                return _operator_supported(self.pub_date.date(), True)
-            return False
-        elif ns in ['Last_read', 'Last read']:
-            if self.last_read:
-                return _operator_supported(self.last_read.date(), True)
-            return False
-        return _search(term)
-
     def __contains__(self, key):
         assert isinstance(key, Chapter), "Can only check for chapters in gallery"
         return self.chapters.__contains__(key)
 
 
     def contains(self, key, args=[]):
-        "Check if gallery contains keyword"
-        is_exclude = False if key[0] == '-' else True
-        key = key[1:] if not is_exclude else key
-        default = False if is_exclude else True
-        if key:
-            # check in title/artist/language
-            found = False
-            if not ':' in key:
-                for g_attr in [self.title, self.artist, self.language]:
-                    if not g_attr:
-                        continue
-                    if app_constants.Search.Regex in args:
-                        if utils.regex_search(key, g_attr, args=args):
-                            found = True
-                            break
-                    else:
-                        if utils.search_term(key, g_attr, args=args):
-                            found = True
-                            break
-
-            # check in tag
-            if not found:
-                tags = key.split(':')
-                ns = tag = ''
-                # only namespace is lowered and capitalized for now
-                if len(tags) > 1:
-                    ns = tags[0].lower().capitalize()
-                    tag = tags[1]
-                else:
-                    tag = tags[0]
-
-                # very special keywords
-                if ns:
-                    key_word = ['none', 'null']
-                    if ns == 'Tag' and tag in key_word:
-                        if not self.tags or len(self.tags) == 1 and 'default' in self.tags and not self.tags['default']:
-                            return is_exclude
-                    elif ns == 'Artist' and tag in key_word:
-                        if not self.artist:
-                            return is_exclude
-                    elif ns == 'Status' and tag in key_word:
-                        if not self.status or self.status == 'Unknown':
-                            return is_exclude
-                    elif ns == 'Language' and tag in key_word:
-                        if not self.language:
-                            return is_exclude
-                    elif ns == 'Url' and tag in key_word:
-                        if not self.link:
-                            return is_exclude
-                    elif ns in ('Descr', 'Description') and tag in key_word:
-                        if not self.info or self.info == 'No description..':
-                            return is_exclude
-                    elif ns == 'Type' and tag in key_word:
-                        if not self.type:
-                            return is_exclude
-                    elif ns in ('Publication', 'Pub_date', 'Pub date') and tag in key_word:
-                        if not self.pub_date:
-                            return is_exclude
-                    elif ns == 'Path' and tag in key_word:
-                        if self.dead_link:
-                            return is_exclude
-
-                if app_constants.Search.Regex in args:
-                    if ns:
-                        if self._keyword_search(ns, tag, args = args):
-                            return is_exclude
-
-                        for x in self.tags:
-                            if utils.regex_search(ns, x):
-                                for t in self.tags[x]:
-                                    if utils.regex_search(tag, t, True, args=args):
-                                        return is_exclude
-                    else:
-                        for x in self.tags:
-                            for t in self.tags[x]:
-                                if utils.regex_search(tag, t, True, args=args):
-                                    return is_exclude
-                else:
-                    if ns:
-                        if self._keyword_search(ns, tag, args=args):
-                            return is_exclude
-
-                        if ns in self.tags:
-                            for t in self.tags[ns]:
-                                if utils.search_term(tag, t, True, args=args):
-                                    return is_exclude
-                    else:
-                        for x in self.tags:
-                            for t in self.tags[x]:
-                                if utils.search_term(tag, t, True, args=args):
-                                    return is_exclude
-            else:
-                return is_exclude
-        return default
+        "Check if gallery contains keyword, see search_query.Term"
+        return search_query.compile_term(key, args)(self)
 
     def move_gallery(self, new_path=''):
         log_i("Moving gallery...")
@@ -1840,6 +2175,9 @@ class Gallery:
                     utils.move_files(chap.path, os.path.join(new_head, tail))
                 else:
                     utils.move_files(chap.path, os.path.join(self.path, tail))
+        # the cached listings of both directories are outdated now
+        dead_links.DeadLinkChecker.invalidate(old_head)
+        dead_links.DeadLinkChecker.invalidate(new_head)
 
     def __lt__(self, other):
         return self.id < other.id
@@ -1861,6 +2199,8 @@ class Chapter:
     number -> chapter number
     pages -> chapter pages
     in_archive -> 1 if the chapter path is in an archive else 0
+    hashes -> dict of page number and hash not yet saved in DB, or None
+    manifest -> utils.Manifest of the pages last read, or None, see get_manifest
     """
     def __init__(self, parent, gallery, number=0, path='', pages=0, in_archive=0, title=''):
         self.parent = parent
@@ -1870,6 +2210,8 @@ class Chapter:
         self.number = number
         self.pages = pages
         self.in_archive = in_archive
+        self.hashes = None
+        self.manifest = None
 
     def __lt__(self, other):
         return self.number < other.number
@@ -1898,6 +2240,39 @@ class Chapter:
         except KeyError:
             return None
 
+    def get_manifest(self, refresh=False, saved_only=False):
+        """
+        Returns the utils.Manifest of the chapter's pages. It's loaded from the DB, or read from
+        the folder or archive and saved if the chapter was modified since or refresh is set.
+        With saved_only, None is returned instead of reading the pages, which can mean reading every page.
+        Raises OSError or app_constants.CreateArchiveFail if the chapter can't be read.
+        """
+        mtime = utils.chapter_mtime(self)
+        gallery_id = self.gallery.id if self.gallery else None
+        if not refresh:
+            if self.manifest and self.manifest.mtime == mtime:
+                return self.manifest
+            if gallery_id is not None:
+                manifest = execute(PageDB.get_manifest, False, gallery_id, self.number, mtime, read=True)
+                if manifest:
+                    self.manifest = manifest
+                    self._update_pages(gallery_id)
+                    return manifest
+        if saved_only:
+            return None
+        self.manifest = utils.read_manifest(self)
+        if gallery_id is not None:
+            execute(PageDB.save_manifest, True, gallery_id, self.number, self.manifest)
+        self._update_pages(gallery_id)
+        return self.manifest
+
+    def _update_pages(self, gallery_id):
+        # the page count decides which hashes are missing, see HashDB.get_unhashed_chapters
+        if self.pages != len(self.manifest.pages):
+            self.pages = len(self.manifest.pages)
+            if gallery_id is not None:
+                execute(ChapterDB.update_chapter_pages, True, gallery_id, self.number, self.pages)
+
     def open(self, stat_msg=True):
         if stat_msg:
             txt = "Opening chapter {} of {}".format(self.number + 1, self.gallery.title)
@@ -1981,11 +2356,7 @@ class ChaptersContainer:
             return False
         execute(HashDB.del_gallery_hashes, True, self.parent.id)
         chap = self[number]
-        if chap.in_archive:
-            with utils.ArchiveFile(chap.gallery.path) as arch:
-                chap.pages = len([x for x in arch.dir_contents(chap.path) if x.lower().endswith(utils.IMG_FILES)])
-        else:
-            chap.pages = len([x for x in os.scandir(chap.path) if x.path.lower().endswith(utils.IMG_FILES)])
+        chap.pages = len(chap.get_manifest(refresh=True).pages)
 
         execute(ChapterDB.update_chapter, True, self, [chap.number])
         return True
@@ -2048,6 +2419,8 @@ class AdminDB(QObject):
     DONE = pyqtSignal(bool)
     PROGRESS = pyqtSignal(int)
     DATA_COUNT = pyqtSignal(int)
+    # list of (path, bad_file) of corrupt archives found by verify_archives
+    CORRUPT_ARCHIVES = pyqtSignal(list)
     def __init__(self, parent=None):
         super().__init__(parent)
 
@@ -2111,9 +2484,11 @@ class AdminDB(QObject):
         t_db_path = os.path.join(head, 'temp.db')
         conn = database.db.init_db(t_db_path)
         database.db.DBBase._DB_CONN = conn
-        for n, g in enumerate(n_galleries, len(chap_rows) - 1):
-            log_d('Adding new gallery')
-            GalleryDB.add_gallery(g)
+        n = len(chap_rows) - 1
+        for chunk in database.db.chunks(n_galleries):
+            log_d('Adding {} new galleries'.format(len(chunk)))
+            GalleryDB.add_galleries(chunk)
+            n += len(chunk)
             self.PROGRESS.emit(n)
 
         conn.commit()
@@ -2149,11 +2524,16 @@ class AdminDB(QObject):
         database.db.DBBase.begin()
         log_i("Adding galleries...")
         GalleryDB.clear_thumb_dir()
-        for n, g in enumerate(galleries):
-            if not os.path.exists(g.path):
-                log_i("Gallery doesn't exist anymore: {}".format(g.title.encode(errors="ignore")))
-            else:
-                GalleryDB.add_gallery(g)
+        n = 0
+        for chunk in database.db.chunks(galleries):
+            existing = []
+            for g in chunk:
+                if not os.path.exists(g.path):
+                    log_i("Gallery doesn't exist anymore: {}".format(g.title.encode(errors="ignore")))
+                else:
+                    existing.append(g)
+            GalleryDB.add_galleries(existing)
+            n += len(chunk)
             self.PROGRESS.emit(n)
         database.db.DBBase.end()
         database.db.DBBase._DB_CONN.close()
@@ -2189,24 +2569,208 @@ class AdminDB(QObject):
             execute(GalleryDB.rebuild_thumb, False, g)
             g.reset_profile()
             self.PROGRESS.emit(n)
+        execute(GalleryDB.collect_thumb_garbage, False)
+        self.DONE.emit(True)
+
+    def verify_archives(self, recheck=False):
+        """
+        Checks the archives of all galleries for corruption with a pool of workers.
+        Archives which haven't changed since they were last checked are skipped unless recheck is set.
+        Emits CORRUPT_ARCHIVES with all archives known to be corrupt when done.
+        """
+        paths = set()
+        for g in app_constants.GALLERY_DATA + app_constants.GALLERY_ADDITION_DATA:
+            if g.is_archive or g.path.endswith(utils.ARCHIVE_FILES):
+                paths.add(g.path)
+        checked = execute(ArchiveIntegrityDB.get_results, False, list(paths))
+        to_check = []
+        for p in sorted(paths):
+            try:
+                stat = os.stat(p)
+            except OSError:
+                continue
+            if recheck or checked.get(p, (None, None, None))[:2] != (stat.st_size, stat.st_mtime_ns):
+                to_check.append((p, stat.st_size, stat.st_mtime_ns))
+
+        self.DATA_COUNT.emit(len(to_check))
+        log_i('Checking {} archives for corruption'.format(len(to_check)))
+        results = []
+        with futures.ThreadPoolExecutor(max(1, app_constants.SCAN_WORKERS)) as executor:
+            fs = {executor.submit(utils.verify_archive, p): (p, size, mtime) for p, size, mtime in to_check}
+            for n, f in enumerate(futures.as_completed(fs), 1):
+                p, size, mtime = fs[f]
+                results.append((p, size, mtime, f.result()))
+                # saved as they come in so an interrupted check doesn't start over
+                if len(results) >= 100:
+                    execute(ArchiveIntegrityDB.save_results, True, results)
+                    results = []
+                self.PROGRESS.emit(n)
+        execute(ArchiveIntegrityDB.save_results, False, results)
+
+        corrupt = [r for r in execute(ArchiveIntegrityDB.get_corrupt, False) if r[0] in paths]
+        log_i('Found {} corrupt archives'.format(len(corrupt)))
+        self.CORRUPT_ARCHIVES.emit(corrupt)
         self.DONE.emit(True)
 
+    def backfill_hashes(self):
+        "Generates the missing page hashes and perceptual hashes of all galleries, see PageHasher.backfill"
+        def progress(n, total):
+            if n == 1:
+                self.DATA_COUNT.emit(total)
+            self.PROGRESS.emit(n)
+        PageHasher.backfill(progress=progress)
+        PageHasher.backfill_phashes(progress=progress)
+        self.DONE.emit(True)
+
+class LibrarySnapshot(database.db.DBBase):
+    """
+    Keeps a snapshot of the loaded galleries with their chapters, tags and lists in a file next to the DB,
+    so startup doesn't have to query and map every gallery again.
+    Triggers increase a change counter in the DB on every write to the tables galleries are loaded from.
+    A snapshot is only used while the counter still has the value it had when the snapshot was taken.
+    Hashes aren't kept since they're also written without the galleries knowing.
+
+    create_counter <- creates the change counter if the DB doesn't have it yet
+    change_count -> returns the token and the value of the change counter of the DB
+    load -> returns the galleries in the snapshot if it's still valid, else None
+    save <- writes a snapshot of the given galleries if the DB changed since the last one
+    """
+    _VERSION = 1
+    # attributes of Gallery, set directly instead of through the path property
+    _FIELDS = ('id', 'title', 'artist', 'profile', '_path', 'file_type', 'is_archive', 'path_in_archive', 'info',
+               'language', 'rating', 'status', 'type', 'fav', 'pub_date', 'last_read', 'date_added', 'times_read',
+               '_db_v', 'exed', 'view', 'link')
+    _saved_count = None
+
+    @classmethod
+    def create_counter(cls):
+        "Creates the change counter and its triggers if the DB doesn't have them yet"
+        # databases from older versions don't have it yet, so changes made before can't be counted
+        cls._DB_CONN.executescript(database.db.change_counter_sql())
+
+    @classmethod
+    def _path(cls):
+        db_path = database.db.db_file_path(cls.reader_connection() or cls._DB_CONN)
+        return db_path + '.snapshot' if db_path else ''
+
+    @classmethod
+    def change_count(cls):
+        "Returns a tuple of the token and the value of the change counter, or None if the DB doesn't have one yet"
+        try:
+            row = cls.execute(cls, 'SELECT token, counter FROM change_counter').fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return (row['token'], row['counter']) if row else None
+
+    @classmethod
+    def load(cls):
+        "Returns a list of the galleries in the snapshot if there's one and it's still valid, else None"
+        path = cls._path()
+        count = cls.change_count()
+        if not path or not count or not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                if pickle.load(f) != (cls._VERSION, count):
+                    log_i('Startup snapshot is outdated')
+                    return None
+                rows = pickle.load(f)
+        except Exception:
+            log.exception('Could not read startup snapshot')
+            return None
+        cls._saved_count = count
+
+        lists = {l._id: l for l in app_constants.GALLERY_LISTS}
+        members = defaultdict(list)
+        galleries = []
+        for fields, chapters, tags, list_ids in rows:
+            gallery = Gallery()
+            gallery.__dict__.update(zip(cls._FIELDS, fields))
+            for number, title, path, pages, in_archive in chapters:
+                chap = gallery.chapters.create_chapter(number)
+                chap.title = title
+                chap.path = path
+                chap.pages = pages
+                chap.in_archive = in_archive
+            gallery.tags = tags
+            for l_id in list_ids:
+                members[l_id].append(gallery)
+            galleries.append(gallery)
+        for l_id, l_galleries in members.items():
+            if l_id in lists:
+                lists[l_id].add_gallery(l_galleries, False, _check_filter=False)
+        return galleries
+
+    @classmethod
+    def save(cls, galleries, count=None):
+        """
+        Writes a snapshot of the given galleries, taken when the change counter had the given value.
+        Without a count, the current value is used, so all writes to the DB must be done already.
+        Nothing is written if the DB didn't change since the last snapshot.
+        """
+        path = cls._path()
+        if not path:
+            return
+        if count is None:
+            count = cls.change_count()
+        if not count or count == cls._saved_count:
+            return
+        # the duplicate check sets the view of library galleries without saving it, so it's taken from DB
+        views = {r['series_id']: r['view'] for r in cls.execute(cls, 'SELECT series_id, view FROM series').fetchall()}
+        list_ids = defaultdict(list)
+        for l in app_constants.GALLERY_LISTS:
+            for g in l.galleries():
+                list_ids[g.id].append(l._id)
+        rows = []
+        for g in galleries:
+            if g.id not in views:
+                continue
+            rows.append((tuple(views[g.id] if name == 'view' else getattr(g, name) for name in cls._FIELDS),
+                         [(c.number, c.title, c.path, c.pages, c.in_archive) for c in g.chapters],
+                         g.tags, list_ids.get(g.id, [])))
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump((cls._VERSION, count), f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(rows, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            log.exception('Could not write startup snapshot')
+            return
+        cls._saved_count = count
+        log_i('Saved startup snapshot of {} galleries'.format(len(rows)))
+
 class DatabaseStartup(QObject):
     """
     Fetches and emits database records
     START: emitted when fetching from DB occurs
     DONE: emitted when the initial fetching from DB finishes
+    DEAD_LINKS: emitted with a list of galleries whose dead_link changed while checking them after DONE
     """
     START = pyqtSignal()
     DONE = pyqtSignal()
     PROGRESS = pyqtSignal(str)
+    DEAD_LINKS = pyqtSignal(list)
     _DB = database.db.DBBase()
+    # amount of galleries loaded before the rest, enough to fill the first screen
+    _FIRST_SCREEN = 200
+    # ORDER BY clauses matching the sort orders of the views, see gallery.MangaView.sort
+    # page_count isn't in the series table, those galleries are just loaded by id
+    # the views sort text case insensitively
+    _SORT_ORDER = {
+        'title': 'title COLLATE NOCASE, series_id',
+        'artist': 'artist COLLATE NOCASE, series_id',
+        'date_added': "NULLIF(date_added, 'None') DESC, series_id",
+        'pub_date': "NULLIF(pub_date, 'None') DESC, series_id",
+        'times_read': 'times_read DESC, series_id',
+        'last_read': "NULLIF(last_read, 'None') DESC, series_id",
+        'rating': 'rating DESC, series_id',
+        }
 
     def __init__(self):
         super().__init__()
         ListDB.init_lists()
         self._fetch_count = app_constants.DATABASE_STARTUP_FETCH_LIMIT
-        self._offset = 0
+        self._last_id = 0
         self._fetching = False
         self.count = 0
         self._finished = False
@@ -2215,57 +2779,136 @@ class DatabaseStartup(QObject):
     def startup(self, manga_views):
         self.START.emit()
 
+        count = None
+        snapshot = None
+        if app_constants.STARTUP_SNAPSHOT:
+            execute(LibrarySnapshot.create_counter, False)
+            # read before loading, so writes made while loading make the new snapshot outdated
+            count = execute(LibrarySnapshot.change_count, False, read=True)
+            with utils.Stopwatch('DatabaseStartup.startup (Loading snapshot)', lambda msg: log_i(msg)):
+                snapshot = execute(LibrarySnapshot.load, False, read=True)
+
+        if snapshot is not None:
+            self._fetching = True
+            self.count = len(snapshot)
+            self._show_galleries(snapshot, manga_views)
+            # chapters and tags come with the snapshot, so both paint levels are reached right away
+            for _ in range(2):
+                [v.list_view.manga_delegate._increment_paint_level() for v in manga_views]
+        else:
+            self.load_galleries(manga_views)
+            if count:
+                db_executor.submit(LibrarySnapshot.save, self._loaded_galleries, count, priority=9999, read=True)
+
+        hashes = self.fetch_hashes()
+        with utils.Stopwatch('DatabaseStartup.startup (Loading hashes)', lambda msg: log_i(msg)):
+            self.PROGRESS.emit("Loading hashes...")
+            hashes.result()
+
+        # low priority, so it doesn't get in the way of anything the user does
+        db_executor.submit(GalleryDB.collect_thumb_garbage, priority=9999, read=True)
+        self._fetching = False
+        self.DONE.emit()
+        self.check_dead_links()
+
+    def load_galleries(self, manga_views):
+        "Loads all galleries with their chapters and tags from DB"
         with utils.Stopwatch('DatabaseStartup.startup (Loading galleries)', lambda msg: log_i(msg)):
             self._fetching = True
             self.count = GalleryDB.gallery_count()
-            remaining = self.count
-            while remaining > 0:
-                self.PROGRESS.emit("Loading galleries: {}".format(remaining))
-                fetch_limit = min(remaining, self._fetch_count) if self._fetch_count > 0 else self.count
-                self.fetch_galleries(self._offset, fetch_limit, manga_views)
-                self._offset += fetch_limit
-                remaining = self.count - self._offset
+            # the galleries at the top of the views are shown first, the rest is loaded by id after
+            first_ids = self.fetch_first_galleries(manga_views)
+            loaded = len(first_ids)
+            while loaded < self.count:
+                self.PROGRESS.emit("Loading galleries: {}".format(self.count - loaded))
+                fetch_limit = self._fetch_count if self._fetch_count > 0 else self.count
+                last_id = self._last_id
+                loaded += self.fetch_galleries(last_id, fetch_limit, manga_views, first_ids)
+                if self._last_id == last_id:
+                    break
             [v.list_view.manga_delegate._increment_paint_level() for v in manga_views]
 
+        with utils.Stopwatch('DatabaseStartup.startup (Loading lists)', lambda msg: log_i(msg)):
+            execute(ListDB.query_all_galleries, False, self._loaded_galleries, read=True)
+
+        # chapters and tags don't depend on each other, so the DB readers load them in parallel
+        chapters = self.fetch_chapters()
+        tags = self.fetch_tags()
+
         with utils.Stopwatch('DatabaseStartup.startup (Loading chapters)', lambda msg: log_i(msg)):
             self.PROGRESS.emit("Loading chapters...")
-            self.fetch_chapters()
+            chapters.result()
 
         with utils.Stopwatch('DatabaseStartup.startup (Loading tags)', lambda msg: log_i(msg)):
             self.PROGRESS.emit("Loading tags...")
-            self.fetch_tags()
+            tags.result()
             [v.list_view.manga_delegate._increment_paint_level() for v in manga_views]
 
-        with utils.Stopwatch('DatabaseStartup.startup (Loading hashes)', lambda msg: log_i(msg)):
-            self.PROGRESS.emit("Loading hashes...")
-            self.fetch_hashes()
-
-        self._fetching = False
-        self.DONE.emit()
-
-    def fetch_galleries(self, offset, limit, manga_views):
-        # instead of "LIMIT 1, 2" you can also write "LIMIT 2 OFFSET 1"
-        c = execute(self._DB.execute, False, '''SELECT * FROM series LIMIT {}, {}'''.format(offset, limit))
-        if c:
-            new_data = c.fetchall()
-            gallery_list = execute(GalleryDB.gen_galleries, False, new_data, {"chapters":False, "tags":False, "hashes":False})
-            if gallery_list:
-                self._loaded_galleries.extend(gallery_list)
-                for view in manga_views:
-                    view_galleries = [g for g in gallery_list if g.view == view.view_type]
-                    view.gallery_model._gallery_to_add = view_galleries
-                    view.gallery_model.insertRows(view.gallery_model.rowCount(), len(view_galleries))
+    def check_dead_links(self):
+        "Finds the loaded galleries whose source is gone, without keeping the galleries from showing up first"
+        with utils.Stopwatch('DatabaseStartup.startup (Checking dead links)', lambda msg: log_i(msg)):
+            def changed(galleries):
+                search_index.SearchIndex.invalidate(*(g.id for g in galleries))
+                self.DEAD_LINKS.emit(galleries)
+            dead_links.DeadLinkChecker.check(self._loaded_galleries, changed)
+
+    def _fetch_series_rows(self, after_id, limit):
+        # seeks to the first id instead of skipping all previous rows like an offset would
+        return self._DB.execute('SELECT * FROM series WHERE series_id > ? ORDER BY series_id LIMIT ?',
+                                (after_id, limit)).fetchall()
+
+    def _fetch_first_series_rows(self, order_by, limit):
+        return self._DB.execute('SELECT * FROM series ORDER BY {} LIMIT ?'.format(order_by), (limit,)).fetchall()
+
+    def _add_to_views(self, rows, manga_views):
+        gallery_list = execute(GalleryDB.gen_galleries, False, rows, chapters=False, tags=False, hashes=False,
+                               check_links=False, lists=False, read=True)
+        self._show_galleries(gallery_list, manga_views)
+
+    def _show_galleries(self, gallery_list, manga_views):
+        if gallery_list:
+            self._loaded_galleries.extend(gallery_list)
+            for view in manga_views:
+                view_galleries = [g for g in gallery_list if g.view == view.view_type]
+                view.gallery_model._gallery_to_add = view_galleries
+                view.gallery_model.insertRows(view.gallery_model.rowCount(), len(view_galleries))
+
+    def fetch_first_galleries(self, manga_views):
+        """
+        Loads the galleries which come first in the current sort order, so they can be shown right away.
+        Returns a set of their ids.
+        """
+        order_by = self._SORT_ORDER.get(app_constants.CURRENT_SORT)
+        if not order_by:
+            return set()
+        rows = execute(self._fetch_first_series_rows, False, order_by, self._FIRST_SCREEN, read=True)
+        self._add_to_views(rows, manga_views)
+        return {r['series_id'] for r in rows}
+
+    def fetch_galleries(self, after_id, limit, manga_views, skip_ids=()):
+        """
+        Loads up to limit galleries with an id greater than after_id, except the ones in skip_ids.
+        Returns the amount of galleries loaded.
+        """
+        new_data = execute(self._fetch_series_rows, False, after_id, limit, read=True)
+        if not new_data:
+            return 0
+        self._last_id = new_data[-1]['series_id']
+        new_data = [r for r in new_data if r['series_id'] not in skip_ids]
+        self._add_to_views(new_data, manga_views)
+        return len(new_data)
 
     def fetch_chapters(self):
-        # block by waiting for a return value
-        _ = execute(ChapterDB.get_chapters_for_galleries, False, self._loaded_galleries)
+        "Returns a future that's done when all chapters have been loaded"
+        return db_executor.submit(ChapterDB.get_chapters_for_galleries, self._loaded_galleries, read=True)
 
     def fetch_tags(self):
-        for g in self._loaded_galleries:
-            g.tags = execute(TagDB.get_gallery_tags, False, g.id)
+        "Returns a future that's done when all tags have been loaded"
+        return db_executor.submit(TagDB.get_tags_for_galleries, self._loaded_galleries, read=True)
 
     def fetch_hashes(self):
-        _ = execute(HashDB.get_multiple_gallery_hashes, False, self._loaded_galleries)
+        "Returns a future that's done when all hashes have been loaded"
+        return db_executor.submit(HashDB.get_multiple_gallery_hashes, self._loaded_galleries, read=True)
 
 
 if __name__ == '__main__':
@@ -904,7 +904,7 @@ class ImportExport(QObject):
             l_data['case'] = l.case
             l_data['strict'] = l.strict
             l_galleries = l_data['galleries'] = []
-            for g in l._galleries:
+            for g in l.galleries():
                 str_id = str(g.id)
                 if str_id in gallery_data:
                     l_galleries.append(str_id)
@@ -17,6 +17,7 @@ import logging
 import logging.handlers
 import os
 import argparse
+import multiprocessing
 import platform
 import traceback
 import datetime
@@ -274,6 +275,8 @@ def start(test=False):
         return db_upgrade()
 
 if __name__ == '__main__':
+    # the thumbnail worker processes need this in frozen builds
+    multiprocessing.freeze_support()
     current_exit_code = 0
     while current_exit_code == app_constants.APP_RESTART_CODE:
         try:
@@ -1172,6 +1172,10 @@ class GalleryMenu(QMenu):
         advanced.setMenu(adv_menu)
         if not self.selected:
             change_cover = adv_menu.addAction('Change cover...', self.change_cover)
+            if self.view.view_type == app_constants.ViewType.Default:
+                similar = adv_menu.addAction('Find visually similar galleries',
+                                             lambda: self.parent_widget.duplicate_check(False, self.gallery))
+                similar.setStatusTip('Only galleries whose pages were hashed are compared, see Generate Hashes in the settings')
 
         if self.selected:
             allow_metadata_count = 0
@@ -0,0 +1,150 @@
+#"""
+#This file is part of Happypanda.
+#Happypanda is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 2 of the License, or
+#any later version.
+#Happypanda is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#You should have received a copy of the GNU General Public License
+#along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+#"""
+
+import io
+import logging
+from collections import defaultdict
+
+from PIL import Image
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+HASH_SIZE = 8 # a hash has HASH_SIZE * HASH_SIZE bits
+
+def dhash(img_path):
+    """
+    Returns the difference hash of the image at img_path, or in the given bytes, as an int.
+    Each bit tells if a pixel of the shrunk greyscale image is darker than its right neighbour,
+    so resized or re-encoded copies of an image only differ in a few bits.
+    """
+    if isinstance(img_path, (bytes, bytearray)):
+        img_path = io.BytesIO(img_path)
+    with Image.open(img_path) as im:
+        # JPEGs are decoded at a reduced scale right away
+        im.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))
+        im = im.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+        pixels = im.tobytes()
+    h = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            h = (h << 1) | (left < pixels[row * (HASH_SIZE + 1) + col + 1])
+    return h
+
+def distance(a, b):
+    "Returns the amount of differing bits of two hashes"
+    return bin(a ^ b).count('1')
+
+class _Node:
+    __slots__ = ('hash', 'items', 'children')
+
+    def __init__(self, hash, item):
+        self.hash = hash
+        self.items = {item}
+        self.children = {}
+
+class BKTree:
+    """
+    Metric tree of hashes, to find the hashes within a distance of a hash
+    without comparing it to every hash in the tree.
+    Each hash can have many items, e.g. the ids of the galleries with a page of that hash.
+
+    add <- adds an item with the given hash
+    search -> returns the items of the hashes within a distance of a hash
+    """
+
+    def __init__(self):
+        self._root = None
+
+    def add(self, hash, item):
+        "Adds an item with the given hash"
+        if self._root is None:
+            self._root = _Node(hash, item)
+            return
+        node = self._root
+        while node.hash != hash:
+            d = distance(hash, node.hash)
+            child = node.children.get(d)
+            if child is None:
+                node.children[d] = _Node(hash, item)
+                return
+            node = child
+        node.items.add(item)
+
+    def search(self, hash, max_distance):
+        "Returns a set of the items of the hashes which differ in at most max_distance bits from hash"
+        found = set()
+        nodes = [self._root] if self._root is not None else []
+        while nodes:
+            node = nodes.pop()
+            d = distance(hash, node.hash)
+            if d <= max_distance:
+                found |= node.items
+            # by the triangle inequality, only these children can have hashes within max_distance
+            for child_d, child in node.children.items():
+                if d - max_distance <= child_d <= d + max_distance:
+                    nodes.append(child)
+        return found
+
+class PHashIndex:
+    """
+    Finds galleries with visually similar pages by the perceptual hashes of their pages.
+    Two galleries are similar if at least ratio of the pages of the one with less pages
+    have a page in the other which differs in at most max_distance bits.
+
+    add <- adds the page hashes of a gallery
+    similar -> returns the ids of the galleries similar to a gallery
+    duplicates -> returns all pairs of similar galleries
+    """
+
+    def __init__(self, max_distance=8, ratio=0.5):
+        self.max_distance = max_distance
+        self.ratio = ratio
+        self._tree = BKTree()
+        self._hashes = {}
+
+    def add(self, g_id, hashes):
+        "Adds the page hashes of the gallery with the given id"
+        # blank pages all have the same hash and say nothing about a gallery
+        hashes = {h for h in hashes if h}
+        if not hashes:
+            return
+        self._hashes[g_id] = hashes
+        for h in hashes:
+            self._tree.add(h, g_id)
+
+    def similar(self, g_id):
+        "Returns a list of the ids of the galleries similar to the gallery with the given id, most similar first"
+        hashes = self._hashes.get(g_id, ())
+        matches = defaultdict(int)
+        for h in hashes:
+            for other in self._tree.search(h, self.max_distance):
+                if other != g_id:
+                    matches[other] += 1
+        found = [other for other, n in matches.items()
+                 if n >= self.ratio * min(len(hashes), len(self._hashes[other]))]
+        return sorted(found, key=matches.get, reverse=True)
+
+    def duplicates(self):
+        "Returns a list of (id, id) of all pairs of similar galleries"
+        pairs = set()
+        for g_id in self._hashes:
+            for other in self.similar(g_id):
+                pairs.add((min(g_id, other), max(g_id, other)))
+        return sorted(pairs)
@@ -0,0 +1,297 @@
+#"""
+#This file is part of Happypanda.
+#Happypanda is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 2 of the License, or
+#any later version.
+#Happypanda is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#You should have received a copy of the GNU General Public License
+#along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+#"""
+
+import collections
+import logging
+import threading
+import weakref
+
+import app_constants
+import search_query
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+# namespaces a search term resolves to a gallery attribute instead of tags
+KEYWORD_NAMESPACES = set(search_query.TEXT_KEYWORDS) | set(search_query.NUMBER_KEYWORDS) | \
+    set(search_query.DATE_KEYWORDS)
+# namespaces with a special meaning for the 'none' and 'null' keywords
+NONE_NAMESPACES = set(search_query.NONE_KEYWORDS)
+
+class Vocabulary:
+    """
+    Maps lowercased words to the set of galleries containing them.
+    Words can be looked up exactly or by substring. Substring lookups search
+    through one string of all words instead of testing every gallery.
+    """
+
+    def __init__(self):
+        self.postings = collections.defaultdict(set)
+        self._text = None
+
+    def remove(self, word, gallery):
+        galleries = self.postings.get(word)
+        if galleries is not None:
+            galleries.discard(gallery)
+            if not galleries:
+                del self.postings[word]
+                self._text = None
+
+    def reset(self):
+        "Call after changing postings directly"
+        self._text = None
+
+    def exact(self, word):
+        "Returns the galleries with the given word"
+        return set(self.postings.get(word, ()))
+
+    def containing(self, sub):
+        "Returns the galleries with a word containing sub"
+        found = set()
+        if not sub or '\x00' in sub:
+            return found
+        if self._text is None:
+            self._text = '\x00' + '\x00'.join(self.postings) + '\x00'
+        text = self._text
+        pos = text.find(sub)
+        while pos != -1:
+            start = text.rfind('\x00', 0, pos) + 1
+            end = text.find('\x00', pos)
+            found.update(self.postings[text[start:end]])
+            pos = text.find(sub, end)
+        return found
+
+class SearchIndex:
+    """
+    An inverted index over the title words, artist, language and namespace:tag pairs of galleries.
+    Plain and namespaced terms are answered by looking up the index, everything
+    it can't answer exactly (regex, case sensitive, operators, special keywords)
+    is checked with its compiled search_query.Term on the remaining galleries.
+
+    add -> indexes galleries
+    remove -> removes galleries from the index
+    invalidate -> marks the galleries with the given ids for reindexing in all indexes
+    version -> returns a number that changes whenever the indexed galleries change
+    search -> returns the set of galleries matching all terms, or None if all galleries match
+    """
+    _instances = weakref.WeakSet()
+    _instances_lock = threading.Lock()
+
+    def __init__(self, galleries=[]):
+        self._galleries = set()
+        self._keys = {}
+        self._title = Vocabulary()
+        self._artist = Vocabulary()
+        self._language = Vocabulary()
+        self._tags = Vocabulary()
+        self._ns_tags = {}
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._version = 0
+        self.add(galleries)
+        with SearchIndex._instances_lock:
+            SearchIndex._instances.add(self)
+
+    @classmethod
+    def invalidate(cls, *gallery_ids):
+        "Marks galleries for reindexing. Safe to call from any thread"
+        with cls._instances_lock:
+            instances = list(cls._instances)
+        for index in instances:
+            with index._dirty_lock:
+                index._dirty.update(gallery_ids)
+
+    @staticmethod
+    def _gallery_keys(gallery):
+        title = gallery.title.lower().split() if isinstance(gallery.title, str) else []
+        artist = gallery.artist.lower() if isinstance(gallery.artist, str) else ''
+        language = gallery.language.lower() if isinstance(gallery.language, str) else ''
+        tags = []
+        if gallery.tags:
+            for ns, tag_list in gallery.tags.items():
+                for tag in tag_list:
+                    if isinstance(tag, str):
+                        tags.append((ns, tag.lower()))
+        return title, artist, language, tags
+
+    def add(self, galleries):
+        "Indexes the given galleries. Already indexed galleries are reindexed"
+        # the postings are filled directly since this runs for every gallery on startup
+        title_p = self._title.postings
+        artist_p = self._artist.postings
+        language_p = self._language.postings
+        tags_p = self._tags.postings
+        ns_tags = self._ns_tags
+        vocabs = (self._title, self._artist, self._language, self._tags, *ns_tags.values())
+        sizes = [len(v.postings) for v in vocabs]
+        self._version += 1
+        for gallery in galleries:
+            if gallery in self._galleries:
+                self._unindex(gallery)
+            self._galleries.add(gallery)
+            title, artist, language, tags = keys = self._gallery_keys(gallery)
+            self._keys[gallery] = keys
+            for word in title:
+                title_p[word].add(gallery)
+            if artist:
+                artist_p[artist].add(gallery)
+            if language:
+                language_p[language].add(gallery)
+            for ns, tag in tags:
+                tags_p[tag].add(gallery)
+                vocab = ns_tags.get(ns)
+                if vocab is None:
+                    ns_tags[ns] = vocab = Vocabulary()
+                vocab.postings[tag].add(gallery)
+        # only new words require the substring lookup text to be rebuilt, new vocabularies have none yet
+        for vocab, size in zip(vocabs, sizes):
+            if len(vocab.postings) != size:
+                vocab.reset()
+
+    def _unindex(self, gallery):
+        title, artist, language, tags = self._keys.pop(gallery)
+        for word in title:
+            self._title.remove(word, gallery)
+        if artist:
+            self._artist.remove(artist, gallery)
+        if language:
+            self._language.remove(language, gallery)
+        for ns, tag in tags:
+            self._tags.remove(tag, gallery)
+            vocab = self._ns_tags[ns]
+            vocab.remove(tag, gallery)
+            if not vocab.postings:
+                del self._ns_tags[ns]
+
+    def remove(self, galleries):
+        "Removes the given galleries from the index"
+        for gallery in galleries:
+            if gallery in self._galleries:
+                self._unindex(gallery)
+                self._galleries.discard(gallery)
+                self._version += 1
+
+    def _update(self):
+        "Reindexes galleries marked by invalidate"
+        with self._dirty_lock:
+            dirty = self._dirty
+            self._dirty = set()
+        if dirty:
+            self.add([g for g in self._galleries if g.id in dirty])
+
+    def version(self):
+        "Returns a number that changes whenever galleries are added, removed or reindexed"
+        self._update()
+        return self._version
+
+    def _title_candidates(self, key):
+        "Returns galleries whose title might contain key"
+        words = key.split()
+        if not words:
+            return set()
+        found = self._title.containing(words[0])
+        for word in words[1:]:
+            if not found:
+                break
+            found &= self._title.containing(word)
+        return found
+
+    def _candidates(self, key, args):
+        """
+        Returns (galleries, exact) for a term without exclusion prefix.
+        galleries is None if the index can't narrow the term down.
+        If exact is False, galleries is a superset that still needs to be checked.
+        """
+        if app_constants.Search.Regex in args:
+            return None, False
+        strict = app_constants.Search.Strict in args
+        # title, artist and language searches respect the case and strict options, tags are always case insensitive
+        exact = not strict and not app_constants.Search.Case in args
+        lookup = lambda vocab, word: vocab.exact(word) if strict else vocab.containing(word)
+
+        if not ':' in key:
+            key = key.lower()
+            found = self._artist.containing(key)
+            found |= self._language.containing(key)
+            found |= lookup(self._tags, key)
+            title = self._title_candidates(key)
+            if exact and len(key.split()) > 1:
+                # words might match in another order, so only these need checking
+                return found | title, False
+            return found | title, exact
+
+        tags = key.split(':')
+        ns = tags[0].lower().capitalize()
+        tag = tags[1].lower()
+        if not tag:
+            return None, False
+        if not ns:
+            return lookup(self._tags, tag), True
+        if ns in NONE_NAMESPACES and tag in ('none', 'null'):
+            return None, False
+        if ns in self._ns_tags:
+            found = lookup(self._ns_tags[ns], tag)
+        else:
+            found = set()
+        if ns in KEYWORD_NAMESPACES:
+            # keyword searches are case insensitive substring searches
+            if ns == 'Artist':
+                found |= self._artist.containing(tag)
+            elif ns in ('Language', 'Lang'):
+                found |= self._language.containing(tag)
+            elif ns == 'Title':
+                found |= self._title_candidates(tag)
+                return found, False
+            else:
+                return None, False
+        return found, True
+
+    def search(self, terms, args=[], cancelled=None, within=None):
+        """
+        Returns the set of galleries matching all terms, or None if all galleries match.
+        Pass a set of galleries as within to only search among them.
+        cancelled is called between terms, the search stops early with an incomplete result if it returns True.
+        """
+        self._update()
+        terms = [t for t in terms if t]
+        if not terms:
+            return None
+        # narrow down with the included terms first so excluded terms have less to check
+        terms = sorted(terms, key=lambda t: t[0] == '-')
+        result = within
+        for term in terms:
+            if cancelled and cancelled():
+                break
+            exclude = term[0] == '-'
+            key = term[1:] if exclude else term
+            if not key:
+                continue
+            candidates, exact = self._candidates(key, args)
+            within = self._galleries if result is None else result
+            if candidates is None:
+                candidates = within
+            elif result is not None:
+                candidates = candidates & result
+            if not exact:
+                match = search_query.compile_term(key, args)
+                candidates = {g for g in candidates if match(g)}
+            if exclude:
+                result = within - candidates
+            else:
+                result = candidates
+        return result
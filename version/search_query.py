@@ -0,0 +1,271 @@
+#"""
+#This file is part of Happypanda.
+#Happypanda is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 2 of the License, or
+#any later version.
+#Happypanda is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#You should have received a copy of the GNU General Public License
+#along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+#"""
+
+import functools
+import logging
+import re
+
+from dateutil import parser as dateparser
+
+import app_constants
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+# keyword namespaces searched in a text attribute of the gallery
+TEXT_KEYWORDS = {'Title': 'title', 'Language': 'language', 'Lang': 'language', 'Type': 'type',
+                 'Status': 'status', 'Artist': 'artist', 'Url': 'link', 'Descr': 'info', 'Description': 'info'}
+# keyword namespaces compared with a number, optionally prefixed with < or >
+NUMBER_KEYWORDS = {
+    'Chapter': lambda g: g.chapters.count(),
+    'Chapters': lambda g: g.chapters.count(),
+    'Read_count': lambda g: g.times_read,
+    'Read count': lambda g: g.times_read,
+    'Times_read': lambda g: g.times_read,
+    'Times read': lambda g: g.times_read,
+    'Rating': lambda g: g.rating,
+    'Stars': lambda g: g.rating,
+    }
+# keyword namespaces compared with a date, galleries without the date never match
+DATE_KEYWORDS = {
+    'Date_added': lambda g: g.date_added.date(),
+    'Date added': lambda g: g.date_added.date(),
+    'Pub_date': lambda g: g.pub_date.date() if g.pub_date else None,
+    'Publication': lambda g: g.pub_date.date() if g.pub_date else None,
+    'Pub date': lambda g: g.pub_date.date() if g.pub_date else None,
+    'Last_read': lambda g: g.last_read.date() if g.last_read else None,
+    'Last read': lambda g: g.last_read.date() if g.last_read else None,
+    }
+# what the 'none' and 'null' keywords match in a namespace
+NONE_KEYWORDS = {
+    'Tag': lambda g: not g.tags or len(g.tags) == 1 and 'default' in g.tags and not g.tags['default'],
+    'Artist': lambda g: not g.artist,
+    'Status': lambda g: not g.status or g.status == 'Unknown',
+    'Language': lambda g: not g.language,
+    'Url': lambda g: not g.link,
+    'Descr': lambda g: not g.info or g.info == 'No description..',
+    'Description': lambda g: not g.info or g.info == 'No description..',
+    'Type': lambda g: not g.type,
+    'Publication': lambda g: not g.pub_date,
+    'Pub_date': lambda g: not g.pub_date,
+    'Pub date': lambda g: not g.pub_date,
+    'Path': lambda g: g.dead_link,
+    }
+
+def text_matcher(needle, regex=False, case=False, strict=False):
+    """
+    Returns a function checking if needle is found in a string, like utils.search_term and utils.regex_search,
+    or None if needle can never be found
+    """
+    if not needle:
+        return None
+    if regex:
+        try:
+            pattern = re.compile(needle, 0 if case else re.IGNORECASE)
+        except re.error:
+            return None
+        search = pattern.search
+        return lambda s: bool(s) and search(s) is not None
+    if not case:
+        needle = needle.lower()
+        if strict:
+            return lambda s: bool(s) and s.lower() == needle
+        return lambda s: bool(s) and needle in s.lower()
+    if strict:
+        return lambda s: s == needle
+    return lambda s: bool(s) and needle in s
+
+def _compare_matcher(tag, get_value, date=False):
+    "Returns a function comparing a value of a gallery with tag, which can start with < or >"
+    op = None
+    if tag[:1] in ('<', '>'):
+        op, tag = tag[0], tag[1:]
+    try:
+        if date:
+            value = dateparser.parse(tag, dayfirst=True)
+            if value:
+                value = value.date()
+        else:
+            value = int(tag)
+    except (ValueError, OverflowError):
+        return None
+
+    def match(g):
+        attr = get_value(g)
+        if attr is None and date:
+            return False
+        try:
+            if op == '>':
+                return value < attr
+            elif op == '<':
+                return value > attr
+            return value == attr
+        except TypeError:
+            return False
+    return match
+
+def _keyword_matcher(ns, tag, regex):
+    "Returns a function checking the attribute of a gallery a keyword namespace stands for, or None"
+    if ns in TEXT_KEYWORDS:
+        # keyword searches are always case insensitive substring searches
+        match = text_matcher(tag, regex)
+        if match:
+            attr = TEXT_KEYWORDS[ns]
+            return lambda g: match(getattr(g, attr))
+        return None
+    if ns in NUMBER_KEYWORDS:
+        return _compare_matcher(tag, NUMBER_KEYWORDS[ns])
+    if ns in DATE_KEYWORDS:
+        return _compare_matcher(tag, DATE_KEYWORDS[ns], True)
+    return None
+
+def _any_tag(match):
+    return lambda g: any(match(t) for tags in g.tags.values() for t in tags)
+
+class Term:
+    """
+    A search term compiled to a predicate on galleries, with its needles lowered,
+    regexes compiled and dates and numbers parsed once instead of for every gallery.
+    Matches the same galleries as Gallery.contains with the same term and args.
+
+    exclude -> True if the term starts with -
+    key -> the term without the -
+    found -> checks if the key is found in a gallery, regardless of exclude
+    """
+    __slots__ = ('exclude', 'key', '_checks')
+
+    def __init__(self, term, args=()):
+        self.exclude = term[:1] == '-'
+        self.key = term[1:] if self.exclude else term
+        self._checks = self._compile(self.key, args) if self.key else []
+
+    @staticmethod
+    def _compile(key, args):
+        regex = app_constants.Search.Regex in args
+        case = app_constants.Search.Case in args
+        strict = app_constants.Search.Strict in args
+        checks = []
+        if not ':' in key:
+            match = text_matcher(key, regex, case, strict)
+            if match:
+                checks.append(lambda g: (g.title and match(g.title)) or (g.artist and match(g.artist)) or \
+                    (g.language and match(g.language)))
+            # tags are always case insensitive
+            tag_match = text_matcher(key, regex, False, strict)
+            if tag_match:
+                checks.append(_any_tag(tag_match))
+            return checks
+
+        parts = key.split(':')
+        # only namespace is lowered and capitalized
+        ns = parts[0].lower().capitalize()
+        tag = parts[1]
+        tag_match = text_matcher(tag, regex, False, strict)
+        if not ns:
+            if tag_match:
+                checks.append(_any_tag(tag_match))
+            return checks
+
+        if tag in ('none', 'null') and ns in NONE_KEYWORDS:
+            checks.append(NONE_KEYWORDS[ns])
+        keyword = _keyword_matcher(ns, tag, regex)
+        if keyword:
+            checks.append(keyword)
+        if tag_match:
+            if regex:
+                # the namespace is a pattern too
+                ns_match = text_matcher(ns, True)
+                if ns_match:
+                    checks.append(lambda g: any(tag_match(t) for x, tags in g.tags.items() if ns_match(x)
+                                                for t in tags))
+            else:
+                checks.append(lambda g: ns in g.tags and any(tag_match(t) for t in g.tags[ns]))
+        return checks
+
+    def found(self, gallery):
+        "Checks if the key is found in the gallery"
+        for check in self._checks:
+            if check(gallery):
+                return True
+        return False
+
+    def __call__(self, gallery):
+        return self.found(gallery) != self.exclude
+
+class Query:
+    """
+    All terms of a search, a gallery matches if it matches every term.
+
+    terms -> the compiled terms
+    """
+
+    def __init__(self, terms, args=()):
+        self.terms = [compile_term(t, args) for t in terms if t]
+
+    def __call__(self, gallery):
+        for term in self.terms:
+            if not term(gallery):
+                return False
+        return True
+
+@functools.lru_cache(maxsize=1024)
+def _cached_term(term, args):
+    return Term(term, args)
+
+def compile_term(term, args=()):
+    "Returns the compiled Term of a search term, the same term and args are only compiled once"
+    return _cached_term(term, frozenset(args))
+
+def compile_query(terms, args=()):
+    "Returns a Query of the terms returned by utils.get_terms"
+    return Query(terms, args)
+
+def _narrows(term, old, case):
+    "Checks if term only matches galleries old matches too, because it extends the text old looks for"
+    if term[:1] == '-':
+        return False
+    if not ':' in old:
+        if ':' in term:
+            return False
+        return old in term if case else old.lower() in term.lower()
+    old_parts = old.split(':')
+    parts = term.split(':')
+    if len(parts) < 2:
+        return False
+    ns = parts[0].lower().capitalize()
+    old_tag, tag = old_parts[1].lower(), parts[1].lower()
+    # numbers, dates and the none keywords don't match by substring
+    if ns != old_parts[0].lower().capitalize() or ns in NUMBER_KEYWORDS or ns in DATE_KEYWORDS or \
+            {tag, old_tag} & {'none', 'null'}:
+        return False
+    return bool(old_tag) and old_tag in tag
+
+def refines(terms, old_terms, args=()):
+    """
+    Checks if the galleries matching terms are a subset of the ones matching old_terms, judging by the terms alone.
+    That's the case when every old term is still there or was only made longer, like when typing in the search bar.
+    """
+    # a longer regex can match more, and a longer strict term matches something else
+    extendable = not (app_constants.Search.Regex in args or app_constants.Search.Strict in args)
+    case = app_constants.Search.Case in args
+    for old in old_terms:
+        if old in terms:
+            continue
+        if old[:1] == '-' or not extendable or not any(_narrows(t, old, case) for t in terms):
+            return False
+    return True
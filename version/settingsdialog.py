@@ -31,6 +31,8 @@ class SettingsDialog(QWidget):
     "A settings dialog"
     scroll_speed_changed = pyqtSignal()
     init_gallery_rebuild = pyqtSignal(bool)
+    init_archive_check = pyqtSignal(bool)
+    init_hash_backfill = pyqtSignal()
     init_gallery_eximport = pyqtSignal(object)
     def __init__(self, parent=None):
         super().__init__(parent, flags=Qt.Window)
@@ -583,6 +585,8 @@ class SettingsDialog(QWidget):
         # Advanced / Database
         app_constants.DATABASE_STARTUP_FETCH_LIMIT = self.advanced_dbstartup_fetch_limit_spinbox.value()
         set(app_constants.DATABASE_STARTUP_FETCH_LIMIT, 'Application', 'db startup fetch limit')
+        app_constants.STARTUP_SNAPSHOT = self.advanced_dbstartup_snapshot.isChecked()
+        set(app_constants.STARTUP_SNAPSHOT, 'Application', 'startup snapshot')
 
         # About / DB Overview
 
@@ -1323,6 +1327,63 @@ class SettingsDialog(QWidget):
         advanced_gallery_m_l.addRow(rebuild_thumbs_info)
         advanced_gallery_m_l.addRow(rebuild_thumbs_btn)
 
+        def verify_archives():
+            recheck_msg = QMessageBox(QMessageBox.Question, '',
+                                      'Do you also want to check archives which have already been checked and have not changed since?',
+                                      QMessageBox.Yes | QMessageBox.No, self)
+            recheck = recheck_msg.exec() == QMessageBox.Yes
+            parent = self.parent_widget
+            app_spinner = misc.Spinner(parent)
+            app_spinner.set_size(60)
+            app_spinner.set_text("Archives")
+            app_spinner.admin_db = gallerydb.AdminDB()
+            app_spinner.admin_db.moveToThread(app_constants.GENERAL_THREAD)
+            app_spinner.admin_db.DONE.connect(app_spinner.admin_db.deleteLater)
+            app_spinner.admin_db.DONE.connect(app_spinner.before_hide)
+            def report(corrupt):
+                if not corrupt:
+                    app_constants.NOTIF_BAR.add_text('No corrupt archives found')
+                    return
+                msg = QMessageBox(QMessageBox.Warning, 'Corrupt archives', '{} corrupt archives found'.format(len(corrupt)),
+                                  QMessageBox.Ok, parent)
+                msg.setDetailedText('\n'.join('{}: {}'.format(p, f) for p, f in corrupt))
+                msg.exec()
+            app_spinner.admin_db.CORRUPT_ARCHIVES.connect(report)
+            self.init_archive_check.connect(app_spinner.admin_db.verify_archives)
+            self.init_archive_check.emit(recheck)
+            app_spinner.show()
+
+        verify_archives_info = QLabel("Checks the archives of your galleries for corrupt files in the background, which can take a while.")
+        verify_archives_btn = QPushButton('Verify Archives')
+        verify_archives_btn.adjustSize()
+        verify_archives_btn.setFixedWidth(verify_archives_btn.width())
+        verify_archives_btn.clicked.connect(verify_archives)
+        advanced_gallery_m_l.addRow(verify_archives_info)
+        advanced_gallery_m_l.addRow(verify_archives_btn)
+
+        def backfill_hashes():
+            app_spinner = misc.Spinner(self.parent_widget)
+            app_spinner.set_size(60)
+            app_spinner.set_text("Hashes")
+            app_spinner.admin_db = gallerydb.AdminDB()
+            app_spinner.admin_db.moveToThread(app_constants.GENERAL_THREAD)
+            app_spinner.admin_db.DONE.connect(app_spinner.admin_db.deleteLater)
+            app_spinner.admin_db.DONE.connect(app_spinner.before_hide)
+            app_spinner.admin_db.DONE.connect(lambda: app_constants.NOTIF_BAR.add_text('Finished generating gallery hashes'))
+            self.init_hash_backfill.connect(app_spinner.admin_db.backfill_hashes)
+            self.init_hash_backfill.emit()
+            app_spinner.show()
+
+        backfill_hashes_info = QLabel("Generates the missing page hashes of your galleries in the background. Hashes are used to find duplicates, similar galleries and metadata. "+
+                                      "Stopping Happypanda halts it, it continues where it left off the next time.")
+        backfill_hashes_info.setWordWrap(True)
+        backfill_hashes_btn = QPushButton('Generate Hashes')
+        backfill_hashes_btn.adjustSize()
+        backfill_hashes_btn.setFixedWidth(backfill_hashes_btn.width())
+        backfill_hashes_btn.clicked.connect(backfill_hashes)
+        advanced_gallery_m_l.addRow(backfill_hashes_info)
+        advanced_gallery_m_l.addRow(backfill_hashes_btn)
+
 
         # Advanced / Gallery / Gallery Renamer
         g_data_fixer_group, g_data_fixer_l =  groupbox('Gallery Renamer', QFormLayout, advanced_gallery)
@@ -1421,6 +1482,12 @@ class SettingsDialog(QWidget):
                                                           'Higher number means faster loading. 0 means no limit, but the app may appear stuck for a few seconds.\n' \
                                                           'DEFAULT: 1000')
         advanced_dbstartup_l.addRow('Startup gallery fetch limit:', self.advanced_dbstartup_fetch_limit_spinbox)
+        self.advanced_dbstartup_snapshot = QCheckBox('Keep a snapshot of the library for faster startup', advanced_db_page)
+        self.advanced_dbstartup_snapshot.setChecked(app_constants.STARTUP_SNAPSHOT)
+        self.advanced_dbstartup_snapshot.setToolTip('Galleries are loaded from a snapshot file next to the database\n' \
+                                                    'as long as the database hasn\'t changed since it was taken.\n' \
+                                                    'DEFAULT: On')
+        advanced_dbstartup_l.addRow(self.advanced_dbstartup_snapshot)
 
 
         # About
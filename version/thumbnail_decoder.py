@@ -0,0 +1,35 @@
+#"""
+#This file is part of Happypanda.
+#Happypanda is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 2 of the License, or
+#any later version.
+#Happypanda is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#You should have received a copy of the GNU General Public License
+#along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+#"""
+
+# Runs in the thumbnail worker processes, keep it free of Qt and app imports.
+
+import io
+
+from PIL import Image
+
+def decode_thumbnail(img_path, width, height):
+    """
+    Decodes the image at img_path, or in the given bytes, scaled down to fit in width x height.
+    JPEGs are decoded at a reduced scale right away with draft(), other formats
+    are shrunk with reduce() before the final resampling.
+    Returns a tuple of the resulting width, height and RGBA bytes.
+    """
+    if isinstance(img_path, (bytes, bytearray)):
+        img_path = io.BytesIO(img_path)
+    with Image.open(img_path) as im:
+        im.draft('RGB', (width, height))
+        # thumbnail() only ever shrinks and uses reduce() for the bulk of it
+        im.thumbnail((width, height), Image.LANCZOS, reducing_gap=2.0)
+        im = im.convert('RGBA')
+        return im.size[0], im.size[1], im.tobytes()
@@ -0,0 +1,133 @@
+#"""
+#This file is part of Happypanda.
+#Happypanda is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 2 of the License, or
+#any later version.
+#Happypanda is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#You should have received a copy of the GNU General Public License
+#along with Happypanda.  If not, see <http://www.gnu.org/licenses/>.
+#"""
+
+import hashlib
+import logging
+import os
+import re
+import time
+
+from database import db_constants
+import app_constants
+
+log = logging.getLogger(__name__)
+log_i = log.info
+log_d = log.debug
+log_w = log.warning
+log_e = log.error
+log_c = log.critical
+
+class ThumbnailStore:
+    """
+    Content-addressed store for generated thumbnails in the thumbnail directory.
+    Thumbnails are named after a fingerprint of their source image and their size,
+    so the same image is only scaled once, no matter how many galleries use it.
+    Entries are shared and must therefore not be deleted by galleries.
+    Unused entries are kept for reuse and evicted least recently used first
+    once they take up more than THUMBNAIL_STORE_SIZE.
+
+    fingerprint -> returns the fingerprint of an image file or image bytes
+    entry_path -> returns the path of the entry for a fingerprint and size
+    lookup -> returns the path of an existing entry and marks it as used
+    is_entry -> checks if a path is an entry in the store
+    collect_garbage <- removes unused files from the thumbnail directory
+    """
+    _ENTRY_NAME = re.compile(r'^[0-9a-f]{40}-\d+x\d+\.png$')
+    # temporary files older than this are leftovers of interrupted writes
+    _TEMP_AGE = 60 * 60
+
+    @staticmethod
+    def fingerprint(img_path):
+        "Returns the fingerprint of the image file at the given path, or of the given image bytes"
+        if isinstance(img_path, (bytes, bytearray, memoryview)):
+            return hashlib.sha1(img_path).hexdigest()
+        sha1 = hashlib.sha1()
+        with open(img_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    @staticmethod
+    def entry_path(fingerprint, width, height):
+        "Returns the path of the entry for the given fingerprint and thumbnail size"
+        return os.path.join(db_constants.THUMBNAIL_PATH, '{}-{}x{}.png'.format(fingerprint, width, height))
+
+    @classmethod
+    def lookup(cls, fingerprint, width, height):
+        "Returns the path of the entry if it exists, else None"
+        path = cls.entry_path(fingerprint, width, height)
+        try:
+            # the modification time is used to find the least recently used entries
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    @classmethod
+    def is_entry(cls, path):
+        "Checks if the given path is an entry in the store"
+        if not path:
+            return False
+        head, tail = os.path.split(os.path.abspath(path))
+        return os.path.normcase(head) == os.path.normcase(os.path.abspath(db_constants.THUMBNAIL_PATH)) and \
+            bool(cls._ENTRY_NAME.match(tail))
+
+    @classmethod
+    def collect_garbage(cls, used_paths, max_size=None):
+        """
+        Reconciles the thumbnail directory with the given paths of thumbnails in use.
+        Files that aren't entries, like thumbnails from older versions, are removed if unused.
+        Unused entries are kept up to max_size mib, least recently used are removed first.
+        Returns the amount of removed files.
+        """
+        if max_size is None:
+            max_size = app_constants.THUMBNAIL_STORE_SIZE
+        if not os.path.isdir(db_constants.THUMBNAIL_PATH):
+            return 0
+        used = {os.path.normcase(os.path.abspath(p)) for p in used_paths if p}
+        unused_entries = []
+        removed = 0
+        now = time.time()
+        for f in os.scandir(db_constants.THUMBNAIL_PATH):
+            if not f.is_file() or os.path.normcase(os.path.abspath(f.path)) in used:
+                continue
+            try:
+                stat = f.stat()
+            except FileNotFoundError:
+                continue
+            if cls._ENTRY_NAME.match(f.name):
+                unused_entries.append((stat.st_mtime, stat.st_size, f.path))
+            elif f.name.endswith('.tmp') and now - stat.st_mtime < cls._TEMP_AGE:
+                continue
+            else:
+                removed += cls._remove(f.path)
+
+        kept_size = 0
+        for mtime, size, path in sorted(unused_entries, reverse=True):
+            kept_size += size
+            if kept_size > max_size * 1024 * 1024:
+                removed += cls._remove(path)
+        log_i('Removed {} unused thumbnails'.format(removed))
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return 0
+        except OSError:
+            log.exception('Failed to remove thumbnail {}'.format(os.path.split(path)[1]))
+            return 0
+        return 1
@@ -30,8 +30,14 @@ import functools
 import time
 import traceback
 import enum
+import io
+import mmap
+import struct
+import collections
+import threading
 
 import py7zr
+import py7zr.io
 from PIL import Image, ImageChops
 
 from PyQt5.QtGui import QImage, qRgba
@@ -46,6 +52,10 @@ log_w = log.warning
 log_e = log.error
 log_c = log.critical
 
+# enough of an image file to read its dimensions from the header
+IMAGE_HEADER_SIZE = 64 * 1024
+# read size when hashing files
+HASH_BUFFER_SIZE = 1024 * 1024
 
 def init_utils():
     global IMG_FILES
@@ -81,7 +91,7 @@ def init_utils():
 
 
 class GMetafile:
-    def __init__(self, path=None, archive=''):
+    def __init__(self, path=None, archive='', names=None):
         self.metadata = {
             "title":'',
             "artist":'',
@@ -97,15 +107,25 @@ class GMetafile:
         if path is None: return
 
         if archive:
-            zip = ArchiveFile(archive)
-            c = zip.dir_contents(path)
-            for x in c:
-                if x.endswith(app_constants.GALLERY_METAFILE_KEYWORDS):
-                    self.files.append(open(zip.extract(x), encoding='utf-8'))
+            # archive can be a path or an already open ArchiveFile
+            zip = archive if isinstance(archive, ArchiveFile) else ArchiveFile(archive)
+            try:
+                c = zip.dir_contents(path)
+                for x in c:
+                    if x.endswith(app_constants.GALLERY_METAFILE_KEYWORDS):
+                        f = io.StringIO(str(zip.read(x), 'utf-8'), newline=None) # same newlines as open()
+                        f.name = x
+                        self.files.append(f)
+            finally:
+                if zip is not archive:
+                    zip.close()
         else:
-            for p in os.scandir(path):
-                if p.name in app_constants.GALLERY_METAFILE_KEYWORDS:
-                    self.files.append(open(p.path, encoding='utf-8'))
+            # names of the files in the folder can be given if it was already listed
+            if names is None:
+                names = [p.name for p in os.scandir(path)]
+            for name in names:
+                if name in app_constants.GALLERY_METAFILE_KEYWORDS:
+                    self.files.append(open(os.path.join(path, name), encoding='utf-8'))
 
         if self.files:
             self.detect()
@@ -399,10 +419,13 @@ def b_search(data, key):
 
 def generate_img_hash(src):
     """
-    Generates sha1 hash based on the given bytes.
+    Generates sha1 hash based on the given bytes or file-like object.
     Returns hex-digits
     """
-    chunk = 8129
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return hashlib.sha1(src).hexdigest()
+    # large reads, hashlib releases the GIL for them
+    chunk = HASH_BUFFER_SIZE
     sha1 = hashlib.sha1()
     buffer = src.read(chunk)
     log_d("Generating hash")
@@ -411,6 +434,19 @@ def generate_img_hash(src):
         buffer = src.read(chunk)
     return sha1.hexdigest()
 
+def hash_file(path):
+    "Returns the same hash as generate_img_hash for the file at path, read into one reused buffer"
+    sha1 = hashlib.sha1()
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            sha1.update(view[:n])
+    return sha1.hexdigest()
+
 
 class ArchiveType(enum.IntEnum):
     NONE = 0
@@ -419,13 +455,166 @@ class ArchiveType(enum.IntEnum):
     SEVENZIP = 3
 
 
+class ArchiveIndex:
+    """
+    The directory tree and file sizes of an archive, built once from its member list.
+    Indexes are cached for the whole process, keyed by the path, modification time and size
+    of the archive, so opening the same archive again doesn't rescan its members.
+
+    get -> returns the cached index of an open ArchiveFile, builds it if needed
+    contains -> checks if name is a member of the archive
+    is_dir -> checks if member name is a directory
+    children -> returns the direct files and subdirectories of a directory
+    dirs -> returns all directories or only top-level ones
+    """
+    MAX_CACHED = 256
+    _cache = collections.OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self, names: list[str], dirs: set[str], sizes: dict[str, int] = None):
+        self.names = names
+        self.sizes = sizes or {}
+        self._members = set(names)
+        self._dirs = dirs
+        self._all_dirs = []
+        self._top_dirs = []
+        self._children = collections.defaultdict(list)
+        for name in names:
+            # zip directories end with a '/', rar and 7z directories don't
+            parent = name.rstrip('/').rpartition('/')[0]
+            self._children[parent].append(name)
+            if name in dirs:
+                self._all_dirs.append(name)
+                if not parent:
+                    self._top_dirs.append(name)
+
+    @classmethod
+    def _build(cls, archive_file: 'ArchiveFile') -> 'ArchiveIndex':
+        archive = archive_file.archive
+        if archive_file.type == ArchiveType.SEVENZIP:
+            files = list(archive.files)
+            return cls([f.filename for f in files], {f.filename for f in files if f.is_directory},
+                       {f.filename: f.uncompressed for f in files})
+        infos = archive.infolist()
+        if archive_file.type == ArchiveType.RAR:
+            dirs = {f.filename for f in infos if f.isdir()}
+        else:
+            dirs = {f.filename for f in infos if f.filename.endswith('/')}
+        return cls([f.filename for f in infos], dirs, {f.filename: f.file_size for f in infos})
+
+    @classmethod
+    def get(cls, archive_file: 'ArchiveFile') -> 'ArchiveIndex':
+        "Returns the index of the given open ArchiveFile"
+        try:
+            stat = os.stat(archive_file.filepath)
+        except OSError:
+            return cls._build(archive_file)
+        key = (os.path.abspath(archive_file.filepath), stat.st_mtime_ns, stat.st_size)
+        with cls._cache_lock:
+            index = cls._cache.get(key)
+            if index is not None:
+                cls._cache.move_to_end(key)
+                return index
+        index = cls._build(archive_file)
+        with cls._cache_lock:
+            cls._cache[key] = index
+            while len(cls._cache) > cls.MAX_CACHED:
+                cls._cache.popitem(last=False)
+        return index
+
+    def contains(self, name: str) -> bool:
+        return name in self._members
+
+    def is_dir(self, name: str) -> bool:
+        return name in self._dirs
+
+    def children(self, dir_name: str) -> list[str]:
+        return list(self._children.get(dir_name.rstrip('/'), ()))
+
+    def dirs(self, only_top_level: bool = False) -> list[str]:
+        return list(self._top_dirs if only_top_level else self._all_dirs)
+
+class _ScanWriter(py7zr.io.Py7zIO):
+    """
+    Receives a file from a 7z archive while it's decompressed, see ArchiveFile.scan.
+    The file is hashed and its content or first bytes are kept, as asked for.
+    """
+
+    def __init__(self, hash: bool, keep: bool, head_size: int, on_done: Callable[[], None] | None = None):
+        self.sha1 = hashlib.sha1() if hash else None
+        self.buffer = io.BytesIO() if keep else None
+        self.head = bytearray()
+        self.head_size = head_size
+        self.on_done = on_done
+        self._size = 0
+
+    def write(self, s: bytes | bytearray) -> int:
+        if self.sha1 is not None:
+            self.sha1.update(s)
+        if self.buffer is not None:
+            self.buffer.write(s)
+        if len(self.head) < self.head_size:
+            self.head += s[:self.head_size - len(self.head)]
+        self._size += len(s)
+        return len(s)
+
+    def read(self, size: int | None = None) -> bytes:
+        return self.buffer.getvalue() if self.buffer is not None else b''
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return 0
+
+    def flush(self) -> None:
+        pass
+
+    def size(self) -> int:
+        return self._size
+
+    def close(self) -> None:
+        # called by py7zr once the file is fully decompressed
+        on_done, self.on_done = self.on_done, None
+        if on_done is not None:
+            on_done()
+
+class _ScanWriterFactory(py7zr.io.WriterFactory):
+    """
+    Creates a _ScanWriter for every file decompressed from a 7z archive.
+    If done is given, it's called with the name and writer of every file once it's complete.
+    """
+
+    def __init__(self, hash: set[str], keep: set[str], heads: set[str], head_size: int,
+                 done: Callable[[str, _ScanWriter], None] | None = None):
+        self.hash = hash
+        self.keep = keep
+        self.heads = heads
+        self.head_size = head_size
+        self.done = done
+        self.products: dict[str, _ScanWriter] = {}
+
+    def create(self, filename: str) -> py7zr.io.Py7zIO:
+        product = _ScanWriter(filename in self.hash, filename in self.keep,
+                              self.head_size if filename in self.heads else 0)
+        if self.done is not None:
+            product.on_done = lambda: self.done(filename, product)
+        self.products[filename] = product
+        return product
+
 class ArchiveFile():
     """
     Work with archive files. Raises exception if instance fails.
 
     namelist -> returns a list with all files in archive
+    is_dir -> checks if a file in archive is a directory
+    dir_list -> returns a list of directories in archive
+    dir_contents -> returns the files and directories in a directory
     extract -> Extracts one specific file to given path
     open -> open the given file in archive, returns bytes
+    read -> returns the content of a file in archive without extracting it
+    read_many -> returns the contents of many files in archive
+    read_each -> passes the contents of many files in archive to a callback one at a time
+    scan -> hashes or reads the start of many files in archive without keeping them in memory
+    file_size -> returns the uncompressed size of a file in archive
+    test -> checks the archive for corrupt files
     close -> close archive
     """
     zip, rar, sevenzip = range(3)
@@ -435,30 +624,29 @@ class ArchiveFile():
         self.type : ArchiveType = ArchiveType.NONE
         self.filepath = os.path.normcase(filepath)
         self.archive = None
+        self.index : ArchiveIndex = None
+        self._mmap = None
 
         file_ext = os.path.splitext(filepath)[1].lower()
         try:
+            # only the list of members is read here, use test to check the archive for corruption
             if filepath.endswith(ARCHIVE_FILES):
                 if file_ext in ZIP_FILES:
                     self.type = ArchiveType.ZIP
                     self.reopen()
-                    b_f = self.archive.testzip()
 
                 elif SUPPORT_RAR and file_ext in RAR_FILES:
                     self.type = ArchiveType.RAR
                     self.reopen()
-                    b_f = self.archive.testrar()
 
                 elif file_ext in SEVENZIP_FILES:
+                    # kept open so the archive header is only parsed once
                     self.type = ArchiveType.SEVENZIP
-                    with self.reopen():
-                        b_f = self.archive.testzip()
+                    self.reopen()
 
-                # test for corruption
-                if b_f:
-                    log_w(f'Bad file found in archive {filepath}: {b_f}')
-                    self.close()
+                else:
                     raise app_constants.CreateArchiveFail
+                self.index = ArchiveIndex.get(self)
             else:
                 log_e('Archive: Unsupported file format')
                 self.close()
@@ -475,11 +663,7 @@ class ArchiveFile():
         self.close()
 
     def namelist(self) -> list[str]:
-        if self.type == ArchiveType.SEVENZIP:
-            with self.reopen():
-                return self.archive.namelist()
-
-        return self.archive.namelist()
+        return list(self.index.names)
 
     def is_dir(self, name: str) -> bool:
         """
@@ -487,89 +671,29 @@ class ArchiveFile():
         """
         if not name: return False
         
-        if not name in self.namelist():
+        if not self.index.contains(name):
             log_e(f'File {name} not found in archive')
             raise app_constants.FileNotFoundInArchive
-        
-        if self.type == ArchiveType.ZIP:
-            return name.endswith('/')
 
-        if self.type == ArchiveType.RAR:
-            return self.archive.getinfo(name).isdir()
-
-        if self.type == ArchiveType.SEVENZIP:
-            with self.reopen():
-                # py7zr returns directories without a '/' and there's no simpler way that I could find
-                for f in self.archive.files:
-                    if f.filename == name:
-                        return f.is_directory
-                return False
-
-        return False
+        return self.index.is_dir(name)
 
     def dir_list(self, only_top_level: bool = False) -> list[str]:
         """
         Returns a list of all directories found recursively. For directories not in toplevel
         a path in the archive to the diretory will be returned.
         """
-        if only_top_level:
-            if self.type == ArchiveType.ZIP:
-                return [f for f in self.namelist() if f.endswith('/') and f.count('/') == 1]
-                
-            if self.type == ArchiveType.RAR:
-                potential_dirs = [f for f in self.namelist() if f.count('/') == 0]
-                return [f.filename for f in [self.archive.getinfo(d) for d in potential_dirs] if f.isdir()]
-
-            if self.type == ArchiveType.SEVENZIP:
-                with self.reopen():
-                    return [f.filename for f in self.archive.files if (f.is_directory and '/' not in f.filename)]
-        else:
-            if self.type == ArchiveType.ZIP:
-                return [f for f in self.namelist() if f.endswith('/')]
-
-            if self.type == ArchiveType.RAR:
-                return [f.filename for f in self.archive.infolist() if f.isdir()]
-
-            if self.type == ArchiveType.SEVENZIP:
-                with self.reopen():
-                    return [f.filename for f in self.archive.files if f.is_directory]
+        return self.index.dirs(only_top_level)
 
     def dir_contents(self, dir_name: str) -> list[str]:
         """
         Returns a list of contents in the directory (files and direct subdirectories).
         An empty string will return the top-level contents.
         """
-        if dir_name and not dir_name in self.namelist():
+        if dir_name and not self.index.contains(dir_name):
             log_e(f'Directory {dir_name} not found in archive')
             raise app_constants.FileNotFoundInArchive
 
-        if not dir_name:
-            # top-level contents
-            if self.type == ArchiveType.ZIP:
-                return [f for f in self.namelist() if f.count('/') == 0 or (f.count('/') == 1 and f.endswith('/'))]
-
-            if self.type == ArchiveType.RAR:
-                return [f for f in self.namelist() if f.count('/') == 0]
-
-            if self.type == ArchiveType.SEVENZIP:
-                with self.reopen():
-                    return [f for f in self.namelist() if f.count('/') == 0]
-
-        # contents of a directory
-        if self.type == ArchiveType.ZIP:
-            dir_con_start = [f for f in self.namelist() if f.startswith(dir_name)]
-            return [f for f in dir_con_start if f.count('/') == dir_name.count('/') and \
-                (f.count('/') == dir_name.count('/') and not f.endswith('/')) or \
-                (f.count('/') == 1 + dir_name.count('/') and f.endswith('/'))]
-
-        if self.type == ArchiveType.RAR:
-            return [f for f in self.namelist() if f.startswith(dir_name) and f.count('/') == 1 + dir_name.count('/')]
-
-        if self.type == ArchiveType.SEVENZIP:
-            with self.reopen():
-                return [f for f in self.namelist() if f.startswith(dir_name) and f.count('/') == 1 + dir_name.count('/')]
-
-        return []
+        return self.index.children(dir_name)
 
     def extract(self, file_or_dir: str, path: str = None) -> str:
         """
@@ -586,7 +710,7 @@ class ArchiveFile():
     
         if self.type == ArchiveType.ZIP:
             # if it's a directory: get all members of that directory
-            membs = [name for name in self.namelist() if (name.startswith(file_or_dir) and name != file_or_dir)]
+            membs = [name for name in self.index.names if (name.startswith(file_or_dir) and name != file_or_dir)]
             # but make sure to extract the directory itself first
             temp_p = self.archive.extract(file_or_dir, path)
             for m in membs:
@@ -597,16 +721,14 @@ class ArchiveFile():
             self.archive.extract(file_or_dir, path)
 
         elif self.type == ArchiveType.SEVENZIP:
-            with self.reopen():
-                # if it's a directory: get all members of that directory
-                membs = [name for name in self.archive.namelist() if (name.startswith(file_or_dir) and name != file_or_dir)]
-                # but make sure to extract the directory itself first
-                log_d(f'extract: {(path, file_or_dir) = }')
-                self.archive.extract(path, [file_or_dir])
-                temp_p = os.path.join(path, file_or_dir)
-                if membs:
-                    log_d(f'extract: {(path, membs) = }')
-                    self.archive.extract(path, membs)
+            # if it's a directory: get all members of that directory
+            membs = [name for name in self.index.names if (name.startswith(file_or_dir) and name != file_or_dir)]
+            log_d(f'extract: {(path, file_or_dir, membs) = }')
+            try:
+                self.archive.extract(path, [file_or_dir] + membs)
+            finally:
+                self.archive.reset()
+            temp_p = os.path.join(path, file_or_dir)
 
         return temp_p
 
@@ -623,8 +745,10 @@ class ArchiveFile():
             self.archive.extractall(path, member)
 
         if self.type == ArchiveType.SEVENZIP:
-            with self.reopen():
+            try:
                 self.archive.extractall(path)
+            finally:
+                self.archive.reset()
         else:
             self.archive.extractall(path)
 
@@ -636,20 +760,195 @@ class ArchiveFile():
         Returns bytes as the file content or, if fp is True, returns file-like object.
         """
         if self.type == ArchiveType.SEVENZIP:
-            fpath = self.extract(file_to_open)
-
-            if fp: return open(fpath, 'rb')
-
-            with open(fpath, 'rb') as f:
-                content = f.read()
-            os.remove(fpath)
+            content = self.read(file_to_open)
+            if fp: return io.BytesIO(content)
             return content
 
         if fp:
             return self.archive.open(file_to_open)
         return self.archive.open(file_to_open).read()
 
+    def _stored_zip_view(self, name: str) -> memoryview | None:
+        """
+        Returns a memoryview into a memory map of the archive for zip entries stored without compression,
+        else None. The central directory is already parsed by zipfile, only the local header is read here.
+        """
+        info = self.archive.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1: # encrypted
+            return None
+        if self._mmap is None:
+            with open(self.filepath, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = info.header_offset
+        if self._mmap[offset:offset + 4] != zipfile.stringFileHeader:
+            return None
+        # the lengths of the file name and extra field at the end of the 30 byte local header
+        name_len, extra_len = struct.unpack_from('<HH', self._mmap, offset + 26)
+        start = offset + 30 + name_len + extra_len
+        return memoryview(self._mmap)[start:start + info.compress_size]
+
+    def read(self, name: str) -> bytes | memoryview:
+        """
+        Returns the content of a file in the archive without extracting it to disk.
+        Uncompressed zip entries are returned as a memoryview of the memory mapped archive,
+        it's only valid until the archive is closed.
+        """
+        if self.type == ArchiveType.ZIP:
+            view = self._stored_zip_view(name)
+            if view is not None:
+                return view
+            return self.archive.read(name)
+
+        if self.type == ArchiveType.SEVENZIP:
+            return self.read_many([name])[name]
+
+        return self.archive.read(name)
+
+    def read_many(self, names: list[str]) -> dict[str, bytes | memoryview]:
+        """
+        Returns a dict of name and content of the given files in the archive, see read.
+        7z archives are decompressed in a single pass for all names.
+        """
+        if self.type != ArchiveType.SEVENZIP:
+            return {name: self.read(name) for name in names}
+
+        factory = py7zr.io.BytesIOFactory(sys.maxsize)
+        try:
+            self.archive.extract(targets=list(names), factory=factory)
+        finally:
+            self.archive.reset()
+        contents = {}
+        for name in names:
+            try:
+                product = factory.get(name)
+            except KeyError:
+                log_e(f'File {name} not found in archive')
+                raise app_constants.FileNotFoundInArchive
+            product.seek(0)
+            contents[name] = product.read()
+        return contents
+
+    def read_each(self, names: list[str], callback: Callable[[str, bytes], None]):
+        """
+        Calls callback with the name and content of each given file as soon as it's read,
+        so only the contents the callback holds on to are kept in memory.
+        7z archives are decompressed in a single pass for all files and the callback can be called from
+        py7zr's threads, in the order of the files in the archive.
+        """
+        names = list(dict.fromkeys(names))
+        if self.type != ArchiveType.SEVENZIP:
+            for name in names:
+                data = self.read(name)
+                callback(name, bytes(data))
+                del data
+            return
+
+        def done(name, product):
+            data = product.read()
+            # drops the content before the next file is decompressed
+            product.buffer = None
+            callback(name, data)
+
+        factory = _ScanWriterFactory(set(), set(names), set(), 0, done)
+        if names:
+            try:
+                self.archive.extract(targets=names, factory=factory)
+            finally:
+                self.archive.reset()
+        for name in names:
+            try:
+                product = factory.products[name]
+            except KeyError:
+                log_e(f'File {name} not found in archive')
+                raise app_constants.FileNotFoundInArchive
+            # older py7zr versions don't close the files they decompressed
+            product.close()
+
+    def scan(self, names: list[str], keep: list[str] = (), heads: list[str] = (),
+             head_size: int = IMAGE_HEADER_SIZE) -> tuple[dict[str, str], dict[str, bytes], dict[str, bytes]]:
+        """
+        Reads the given files in the archive one at a time, without holding more than asked for in memory.
+        Returns a tuple of a dict of name and hash of the files in names, like generate_img_hash,
+        a dict of name and content of the files in keep and
+        a dict of name and the first head_size bytes of the files in heads.
+        Files only in heads aren't read any further, except in 7z archives,
+        which are decompressed in a single pass for all files.
+        """
+        targets = list(dict.fromkeys([*names, *keep, *heads]))
+        hash_names = set(names)
+        keep = set(keep)
+        heads = set(heads)
+        hashes = {}
+        contents = {}
+        head_contents = {}
+        if self.type != ArchiveType.SEVENZIP:
+            for name in targets:
+                if name in hash_names or name in keep:
+                    data = self.read(name)
+                    if name in hash_names:
+                        hashes[name] = hashlib.sha1(data).hexdigest()
+                    if name in keep:
+                        contents[name] = bytes(data)
+                    if name in heads:
+                        head_contents[name] = bytes(data[:head_size])
+                    del data
+                else:
+                    with self.archive.open(name) as f:
+                        head_contents[name] = f.read(head_size)
+            return hashes, contents, head_contents
+
+        factory = _ScanWriterFactory(hash_names, keep, heads, head_size)
+        if targets:
+            try:
+                self.archive.extract(targets=targets, factory=factory)
+            finally:
+                self.archive.reset()
+        for name in targets:
+            try:
+                product = factory.products[name]
+            except KeyError:
+                log_e(f'File {name} not found in archive')
+                raise app_constants.FileNotFoundInArchive
+            if name in hash_names:
+                hashes[name] = product.sha1.hexdigest()
+            if name in keep:
+                contents[name] = product.read()
+            if name in heads:
+                head_contents[name] = bytes(product.head)
+        return hashes, contents, head_contents
+
+    def file_size(self, name: str) -> int:
+        "Returns the uncompressed size of a file in the archive"
+        return self.index.sizes.get(name, 0)
+
+    def test(self) -> str | None:
+        """
+        Decompresses every file in the archive and checks its CRC, which can take a while.
+        Returns the name of the first corrupt file or None if the archive is fine.
+        """
+        if self.type == ArchiveType.RAR:
+            try:
+                self.archive.testrar()
+            except rarfile.Error as e:
+                return str(e) or self.filepath
+            return None
+
+        if self.type == ArchiveType.SEVENZIP:
+            try:
+                return self.archive.testzip()
+            finally:
+                self.archive.reset()
+
+        return self.archive.testzip()
+
     def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # views returned by read are still in use, the map is closed when they're gone
+                pass
+            self._mmap = None
         try:
             if self.archive:
                 self.archive.close()
@@ -681,18 +980,40 @@ class ArchiveFile():
 
         return self.archive
 
+def verify_archive(archive_path):
+    """
+    Checks the archive for corruption.
+    Returns None if it's fine, else the name of the first corrupt file or a reason why it couldn't be checked
+    """
+    try:
+        with ArchiveFile(archive_path) as arch:
+            bad_file = arch.test()
+    except app_constants.CreateArchiveFail:
+        return 'Could not open archive'
+    except Exception as e:
+        log.exception(f'Could not check archive {archive_path}')
+        return str(e) or 'Could not check archive'
+    if bad_file:
+        log_w(f'Bad file found in archive {archive_path}: {bad_file}')
+    return bad_file
+
 def check_archive(archive_path):
     """
     Checks archive path for potential galleries.
     Returns a list with a path in archive to galleries
     if there is no directories
+    archive_path can also be an open ArchiveFile, it's left open
     """
+    if isinstance(archive_path, ArchiveFile):
+        return _check_archive(archive_path)
     try:
         zip = ArchiveFile(archive_path)
     except app_constants.CreateArchiveFail:
         return []
-    if not zip:
-        return []
+    with zip:
+        return _check_archive(zip)
+
+def _check_archive(zip):
     galleries = []
     zip_dirs = zip.dir_list()
     def gallery_eval(d):
@@ -713,11 +1034,9 @@ def check_archive(archive_path):
             r = gallery_eval(d)
             if r:
                 galleries.append(r)
-        zip.close()
     else: # all pages are in top folder
         if isinstance(gallery_eval(''), str):
             galleries.append('')
-        zip.close()
 
     return galleries
 
@@ -904,17 +1223,28 @@ def open_chapter(chapterpath, archive=None):
         app_constants.NOTIF_BAR.add_text("Could not open chapter for unknown reasons. Check happypanda.log!")
         log_e(f'Could not open chapter {os.path.split(chapterpath)[1]}')
 
-def get_gallery_img(gallery_or_path, chap_number=0):
+def get_gallery_img(gallery_or_path, chap_number=0, in_memory=False):
     """
     Returns a path to image in gallery chapter
+    If in_memory is True, images in archives are returned as bytes instead of being extracted
     """
     archive = None
+    first_img = None
     if isinstance(gallery_or_path, str):
         path = gallery_or_path
     else:
-        path = gallery_or_path.chapters[chap_number].path
+        chapter = gallery_or_path.chapters[chap_number]
+        path = chapter.path
         if gallery_or_path.is_archive:
             archive = gallery_or_path.path
+        # a saved manifest knows the first page without listing the chapter, reading a missing one
+        # would read every page, so the chapter is listed instead and the manifest is left for later
+        try:
+            manifest = chapter.get_manifest(saved_only=True)
+            if manifest and manifest.pages:
+                first_img = manifest.pages[0].name
+        except OSError:
+            log_w(f'Could not read the pages of {path}')
 
     # TODO: add chapter support
     try:
@@ -927,26 +1257,34 @@ def get_gallery_img(gallery_or_path, chap_number=0):
     if is_archive:
         try:
             log_i('Getting image from archive')
-            arc = ArchiveFile(real_path)
-            log_d(f'{arc = }')
-            temp_path = os.path.join(app_constants.temp_dir, str(uuid.uuid4()))
-            os.mkdir(temp_path)
-            log_d(f'{temp_path = }')
-            if not archive:
-                f_img_name = sorted([img for img in arc.namelist() if img.lower().endswith(IMG_FILES) and not img.startswith('.')])[0]
-            else:
-                f_img_name = sorted([img for img in arc.dir_contents(path) if img.lower().endswith(IMG_FILES) and not img.startswith('.')])[0]
-            log_d(f'{f_img_name = }')
-            img_path = arc.extract(f_img_name, temp_path)
-            log_d(f'{img_path = }')
-            arc.close()
+            with ArchiveFile(real_path) as arc:
+                log_d(f'{arc = }')
+                if first_img:
+                    f_img_name = first_img
+                elif not archive:
+                    f_img_name = sorted([img for img in arc.namelist() if img.lower().endswith(IMG_FILES) and not img.startswith('.')])[0]
+                else:
+                    f_img_name = sorted([img for img in arc.dir_contents(path) if img.lower().endswith(IMG_FILES) and not img.startswith('.')])[0]
+                log_d(f'{f_img_name = }')
+                if in_memory:
+                    return bytes(arc.read(f_img_name))
+                temp_path = os.path.join(app_constants.temp_dir, str(uuid.uuid4()))
+                os.mkdir(temp_path)
+                log_d(f'{temp_path = }')
+                img_path = arc.extract(f_img_name, temp_path)
+                log_d(f'{img_path = }')
         except app_constants.CreateArchiveFail:
             img_path = app_constants.NO_IMAGE_PATH
+        except Exception:
+            # archives aren't checked for corruption when opened, so it shows up here
+            log.exception(f'Could not read image from archive {real_path}')
+            img_path = app_constants.NO_IMAGE_PATH
     elif os.path.isdir(real_path):
         log_i('Getting image from folder')
-        first_img = sorted([img.name for img in os.scandir(real_path) if img.name.lower().endswith(tuple(IMG_FILES)) and not img.name.startswith('.')])
+        if not first_img:
+            first_img = next(iter(page_names(img.name for img in os.scandir(real_path))), None)
         if first_img:
-            img_path = os.path.join(real_path, first_img[0])
+            img_path = os.path.join(real_path, first_img)
 
     if img_path:
         return os.path.abspath(img_path)
@@ -1439,6 +1777,111 @@ def PToQImageHelper(im):
         'data': __data, 'im': im, 'format': format, 'colortable': colortable
     }
 
+def page_names(names):
+    "Returns the images in names sorted in page order, hidden files are left out"
+    return sorted(n for n in names if n.lower().endswith(IMG_FILES) and not os.path.basename(n).startswith('.'))
+
+# a page of a chapter, width and height are None if they couldn't be read from the image header
+PageInfo = collections.namedtuple('PageInfo', 'name size width height')
+# the pages of a chapter in order and the modification time of the chapter they were read at
+Manifest = collections.namedtuple('Manifest', 'mtime pages')
+
+def image_size(data):
+    "Returns the width and height of an image from its first bytes, or (None, None) if they can't be read"
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            return im.size
+    except Exception:
+        return None, None
+
+def chapter_archive(chapter):
+    "Returns the path to the archive the chapter is in or None if it's a folder"
+    if chapter.in_archive and chapter.gallery.is_archive:
+        return chapter.gallery.path
+    if chapter.path.endswith(ARCHIVE_FILES):
+        return chapter.path
+    return None
+
+def chapter_mtime(chapter):
+    "Returns the modification time of the folder or archive of a chapter, manifests are checked against it"
+    return os.stat(chapter_archive(chapter) or chapter.path).st_mtime_ns
+
+def _archive_dir(chapter, archive):
+    # chapters can be a directory in the archive or the whole archive
+    return chapter.path if archive.index.contains(chapter.path) else ''
+
+def _read_chapter(chapter, archive, hash_pages, cover):
+    """
+    Lists and reads the pages of a chapter in a single pass, see ingest_chapter.
+    Returns a tuple of the names of the files in the chapter, its Manifest, the page hashes
+    and the content of the first page.
+    """
+    hashes = {}
+    first_page = None
+    if archive is not None:
+        mtime = os.stat(archive.filepath).st_mtime_ns
+        names = archive.dir_contents(_archive_dir(chapter, archive))
+        pages = page_names(names)
+        hashed = pages if hash_pages is None else pages[:hash_pages]
+        keep = pages[:1] if cover else []
+        page_hashes, contents, heads = archive.scan(hashed, keep, pages)
+        hashes = {n: page_hashes[name] for n, name in enumerate(hashed)}
+        if keep:
+            first_page = contents[keep[0]]
+        infos = [PageInfo(name, archive.file_size(name), *image_size(heads[name])) for name in pages]
+    else:
+        mtime = os.stat(chapter.path).st_mtime_ns
+        names = [e.name for e in os.scandir(chapter.path) if e.is_file()]
+        pages = page_names(names)
+        hashed = pages if hash_pages is None else pages[:hash_pages]
+        infos = []
+        for n, name in enumerate(pages):
+            with open(os.path.join(chapter.path, name), 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if n < len(hashed) or n == 0 and cover:
+                    data = f.read()
+                    if n < len(hashed):
+                        hashes[n] = generate_img_hash(data)
+                    if n == 0 and cover:
+                        first_page = data
+                    head = data[:IMAGE_HEADER_SIZE]
+                    del data
+                else:
+                    # only the header is needed for the dimensions
+                    head = f.read(IMAGE_HEADER_SIZE)
+            infos.append(PageInfo(name, size, *image_size(head)))
+    return names, Manifest(mtime, infos), hashes, first_page
+
+def read_manifest(chapter):
+    """
+    Lists the pages of a chapter from its folder or archive and reads their size and dimensions,
+    the dimensions only from the image headers. Returns a Manifest
+    """
+    archive_path = chapter_archive(chapter)
+    if archive_path:
+        with ArchiveFile(archive_path) as archive:
+            return _read_chapter(chapter, archive, 0, False)[1]
+    return _read_chapter(chapter, None, 0, False)[1]
+
+def ingest_chapter(chapter, archive=None, hash_pages=None, cover=True):
+    """
+    Reads a chapter from its folder, or from its directory in the given open ArchiveFile, in a single pass.
+    Sets the page count, the manifest and the page hashes of the chapter.
+    hash_pages limits hashing to the first n pages, None hashes all of them.
+    Returns a tuple of the GMetafile of the chapter and the content of its first page,
+    which is None if there are no pages or cover is False.
+    """
+    names, manifest, hashes, first_page = _read_chapter(chapter, archive, hash_pages, cover)
+    if archive is not None:
+        metafile = GMetafile(_archive_dir(chapter, archive), archive)
+    else:
+        metafile = GMetafile(chapter.path, names=names)
+
+    chapter.pages = len(manifest.pages)
+    chapter.manifest = manifest
+    chapter.hashes = hashes or None
+    return metafile, first_page
+
 def make_chapters(gallery_object):
     chap_container = gallery_object.chapters
     path = gallery_object.path
@@ -1470,15 +1913,18 @@ def make_chapters(gallery_object):
         if path.endswith(ARCHIVE_FILES):
             gallery_object.is_archive = 1
             log_i("Gallery source is an archive")
-            archive_g = sorted(check_archive(path))
-            for g in archive_g:
-                chap = chap_container.create_chapter()
-                chap.path = g
-                chap.in_archive = 1
-                metafile.update(GMetafile(g, path))
-                arch = ArchiveFile(path)
-                chap.pages = len(arch.dir_contents(g))
-                arch.close()
+            try:
+                # opened once for all chapters
+                with ArchiveFile(path) as arch:
+                    archive_g = sorted(check_archive(arch))
+                    for g in archive_g:
+                        chap = chap_container.create_chapter()
+                        chap.path = g
+                        chap.in_archive = 1
+                        metafile.update(GMetafile(g, arch))
+                        chap.pages = len(arch.dir_contents(g))
+            except app_constants.CreateArchiveFail:
+                log_w(f'Could not open archive {path}')
 
     metafile.apply_gallery(gallery_object)
 